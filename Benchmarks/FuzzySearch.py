@@ -0,0 +1,101 @@
+"""
+Measures fuzzy search over a large synthetic database: the time to build the FuzzyIndex and the time a
+query takes, against the exact search over OcrBlockFts
+
+Run from the Benchmarks folder: python FuzzySearch.py [blocks] [distinct words]
+"""
+import sys
+sys.path.append("..")  # When launching from source, include StudiOCR folder
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from StudiOCR.db import init_database, set_image_store, create_tables, read_only, search_document_ids
+from StudiOCR.FuzzyIndex import FuzzyIndex
+from StudiOCR.ImageStore import FileImageStore
+from StudiOCR.OcrEngine import OcrEngine
+from StudiOCR.OcrPageData import OcrPageData
+
+IMAGE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                     '..', 'Image_Preprocessing_Optimization', 'image_src', 'b_1.jpg')
+WORDS_PER_PAGE = 500
+PAGES_PER_DOCUMENT = 100
+# Searched for. Every other document has them misread, the kind of error OCR makes, which only fuzzy search finds.
+QUERIES = ['algorithm', 'modern', 'binary', 'lecture', 'theorem', 'eigenvalue', 'tree']
+MISREAD = {'algorithm': 'a1gorithm', 'modern': 'modem', 'binary': 'binarv', 'lecture': 'lectnre',
+           'theorem': 'tbeorem', 'eigenvalue': 'eigenva1ue', 'tree': 'trce'}
+
+
+def vocabulary(words: int, rng: np.random.Generator) -> list:
+    """Random words of 2 to 12 letters, most common first"""
+    letters = np.array(list('etaoinshrdlcumwfgypbvkjxqz'))
+    # Roughly the letter frequencies of English
+    weights = 1 / np.arange(1, len(letters) + 1)
+    weights /= weights.sum()
+    lengths = rng.integers(2, 13, size=words)
+    return [''.join(rng.choice(letters, size=length, p=weights)) for length in lengths]
+
+
+def synthetic_document(words: list, pages: int, misread: bool, rng: np.random.Generator) -> list:
+    """
+    commit_data input for a document of pages copies of IMAGE, with words drawn by a Zipf distribution.
+    A word of each page is one of the QUERIES, or its misreading if misread.
+    """
+    planted = [MISREAD[query] for query in QUERIES] if misread else QUERIES
+    image = open(IMAGE, 'rb').read()
+    data = []
+    for idx in range(pages):
+        ranks = np.minimum(rng.zipf(1.2, size=WORDS_PER_PAGE), len(words)) - 1
+        text = [words[rank] for rank in ranks]
+        text[rng.integers(WORDS_PER_PAGE)] = planted[rng.integers(len(planted))]
+        page_data = {'text': text,
+                     'left': list(rng.integers(0, 1000, size=WORDS_PER_PAGE)),
+                     'top': list(rng.integers(0, 1000, size=WORDS_PER_PAGE)),
+                     'width': [40] * WORDS_PER_PAGE,
+                     'height': [12] * WORDS_PER_PAGE,
+                     'conf': list(rng.integers(0, 100, size=WORDS_PER_PAGE))}
+        data.append((idx, (page_data, image, OcrPageData(image_to_data=page_data))))
+    return data
+
+
+def main():
+    blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+
+    temp_dir = tempfile.mkdtemp()
+    init_database(os.path.join(temp_dir, 'benchmark.db'))
+    set_image_store(FileImageStore(os.path.join(temp_dir, 'page_images')))
+    create_tables()
+    rng = np.random.default_rng(seed=0)
+    words = vocabulary(distinct, rng)
+    pages = blocks // WORDS_PER_PAGE
+    start = time.perf_counter()
+    for document in range(0, pages, PAGES_PER_DOCUMENT):
+        OcrEngine.commit_data(f'document {document // PAGES_PER_DOCUMENT}', None,
+                              synthetic_document(words, min(PAGES_PER_DOCUMENT, pages - document),
+                                                 document // PAGES_PER_DOCUMENT % 2 == 1, rng))
+    print(f'Committed {pages * WORDS_PER_PAGE} blocks in {time.perf_counter() - start:.1f}s')
+
+    index = FuzzyIndex()
+    start = time.perf_counter()
+    index.refresh()
+    print(f'Built the fuzzy index in {time.perf_counter() - start:.1f}s')
+
+    for query in QUERIES:
+        timings = {}
+        for mode, search in (('exact', search_document_ids), ('fuzzy', index.search_document_ids)):
+            latencies = []
+            for _ in range(5):
+                start = time.perf_counter()
+                with read_only():
+                    documents = search([query])
+                latencies.append((time.perf_counter() - start) * 1000)
+            timings[mode] = (np.median(latencies), len(documents))
+        print(f'{query:>12}: exact {timings["exact"][0]:6.1f} ms {timings["exact"][1]:3} documents, '
+              f'fuzzy {timings["fuzzy"][0]:6.1f} ms {timings["fuzzy"][1]:3} documents')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Compares the page image storage policies on the image_src corpus: stored size and encode time per page
+
+Run from the Benchmarks folder: python ImageCodecs.py [quality]
+"""
+import sys
+sys.path.append("..")  # When launching from source, include StudiOCR folder
+import glob
+import os
+import shutil
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from StudiOCR.ImageStore import FileImageStore
+from StudiOCR.PageImageCodec import PageImageCodec
+
+IMAGE_SRC = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                         '..', 'Image_Preprocessing_Optimization', 'image_src')
+
+
+def library_size(root: str) -> int:
+    """Bytes of every file under root"""
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for directory, _, names in os.walk(root) for name in names)
+
+
+def main():
+    quality = int(sys.argv[1]) if len(sys.argv) > 1 else PageImageCodec.DEFAULT_QUALITY
+    filepaths = sorted(glob.glob(os.path.join(IMAGE_SRC, '*')))
+    pages = []
+    for filepath in filepaths:
+        with open(filepath, 'rb') as image_file:
+            original = image_file.read()
+        pages.append((cv2.imdecode(np.frombuffer(original, dtype=np.uint8), cv2.IMREAD_COLOR), original))
+    print(f'{len(pages)} pages, {sum(len(original) for _, original in pages) / 1024:.0f} KiB of originals')
+
+    # What process_image stored before the storage policy existed
+    policies = [('jpeg q100 (previous)', PageImageCodec(PageImageCodec.JPEG, 100))]
+    policies += [(f'{codec} q{quality}' if codec in (PageImageCodec.WEBP, PageImageCodec.JPEG) else codec,
+                  PageImageCodec(codec, quality)) for codec in PageImageCodec.CODECS]
+
+    print(f'{"policy":<22}{"library KiB":>12}{"KiB/page":>10}{"encode ms/page":>16}')
+    for label, codec in policies:
+        temp_dir = tempfile.mkdtemp()
+        try:
+            store = FileImageStore(temp_dir)
+            encode_seconds = 0
+            for image, original in pages:
+                start = time.perf_counter()
+                encoded = codec.encode(image=image, original=original)
+                encode_seconds += time.perf_counter() - start
+                store.put(encoded)
+            size = library_size(temp_dir)
+        finally:
+            shutil.rmtree(temp_dir)
+        print(f'{label:<22}{size / 1024:>12.0f}{size / 1024 / len(pages):>10.1f}'
+              f'{encode_seconds * 1000 / len(pages):>16.2f}')
+
+
+if __name__ == "__main__":
+    main()
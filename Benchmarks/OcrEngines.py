@@ -0,0 +1,54 @@
+"""
+Compares the pages/sec of the Tesseract engines on the image_src corpus, in a single process
+
+Run from the Benchmarks folder: python OcrEngines.py [best|fast] [psm]
+"""
+import sys
+sys.path.append("..")  # When launching from source, include StudiOCR folder
+import glob
+import os
+import time
+
+import cv2
+
+from StudiOCR.util import get_absolute_path
+from StudiOCR.TesseractEngine import LibTesseractEngine, PytesseractEngine
+
+IMAGE_SRC = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                         '..', 'Image_Preprocessing_Optimization', 'image_src')
+
+
+def main():
+    model = sys.argv[1] if len(sys.argv) > 1 else 'best'
+    psm = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    tessdata_path = get_absolute_path(f'tessdata/{model}')
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+
+    images = [cv2.cvtColor(src=cv2.imread(filepath, cv2.IMREAD_COLOR), code=cv2.COLOR_BGR2RGB)
+              for filepath in sorted(glob.glob(os.path.join(IMAGE_SRC, '*')))]
+    print(f'{len(images)} pages, {model} model, psm {psm}')
+
+    words = {}
+    for engine_type in (PytesseractEngine, LibTesseractEngine):
+        try:
+            start = time.perf_counter()
+            engine = engine_type(tessdata_path, 3)
+            load_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            words[engine_type] = [[text for text in engine.image_to_data(image, psm)['text'] if text.strip()]
+                                  for image in images]
+            elapsed = time.perf_counter() - start
+        except OSError as error:
+            # pytesseract raises TesseractNotFoundError, an OSError, without the tesseract executable
+            print(f'{engine_type.__name__}: unavailable ({error})')
+            continue
+        print(f'{engine_type.__name__}: {len(images) / elapsed:.2f} pages/sec '
+              f'({elapsed * 1000 / len(images):.0f} ms/page, model load {load_seconds * 1000:.0f} ms)')
+
+    if len(words) == 2:
+        same = sum(a == b for a, b in zip(*words.values()))
+        print(f'{same} of {len(images)} pages recognized identically by both engines')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Compares handing page images to the OCR pool by pickling them with handing them over in shared memory,
+measuring the pages/sec and the peak RSS of the worker process and of the pool processes
+
+Run from the Benchmarks folder: python PageTransfer.py [PDF file] [pages] [--ocr]
+Without a PDF the image_src pages are repeated. Without --ocr the pool processes only read every pixel,
+so the transfer itself is measured, with --ocr they run Tesseract on the pages.
+"""
+import sys
+sys.path.append("..")  # When launching from source, include StudiOCR folder
+import glob
+import itertools
+import os
+import resource
+import shutil
+import time
+from multiprocessing import Pool, Process
+from multiprocessing.pool import ThreadPool
+import threading
+
+import cv2
+import numpy as np
+
+from StudiOCR.util import get_absolute_path, get_ocr_processes
+from StudiOCR.OcrEngine import OcrEngine
+from StudiOCR.PdfToImage import PDFToImage
+from StudiOCR.SharedImage import SharedImageBuffer, share_with_child_processes
+
+IMAGE_SRC = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                         '..', 'Image_Preprocessing_Optimization', 'image_src')
+
+
+def read_pixels(image: np.ndarray, *_) -> int:
+    """Stands in for OCR when only the transfer is measured, reads the image once as Tesseract would"""
+    return int(image.sum())
+
+
+def read_shared_pixels(image, *_) -> int:
+    """read_pixels of a SharedImage"""
+    return image.apply(read_pixels)
+
+
+def run(mode: str, filepaths: list, ocr: bool) -> None:
+    processes = get_ocr_processes()
+    share_with_child_processes()
+    pool = Pool(processes=processes)
+    settings = (get_absolute_path('tessdata/best'), 3, 3)
+    if ocr:
+        function = OcrEngine.recognize_shared if mode == 'shared' else OcrEngine.recognize
+    else:
+        function = read_shared_pixels if mode == 'shared' else read_pixels
+    buffers = threading.local()
+    all_buffers = []
+
+    # Pages are decoded in this process and handed to the pool by a thread per pool process, as in OcrWorker
+    def process_page(filepath):
+        image = cv2.cvtColor(src=cv2.imread(filepath, cv2.IMREAD_COLOR), code=cv2.COLOR_BGR2RGB)
+        if mode == 'shared':
+            if not hasattr(buffers, 'buffer'):
+                buffers.buffer = SharedImageBuffer()
+                all_buffers.append(buffers.buffer)
+            image = buffers.buffer.share(image)
+        return pool.apply(function, (image, *settings))
+
+    start = time.perf_counter()
+    with ThreadPool(processes) as threads:
+        threads.map(process_page, filepaths)
+    elapsed = time.perf_counter() - start
+    pool.close()
+    pool.join()
+    for buffer in all_buffers:
+        buffer.close()
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    scale = 1024 if sys.platform != 'darwin' else 1
+    worker_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+    pool_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 2 ** 20
+    print(f'{mode}: {len(filepaths) / elapsed:.1f} pages/sec, peak RSS {worker_rss:.0f} MB worker, '
+          f'{pool_rss:.0f} MB largest pool process')
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if arg != '--ocr']
+    ocr = '--ocr' in sys.argv
+    pdf = args[0] if len(args) > 0 and args[0].lower().endswith('.pdf') else None
+    pages = int(args[-1]) if len(args) > 0 and args[-1].isdigit() else 300
+
+    temp_dir = None
+    if pdf is not None:
+        start = time.perf_counter()
+        _, (filepaths, temp_dir) = PDFToImage.pdf_to_img(pdf)
+        print(f'Rasterized {len(filepaths)} pages in {time.perf_counter() - start:.1f}s')
+        filepaths = filepaths[:pages]
+    else:
+        filepaths = list(itertools.islice(itertools.cycle(
+            sorted(glob.glob(os.path.join(IMAGE_SRC, '*')))), pages))
+    print(f'{len(filepaths)} pages, {get_ocr_processes()} pool processes, {"OCR" if ocr else "transfer only"}')
+
+    try:
+        # Each mode runs in a fresh process, so neither inherits the other's peak RSS
+        for mode in ('pickle', 'shared'):
+            process = Process(target=run, args=(mode, filepaths, ocr))
+            process.start()
+            process.join()
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
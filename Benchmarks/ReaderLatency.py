@@ -0,0 +1,87 @@
+"""
+Measures the latency of GUI reads while the OCR process commits a large document
+
+Run from the Benchmarks folder: python ReaderLatency.py [pages] [words per page]
+"""
+import sys
+sys.path.append("..")  # When launching from source, include StudiOCR folder
+import os
+import tempfile
+import time
+from multiprocessing import Process
+
+import numpy as np
+from peewee import OperationalError
+
+from StudiOCR.db import (OcrDocument, init_database, set_image_store,
+                         create_tables, read_only, search_document_ids)
+from StudiOCR.ImageStore import FileImageStore
+from StudiOCR.OcrEngine import OcrEngine
+from StudiOCR.OcrPageData import OcrPageData
+
+IMAGE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                     '..', 'Image_Preprocessing_Optimization', 'image_src', 'b_1.jpg')
+WORDS = ['binary', 'search', 'tree', 'graph', 'lecture', 'notes', 'theorem', 'proof']
+
+
+def synthetic_document(pages: int, words_per_page: int) -> list:
+    """commit_data input for a document of pages copies of IMAGE, each with random words"""
+    image = open(IMAGE, 'rb').read()
+    rng = np.random.default_rng(seed=0)
+    data = []
+    for idx in range(pages):
+        page_data = {'text': list(rng.choice(WORDS, size=words_per_page)),
+                     'left': list(rng.integers(0, 1000, size=words_per_page)),
+                     'top': list(rng.integers(0, 1000, size=words_per_page)),
+                     'width': [40] * words_per_page,
+                     'height': [12] * words_per_page,
+                     'conf': list(rng.integers(0, 100, size=words_per_page))}
+        data.append((idx, (page_data, image, OcrPageData(image_to_data=page_data))))
+    return data
+
+
+def ingest(database: str, library: str, name: str, pages: int, words_per_page: int) -> None:
+    init_database(database)
+    set_image_store(FileImageStore(library))
+    OcrEngine.commit_data(name, None, synthetic_document(pages, words_per_page))
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    words_per_page = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+
+    temp_dir = tempfile.mkdtemp()
+    database = os.path.join(temp_dir, 'benchmark.db')
+    library = os.path.join(temp_dir, 'page_images')
+    init_database(database)
+    set_image_store(FileImageStore(library))
+    create_tables()
+    # Something for the readers to find before the big commit lands
+    ingest(database, library, 'seed', 5, words_per_page)
+
+    writer = Process(target=ingest, args=(
+        database, library, 'large', pages, words_per_page))
+    writer.start()
+
+    latencies = []
+    errors = 0
+    while writer.is_alive():
+        start = time.perf_counter()
+        try:
+            with read_only():
+                OcrDocument.select().count()
+                search_document_ids(['tree'])
+        except OperationalError:
+            errors += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+    writer.join()
+
+    latencies = np.asarray(latencies)
+    print(f'{pages} pages x {words_per_page} words committed while reading')
+    print(f'{len(latencies)} reads, {errors} failed')
+    print(f'latency ms: p50 {np.percentile(latencies, 50):.2f}, p95 {np.percentile(latencies, 95):.2f}, '
+          f'p99 {np.percentile(latencies, 99):.2f}, max {latencies.max():.2f}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Compares the PDF render profiles on a PDF: time to render the pages, size of the page images,
+time to recognize them and words recognized, against rendering in color at 200 DPI
+
+Run from the Benchmarks folder: python RenderProfiles.py <PDF file> [pages] [best|fast]
+"""
+import sys
+sys.path.append("..")  # When launching from source, include StudiOCR folder
+import os
+import shutil
+import tempfile
+import time
+
+import cv2
+
+from StudiOCR.util import get_absolute_path
+from StudiOCR.OcrEngine import OcrEngine
+from StudiOCR.PdfToImage import PDFToImage
+
+
+def main():
+    filepath = sys.argv[1]
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    model = sys.argv[3] if len(sys.argv) > 3 else 'best'
+    tessdata_path = get_absolute_path(f'tessdata/{model}')
+    pages = min(pages, PDFToImage.page_count(filepath))
+    print(f'{filepath}: first {pages} pages, {model} model')
+
+    results = {}
+    for profile in PDFToImage.PROFILES:
+        if profile == PDFToImage.AUTO:
+            start = time.perf_counter()
+            dpi, color = PDFToImage.auto_profile(filepath, (pages + 1) // 2)
+            sample_seconds = time.perf_counter() - start
+        else:
+            (dpi, color), sample_seconds = PDFToImage.RENDER_PROFILES[profile], 0
+        temp_dir = tempfile.mkdtemp()
+        try:
+            start = time.perf_counter()
+            filepaths = [image for chunk in PDFToImage.chunks(list(range(1, pages + 1)))
+                         for image in PDFToImage.rasterize(filepath, chunk[0], chunk[-1], temp_dir, dpi, color)]
+            render_seconds = time.perf_counter() - start + sample_seconds
+            size = sum(os.path.getsize(image) for image in filepaths)
+
+            ocr_seconds, words = None, None
+            try:
+                start = time.perf_counter()
+                words = 0
+                for image in filepaths:
+                    image = cv2.cvtColor(src=cv2.imread(image, cv2.IMREAD_COLOR), code=cv2.COLOR_BGR2RGB)
+                    words += sum(1 for text in OcrEngine.recognize(image, tessdata_path, 3, 3)['text']
+                                 if text.strip())
+                ocr_seconds = time.perf_counter() - start
+            except OSError as error:
+                # pytesseract raises TesseractNotFoundError, an OSError, without the tesseract executable
+                print(f'OCR unavailable ({error})')
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        results[profile] = (render_seconds, ocr_seconds)
+
+        line = (f'{profile:>10}: {dpi} DPI {color:<5} render {render_seconds:6.2f}s, '
+                f'images {size / 2 ** 20:6.1f} MB')
+        if ocr_seconds is not None:
+            line += f', OCR {ocr_seconds:7.2f}s, {words} words'
+        print(line)
+
+    baseline_render, baseline_ocr = results['color-200']
+    for profile, (render_seconds, ocr_seconds) in results.items():
+        saved = baseline_render - render_seconds
+        if ocr_seconds is not None and baseline_ocr is not None:
+            saved += baseline_ocr - ocr_seconds
+        print(f'{profile:>10}: {saved:+.2f}s saved against color-200')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 
 from PySide2 import QtCore as Qc
 from PySide2 import QtWidgets as Qw
@@ -7,24 +7,64 @@ from PySide2 import QtGui as Qg
 import img2pdf
 
 from StudiOCR.util import get_absolute_path
-from StudiOCR.db import (db, OcrDocument, OcrPage, OcrBlock, create_tables)
+from StudiOCR.db import (db, OcrDocument, OcrPage, OcrBlock,
+                         create_tables, read_only, search_blocks, search_phrases)
 from StudiOCR.PhotoViewer import PhotoViewer
+from StudiOCR.PageImageCodec import PageImageCodec
 from StudiOCR.EditDocWindow import EditDocWindow
 
 
+# Box drawn around matched text, with the lowest confidence of its words
+Highlight = namedtuple('Highlight', ('left', 'top', 'width', 'height', 'conf'))
+
+
+def phrase_highlights(blocks: tuple) -> list:
+    """
+    Highlights covering a phrase: one box per line the phrase spans, around its words on that line
+
+    Parameters
+    blocks - OcrBlock of each word of the phrase, in reading order
+    """
+    lines = []
+    for block in blocks:
+        layout = (block.block_num, block.par_num, block.line_num)
+        if len(lines) > 0:
+            previous = lines[-1][-1]
+            if None in layout:
+                # Blocks committed before the layout keys were kept are on the same line if they overlap vertically
+                same_line = block.top < previous.top + previous.height and previous.top < block.top + block.height
+            else:
+                same_line = layout == (previous.block_num, previous.par_num, previous.line_num)
+            if same_line:
+                lines[-1].append(block)
+                continue
+        lines.append([block])
+    highlights = []
+    for line in lines:
+        left = min(block.left for block in line)
+        top = min(block.top for block in line)
+        highlights.append(Highlight(left, top,
+                                    max(block.left + block.width for block in line) - left,
+                                    max(block.top + block.height for block in line) - top,
+                                    min(block.conf for block in line)))
+    return highlights
+
+
 class DocWindow(Qw.QDialog):
     """
     Document Window for when the user is searching in a specific document
     """
 
-    def __init__(self, doc, parent=None, filter=''):
+    def __init__(self, doc, parent=None, filter='', page=0, any_word=False):
         """
         Constructor method
         :param doc: OCRDocument
         :param filter: Filter from main window
+        :param page: number of the page to open at
+        :param any_word: match the words of filter separately, as the OCR search of the main window does,
+        rather than as a phrase, until the search text is changed
         """
         super().__init__(parent=parent)
-        db.connect(reuse_if_open=True)
         self.setWindowTitle(doc.name)
 
         desktop = Qw.QDesktopWidget()
@@ -34,10 +74,12 @@ class DocWindow(Qw.QDialog):
 
         self._doc = doc
         self._filter = filter
+        self._any_word_filter = filter if any_word else None
         self._curr_page = 0
-        self._pages = self._doc.pages
-        self._pages_len = len(self._pages)
-        # Store key as page index, value as list of blocks
+        with read_only():
+            self._pages = self._doc.pages.order_by(OcrPage.number)
+            self._pages_len = len(self._pages)
+        # Store key as page index, value as list of blocks and phrase Highlights
         self._filtered_page_indexes = OrderedDict()
 
         self._layout = Qw.QVBoxLayout()
@@ -122,9 +164,8 @@ class DocWindow(Qw.QDialog):
         if self._filter:
             self.search_bar.setText(self._filter)
             self.update_filter()
-        self.jump_to_page(0)
-
-        db.close()
+        self.jump_to_page(next((page_index for page_index, doc_page in enumerate(self._pages)
+                                if doc_page.number == page), 0))
 
     def add_pages(self, doc):
         # TODO: Refactor. This is disgusting
@@ -179,7 +220,8 @@ class DocWindow(Qw.QDialog):
             file = file_dialog.selectedFiles()[0]
             imgs = []
             for page in self._pages:
-                imgs.append(page.image)
+                # img2pdf embeds JPEG and PNG, WebP pages are converted
+                imgs.append(PageImageCodec.for_pdf(page.image))
 
             with open(file, "wb") as f:
                 f.write(img2pdf.convert(imgs))
@@ -206,14 +248,13 @@ class DocWindow(Qw.QDialog):
         dialog.show()
 
     def update_image(self):
-        db.connect(reuse_if_open=True)
         # if there is no search criteria, display original image of current page
         if not self._filter or self._curr_page not in self._filtered_page_indexes.keys():
             img = Qg.QImage.fromData(self._pages[self._curr_page].image)
             self._pixmap = Qg.QPixmap.fromImage(img)
             self.viewer.setPhoto(self._pixmap)
         else:
-            # for each block containing the search criteria, draw rectangles on the image
+            # for each block or phrase matching the search criteria, draw rectangles on the image
             block_list = self._filtered_page_indexes[self._curr_page]
             img = Qg.QImage.fromData(self._pages[self._curr_page].image)
             self._pixmap = Qg.QPixmap.fromImage(img)
@@ -232,7 +273,6 @@ class DocWindow(Qw.QDialog):
                 painter.end()
 
             self.viewer.setPhoto(self._pixmap)
-        db.close()
 
     def set_filter_mode(self):
         if self.filter_mode.isChecked():
@@ -252,10 +292,9 @@ class DocWindow(Qw.QDialog):
         It is used in case files are added to an existing document and the user wants to see
         those immediatelely in the doc preview
         """
-        db.connect(reuse_if_open=True)
-        self._pages = self._doc.pages
-        self._pages_len = len(self._pages)
-        db.close()
+        with read_only():
+            self._pages = self._doc.pages.order_by(OcrPage.number)
+            self._pages_len = len(self._pages)
 
     def jump_to_page(self, page_num: int):
         self.page_number_box.blockSignals(True)
@@ -352,23 +391,35 @@ class DocWindow(Qw.QDialog):
         self._filtered_page_indexes = OrderedDict()
         # if there is search critera, then perform filtering
         if self._filter:
-            db.connect(reuse_if_open=True)
-            # search each block in the current page to see if it contains the search criteria (filter)
-            if self.case_sens_button.isChecked():
-                words = self._filter.split()
-            else:
-                words = self._filter.lower().split()
-            for page_index, page in enumerate(self._pages):
-                matched_blocks = []
-                for block in page.blocks:
-                    if self.case_sens_button.isChecked():
-                        text = block.text
-                    else:
-                        text = block.text.lower()
-                    # if the filter value is contained in the block text, add block to list
-                    for word in words:
-                        if word in text:
-                            matched_blocks.append(block)
-                if len(matched_blocks) != 0:
-                    self._filtered_page_indexes[page_index] = matched_blocks
-            db.close()
+            # search the index for blocks containing the search criteria (filter), it matches case insensitively
+            case_sensitive = self.case_sens_button.isChecked()
+            words = self._filter.split() if case_sensitive else self._filter.lower().split()
+            page_indexes = {page.id: page_index for page_index,
+                            page in enumerate(self._pages)}
+            matched_pages = {}
+            if len(words) > 1 and self._filter != self._any_word_filter:
+                # several words are a phrase, matched by words that follow each other in reading order
+                with read_only():
+                    phrases = search_phrases(words, document_id=self._doc.id)
+                for phrase in phrases:
+                    page_index = page_indexes.get(phrase[0].page_id)
+                    if page_index is None:
+                        continue
+                    if case_sensitive and not all(word in block.text for word, block in zip(words, phrase)):
+                        continue
+                    matched_pages.setdefault(page_index, []).extend(
+                        phrase_highlights(phrase))
+            elif len(words) > 0:
+                with read_only():
+                    blocks = list(search_blocks(
+                        words, document_id=self._doc.id))
+                for block in blocks:
+                    page_index = page_indexes.get(block.page_id)
+                    if page_index is None:
+                        continue
+                    # narrow the case insensitive index matches down if case sensitive
+                    if case_sensitive and not any(word in block.text for word in words):
+                        continue
+                    matched_pages.setdefault(page_index, []).append(block)
+            for page_index in sorted(matched_pages):
+                self._filtered_page_indexes[page_index] = matched_pages[page_index]
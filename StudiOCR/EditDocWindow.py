@@ -1,13 +1,16 @@
 import os
-import shutil
 
 from PySide2 import QtCore as Qc
 from PySide2 import QtWidgets as Qw
 from PySide2 import QtGui as Qg
 
 from StudiOCR.util import get_absolute_path
-from StudiOCR.db import (db, OcrDocument, OcrPage, OcrBlock, create_tables)
+from StudiOCR.db import (OcrDocument, OcrPage, OcrBlock,
+                         create_tables, read_only)
 from StudiOCR.PdfToImage import PDFToImage
+from StudiOCR.RasterCache import raster_cache
+from StudiOCR.PageImageCodec import PageImageCodec
+from StudiOCR.PageScheduler import PageScheduler
 from StudiOCR.PhotoViewer import PhotoViewer
 
 
@@ -17,11 +20,8 @@ class EditDocWindow(Qw.QDialog):
     This window also appears when the user wants to add pages to an existing document
     """
 
-    close_event_signal = Qc.Signal(None)
-
     def __init__(self, new_doc_cb, doc=None, parent=None):
         super().__init__(parent=parent)
-        db.connect(reuse_if_open=True)
 
         self._doc = doc
 
@@ -47,8 +47,8 @@ class EditDocWindow(Qw.QDialog):
             self.preview.update_preview_image_list)
         self.settings.display_preview_toggle_signal.connect(
             self.set_preview_visibility)
-
-        self.submitted = False
+        self.settings.render_profile_changed.connect(
+            self.preview.set_render_profile)
 
         self.settings_layout = Qw.QVBoxLayout()
         # self.settings_layout.addWidget(self.display_preview_button)
@@ -59,8 +59,6 @@ class EditDocWindow(Qw.QDialog):
 
         self.setLayout(self.layout)
 
-        db.close()
-
     @Qc.Slot(bool)
     def set_preview_visibility(self, visible: bool):
         if visible:
@@ -75,15 +73,9 @@ class EditDocWindow(Qw.QDialog):
             self.preview.hide()
 
     def close_on_submit(self):
-        # If we are closing on submit, do not send close_event_signal to child
-        # We need to preserve the temporary image files for processing
-        self.submitted = True
+        # The OCR process reads the PDF pages rendered for the preview from the RasterCache
         self.close()
 
-    def closeEvent(self, e):
-        if not self.submitted:
-            self.close_event_signal.emit()
-
 
 class DragList(Qw.QListWidget):
     """
@@ -130,13 +122,13 @@ class EditDocPreview(Qw.QWidget):
 
     def __init__(self, doc=None, parent=None):
         super().__init__(parent)
-        db.connect(reuse_if_open=True)
 
         self._image_previewer = Qw.QLabel()
         self.viewer = PhotoViewer(parent=self)
 
         self._doc = doc
-        self._doc_size = 0 if self._doc is None else len(self._doc.pages)
+        with read_only():
+            self._doc_size = 0 if self._doc is None else len(self._doc.pages)
 
         self._curr_preview_page = 0
         # create button group for prev and next page buttons
@@ -169,10 +161,19 @@ class EditDocPreview(Qw.QWidget):
 
         self.setLayout(self.preview_layout)
 
+        # Pages to preview, image filepaths and (PDF filepath, page number) tuples
         self._pages = []
         self._pages_len = 0
-
-        db.close()
+        # PDF pages are previewed as they are rendered for OCR, so OCR finds them in the RasterCache
+        self._render = PDFToImage.AUTO
+        # (DPI, color mode) of each PDF, by filepath
+        self._profiles = {}
+        # (page, render profile) of the PDF page being rasterized for the preview, None once it is shown
+        self._rendering = None
+        # PageRenders not done yet. The pool does not delete them, PySide2 crashes starting a runnable
+        # once one it deleted is garbage collected.
+        self._renders = set()
+        self._pixmap = None
 
         if self._doc is not None:
             self.update_preview_image_list([])
@@ -180,6 +181,7 @@ class EditDocPreview(Qw.QWidget):
     @Qc.Slot(list)
     def update_preview_image_list(self, pages):
         self._pages = pages
+        self._profiles = {}
         self._pages_len = len(self._pages)
         self.page_number_box.setInputMask(
             "0" * len(str(self._pages_len + self._doc_size)))
@@ -215,19 +217,88 @@ class EditDocPreview(Qw.QWidget):
         """
 
         if self._curr_preview_page < self._doc_size:
-            db.connect(reuse_if_open=True)
-            img = Qg.QImage.fromData(
-                self._doc.pages[self._curr_preview_page].image)
-            db.close()
+            with read_only():
+                # One row lookup on the (document, number) index
+                page = OcrPage.get((OcrPage.document == self._doc.id) &
+                                   (OcrPage.number == self._curr_preview_page))
+                img = Qg.QImage.fromData(page.image)
             self._pixmap = Qg.QPixmap.fromImage(img)
             self.viewer.setPhoto(self._pixmap)
         elif self._pages_len > 0:
-            self._pixmap = Qg.QPixmap(
-                self._pages[self._curr_preview_page - self._doc_size])
-            self.viewer.setPhoto(self._pixmap)
+            page = self._pages[self._curr_preview_page - self._doc_size]
+            if isinstance(page, tuple):
+                self.render_page(page)
+            else:
+                self._rendering = None
+                self._pixmap = Qg.QPixmap(page)
+                self.viewer.setPhoto(self._pixmap)
         else:
             self.viewer.hide()
 
+    @Qc.Slot(str)
+    def set_render_profile(self, render: str):
+        """Previews PDF pages with one of PDFToImage.PROFILES"""
+        if render != self._render:
+            self._render = render
+            self._profiles = {}
+            self.update_image()
+
+    def render_page(self, page):
+        """
+        Shows a placeholder while a PDF page is rasterized into the RasterCache on another thread,
+        then the page. Only the pages looked at are converted, and only once across sessions.
+        :param page: (PDF filepath, page number) tuple
+        """
+        filepath, number = page
+        render = self._render
+        self._rendering = (page, render)
+        self.viewer.setPhoto(self.placeholder(number))
+        sample_page = None
+        if filepath not in self._profiles:
+            # Sampled from the same page as the OCR process does
+            pages = [other[1] for other in self._pages
+                     if isinstance(other, tuple) and other[0] == filepath]
+            sample_page = pages[len(pages) // 2]
+        job = PageRender(page, render, sample_page, self._profiles.get(filepath),
+                         wanted=lambda: self._rendering == (page, render))
+        job.setAutoDelete(False)
+        self._renders.add(job)
+        job.signals.done.connect(self.show_rendered_page)
+        job.signals.done.connect(lambda *_: self._renders.discard(job))
+        Qc.QThreadPool.globalInstance().start(job)
+
+    @Qc.Slot(object, str, object, object)
+    def show_rendered_page(self, page, render, profile, image):
+        """
+        Shows a page PageRender rasterized, unless another page has been chosen since
+        :param page: (PDF filepath, page number) tuple
+        :param render: PDFToImage profile the page was rendered with
+        :param profile: (DPI, color mode) the page was rendered with, None if it could not be
+        :param image: image filepath of the page, None if it could not be rasterized
+        """
+        if profile is not None and render == self._render:
+            self._profiles[page[0]] = profile
+        if self._rendering != (page, render):
+            return
+        self._rendering = None
+        self._pixmap = Qg.QPixmap() if image is None else Qg.QPixmap(image)
+        self.viewer.setPhoto(self._pixmap)
+
+    def placeholder(self, number) -> Qg.QPixmap:
+        """Shown in place of a page while it is rasterized, the size of the page shown before it"""
+        size = self._pixmap.size() if self._pixmap is not None and not self._pixmap.isNull() else Qc.QSize(850, 1100)
+        pixmap = Qg.QPixmap(size)
+        pixmap.fill(Qg.QColor(30, 30, 30))
+        painter = Qg.QPainter(pixmap)
+        painter.setPen(Qg.QColor(200, 200, 200))
+        font = painter.font()
+        font.setPixelSize(max(size.height() // 40, 12))
+        painter.setFont(font)
+        painter.drawText(Qc.QRectF(pixmap.rect()), f"Rendering page {number}...",
+                         Qg.QTextOption(Qc.Qt.AlignCenter))
+        painter.end()
+        return pixmap
+
     def next_page(self):
         if self._curr_preview_page + 1 < self._pages_len + self._doc_size:
             self.jump_to_page(self._curr_preview_page + 1)
@@ -237,6 +308,49 @@ class EditDocPreview(Qw.QWidget):
             self.jump_to_page(self._curr_preview_page - 1)
 
 
+class PageRender(Qc.QRunnable):
+    """
+    Rasterizes a PDF page to preview into the RasterCache on a thread of the global QThreadPool,
+    so the GUI thread does not wait on pdftocairo, nor on the sample page the AUTO profile renders
+    """
+
+    class Signals(Qc.QObject):
+        # Page, PDFToImage profile, (DPI, color mode) it was rendered with and image filepath, as in show_rendered_page
+        done = Qc.Signal(object, str, object, object)
+
+    def __init__(self, page, render, sample_page=None, profile=None, wanted=None):
+        """
+        :param page: (PDF filepath, page number) tuple
+        :param render: PDFToImage profile to render with
+        :param sample_page: page the AUTO profile samples, needed unless profile is given
+        :param profile: (DPI, color mode) of the PDF, resolved from render if None
+        :param wanted: called before rendering, the page is skipped if it returns False,
+        done is emitted without a profile nor image
+        """
+        super().__init__()
+        self.page = page
+        self.render = render
+        self.sample_page = sample_page
+        self.profile = profile
+        self.wanted = wanted
+        self.signals = PageRender.Signals()
+
+    def run(self):
+        # Pages flipped past while others were rendering are not converted
+        if self.wanted is not None and not self.wanted():
+            self.signals.done.emit(self.page, self.render, None, None)
+            return
+        filepath, number = self.page
+        profile, image = self.profile, None
+        try:
+            if profile is None:
+                profile = PDFToImage.profile(filepath, self.render, self.sample_page)
+            image = raster_cache().pages(filepath, [number], *profile)[0]
+        except Exception as error:
+            print(f'Could not rasterize page {number} of {filepath}: {error}')
+        self.signals.done.emit(self.page, self.render, profile, image)
+
+
 class EditDocOptions(Qw.QWidget):
     """
     Contains the methods for new document insertion: model selection and add/remove functionality
@@ -244,18 +358,18 @@ class EditDocOptions(Qw.QWidget):
 
     close_on_submit_signal = Qc.Signal(None)
     has_new_file_previews = Qc.Signal(list)
+    # One of PDFToImage.PROFILES
+    render_profile_changed = Qc.Signal(str)
     display_preview_toggle_signal = Qc.Signal(bool)
 
     def __init__(self, new_doc_cb, doc=None, parent=None):
         super().__init__(parent)
-        db.connect(reuse_if_open=True)
 
         self.new_doc_cb = new_doc_cb
 
         self._doc = doc
-        self._doc_size = 0 if self._doc is None else len(self._doc.pages)
-
-        self.parentWidget().close_event_signal.connect(self.cleanup_temp_files)
+        with read_only():
+            self._doc_size = 0 if self._doc is None else len(self._doc.pages)
 
         self.display_preview_button = Qw.QPushButton(
             "Show document preview", default=False, autoDefault=False, parent=self)
@@ -330,6 +444,49 @@ class EditDocOptions(Qw.QWidget):
         self.psm_num.setCurrentIndex(0)
         self.psm_num.currentIndexChanged.connect(self.custom_preset)
 
+        # Storage policy for page images, in PageImageCodec.CODECS order
+        self.storage_label = Qw.QLabel("Page image storage:")
+        self.storage_options = Qw.QComboBox()
+        self.storage_options.setStyleSheet(self.dropdown_style)
+        self.storage_options.addItem("Original")
+        self.storage_options.addItem("Compressed (WebP)")
+        self.storage_options.addItem("Compressed (JPEG)")
+        self.storage_options.addItem("Black and White (PNG)")
+        # Default should be Original
+        self.storage_options.setCurrentIndex(0)
+        self.storage_options.currentIndexChanged.connect(
+            self.storage_changed)
+
+        # How PDF pages are rendered for OCR, in PDFToImage.PROFILES order
+        self.render_label = Qw.QLabel("PDF rendering:")
+        self.render_options = Qw.QComboBox()
+        self.render_options.setStyleSheet(self.dropdown_style)
+        self.render_options.addItem("Automatic")
+        self.render_options.addItem("Color, 150 DPI")
+        self.render_options.addItem("Color, 200 DPI")
+        self.render_options.addItem("Grayscale, 300 DPI")
+        self.render_options.addItem("Black and White, 300 DPI")
+        # Default should be Automatic
+        self.render_options.setCurrentIndex(0)
+        self.render_options.currentIndexChanged.connect(self.custom_preset)
+        self.render_options.currentIndexChanged.connect(self.render_changed)
+
+        # Processing priority, in PageScheduler.PRIORITIES order
+        self.priority_label = Qw.QLabel("Processing priority:")
+        self.priority_options = Qw.QComboBox()
+        self.priority_options.setStyleSheet(self.dropdown_style)
+        self.priority_options.addItem("Low")
+        self.priority_options.addItem("Normal")
+        self.priority_options.addItem("High")
+        # Default should be Normal
+        self.priority_options.setCurrentIndex(1)
+
+        self.quality_label = Qw.QLabel("Compressed image quality:")
+        self.quality_num = Qw.QSpinBox()
+        self.quality_num.setRange(1, 100)
+        self.quality_num.setValue(PageImageCodec.DEFAULT_QUALITY)
+        self.storage_changed(self.storage_options.currentIndex())
+
         self.info_button = Qw.QPushButton(
             default=False, autoDefault=False, parent=self)
         self.info_button.setIcon(
@@ -350,6 +507,14 @@ class EditDocOptions(Qw.QWidget):
         options_layout.addWidget(self.processing_options)
         options_layout.addWidget(self.psm_label)
         options_layout.addWidget(self.psm_num)
+        options_layout.addWidget(self.render_label)
+        options_layout.addWidget(self.render_options)
+        options_layout.addWidget(self.storage_label)
+        options_layout.addWidget(self.storage_options)
+        options_layout.addWidget(self.quality_label)
+        options_layout.addWidget(self.quality_num)
+        options_layout.addWidget(self.priority_label)
+        options_layout.addWidget(self.priority_options)
         options_layout.addWidget(self.info_button, alignment=Qc.Qt.AlignRight)
         self.options.setLayout(options_layout)
 
@@ -377,38 +542,54 @@ class EditDocOptions(Qw.QWidget):
         self.setLayout(main_layout)
 
         # For the preview image feature, keep two data types
-        # Dictionary that stores PDF filepath -> ([image filepaths], temp_dir)
-        self.pdf_previews = {}
-        # List of filenames, with PDFs already converted to images
+        # Dictionary that stores PDF filepath -> number of pages
+        self.pdf_page_counts = {}
+        # List of pages, image filepaths and (PDF filepath, page number) tuples
         self._pages = []
 
-        db.close()
-
     def custom_preset(self):
         # set preset to custom
         self.preset_options.setCurrentIndex(4)
 
+    def render_changed(self):
+        self.render_profile_changed.emit(
+            PDFToImage.PROFILES[self.render_options.currentIndex()])
+
+    def storage_changed(self, i):
+        # quality only applies to the lossy codecs
+        lossy = PageImageCodec.CODECS[i] in (
+            PageImageCodec.WEBP, PageImageCodec.JPEG)
+        self.quality_label.setEnabled(lossy)
+        self.quality_num.setEnabled(lossy)
+
     def preset_changed(self, i):
         self.processing_options.blockSignals(True)
         self.psm_num.blockSignals(True)
+        self.render_options.blockSignals(True)
         # screenshot
         if self.preset_options.currentIndex() == 0:
             self.processing_options.setCurrentIndex(0)
             self.psm_num.setCurrentIndex(0)
+            self.render_options.setCurrentIndex(1)
         # printed text
         elif self.preset_options.currentIndex() == 1:
             self.processing_options.setCurrentIndex(0)
             self.psm_num.setCurrentIndex(0)
+            self.render_options.setCurrentIndex(0)
         # written paragraph
         elif self.preset_options.currentIndex() == 2:
             self.processing_options.setCurrentIndex(1)
             self.psm_num.setCurrentIndex(3)
+            self.render_options.setCurrentIndex(3)
         # written page
         elif self.preset_options.currentIndex() == 3:
             self.processing_options.setCurrentIndex(1)
             self.psm_num.setCurrentIndex(0)
+            self.render_options.setCurrentIndex(3)
         self.processing_options.blockSignals(False)
         self.psm_num.blockSignals(False)
+        self.render_options.blockSignals(False)
+        self.render_changed()
 
     @Qc.Slot(None)
     def on_display_preview_button_toggled(self):
@@ -437,11 +618,6 @@ class EditDocOptions(Qw.QWidget):
         self.setMaximumWidth(self.sensible_max_width())
         super().resizeEvent(e)
 
-    def cleanup_temp_files(self):
-        for key in self.pdf_previews:
-            shutil.rmtree(self.pdf_previews[key][1])
-        self.pdf_previews = {}
-
     def choose_files(self):
         """
         Opens the file dialog and sets a filter for the type of files allowed
@@ -500,70 +676,30 @@ class EditDocOptions(Qw.QWidget):
             msg.exec_()
         else:
             for item in items:
-
-                # If the item being deleted is a PDF, ensure that we remove the temp files
-                if item.text() in self.pdf_previews:
-                    shutil.rmtree(self.pdf_previews[item.text()][1])
-                    del self.pdf_previews[item.text()]
-
+                self.pdf_page_counts.pop(item.text(), None)
                 self.listwidget.takeItem(self.listwidget.row(item))
 
         self.update_file_previews()
 
-    @Qc.Slot(int, int)
-    def update_pdf_process_status(self, processed: int, total: int):
-        if processed != total:
-            self.status_bar.showMessage(
-                f"Processing PDFs, {processed} out of {total}")
-        else:
-            self.status_bar.showMessage("Ready")
-
     def update_file_previews(self):
         """
         Update the file previews on file change
         """
-
-        to_process = []
-        for index in range(self.listwidget.count()):
-            filepath = self.listwidget.item(index).text()
-            filename, file_extension = os.path.splitext(filepath)
-            if file_extension == '.pdf' and filepath not in self.pdf_previews:
-                # If the file is a PDF, save the path into a queue for processing in a separate process
-                # We do not want to block the GUI Thread
-                to_process.append(filepath)
-
-        if len(to_process) > 0:
-            # disable the buttons until all the PDFs are done processing
-            self.submit.setEnabled(False)
-            self.choose_file_button.setEnabled(False)
-            self.remove_file_button.setEnabled(False)
-            self.pdf_image_process = PDFToImage(self)
-            self.pdf_image_process.done_signal.connect(
-                self.complete_update_file_previews)
-            self.pdf_image_process.status_signal.connect(
-                self.update_pdf_process_status)
-
-            self.pdf_image_process.pdf_filenames = to_process
-            self.pdf_image_process.run()
-            self.update_pdf_process_status(0, len(to_process))
-        else:
-            self.complete_update_file_previews({})
-
-    @Qc.Slot(object)
-    def complete_update_file_previews(self, result):
-        self.pdf_previews.update(result)
-
-        # re-enable the buttons
-        self.submit.setEnabled(True)
-        self.choose_file_button.setEnabled(True)
-        self.remove_file_button.setEnabled(True)
-
         self._pages = []
         for index in range(self.listwidget.count()):
             filepath = self.listwidget.item(index).text()
             _, file_extension = os.path.splitext(filepath)
-            if file_extension == '.pdf' and filepath in self.pdf_previews:
-                self._pages.extend(self.pdf_previews[filepath][0])
+            if file_extension == '.pdf':
+                # Only the page count is read here, the pages are rasterized when they are previewed or processed
+                if filepath not in self.pdf_page_counts:
+                    try:
+                        self.pdf_page_counts[filepath] = PDFToImage.page_count(
+                            filepath)
+                    except Exception as error:
+                        print(f'Could not read {filepath}: {error}')
+                        self.pdf_page_counts[filepath] = 0
+                self._pages.extend((filepath, page) for page in range(
+                    1, self.pdf_page_counts[filepath] + 1))
             else:
                 self._pages.append(filepath)
 
@@ -582,10 +718,10 @@ class EditDocOptions(Qw.QWidget):
         """
         Adds a new document to the database with the file names from listwidget
         """
-        db.connect(reuse_if_open=True)
         name = self.name_edit.text()
-        query = OcrDocument.select().where(OcrDocument.name == name)
-        if (query.exists() or len(name) == 0) and self._doc is None:
+        with read_only():
+            name_taken = OcrDocument.select().where(OcrDocument.name == name).exists()
+        if (name_taken or len(name) == 0) and self._doc is None:
             msg = Qw.QMessageBox()
             msg.setIcon(Qw.QMessageBox.Warning)
             msg.setText("Document names must be unique and non empty.")
@@ -612,11 +748,14 @@ class EditDocOptions(Qw.QWidget):
             psm_number = self.psm_num.currentIndex()+3
             best = bool(self.best_vs_fast_options.currentIndex())
             preprocessing = bool(self.processing_options.currentIndex())
+            codec = PageImageCodec.CODECS[self.storage_options.currentIndex()]
+            quality = self.quality_num.value()
+            priority = PageScheduler.PRIORITIES[self.priority_options.currentIndex()]
+            render = PDFToImage.PROFILES[self.render_options.currentIndex()]
             doc_id = None if self._doc is None else self._doc.id
-            self.new_doc_cb(name, doc_id, self.pdf_previews, self._pages, oem_number,
-                            psm_number, best, preprocessing)
+            self.new_doc_cb(name, doc_id, self._pages, oem_number,
+                            psm_number, best, preprocessing, codec, quality, priority, render)
             self.close_on_submit_signal.emit()
-        db.close()
 
     def display_info(self):
         """
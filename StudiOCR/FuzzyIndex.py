@@ -0,0 +1,199 @@
+from array import array
+import threading
+
+import numpy as np
+from peewee import fn
+
+from StudiOCR.db import OcrBlock, OcrPage, read_db
+
+
+class FuzzyIndex:
+    """
+    Approximate search over the words of every OcrBlock, tolerant of the errors OCR makes.
+    The distinct words are held in memory with a trigram index. Words sharing enough trigrams with a query word
+    are candidates, which are checked with Myers' bit-parallel edit distance, run over every candidate at once.
+    """
+
+    # Characters OCR commonly mistakes for one another, folded to the same text before comparing
+    CONFUSIONS = (('rn', 'm'), ('vv', 'w'), ('1', 'l'), ('|', 'l'), ('0', 'o'))
+    # Edits allowed per this many characters of a query word, shorter words have to match exactly
+    CHARS_PER_EDIT = 4
+    # Query words are compared up to this many characters, the width of the bit vectors
+    MAX_QUERY_CHARS = 64
+
+    def __init__(self) -> None:
+        # Folded words, the vocabulary index of each and the ids of the documents each is found in
+        self._words = []
+        self._word_ids = {}
+        self._documents = []
+        # Vocabulary indexes of the words containing each trigram
+        self._postings = {}
+        # Characters of each word as alphabet ids, 0 past its end, and its length
+        self._alphabet = {}
+        self._chars = np.zeros((1024, 16), dtype=np.uint16)
+        self._lengths = np.zeros(1024, dtype=np.int32)
+        # Blocks up to this id are indexed
+        self._last_id = 0
+        # The index may be built on another thread while a search waits for it
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fold(text: str) -> str:
+        """Lowercases text and folds its OCR CONFUSIONS"""
+        text = text.lower()
+        for confusion, folded in FuzzyIndex.CONFUSIONS:
+            text = text.replace(confusion, folded)
+        return text
+
+    @staticmethod
+    def trigrams(word: str) -> set:
+        return {word[index:index + 3] for index in range(len(word) - 2)}
+
+    def refresh(self) -> None:
+        """Adds the words of the blocks committed since the last refresh"""
+        with self._lock:
+            self._refresh()
+
+    def refresh_in_background(self) -> threading.Thread:
+        """Runs refresh on its own thread, so the first search does not wait for every block to be indexed"""
+        thread = threading.Thread(target=self._refresh_and_disconnect, daemon=True)
+        thread.start()
+        return thread
+
+    def _refresh_and_disconnect(self) -> None:
+        try:
+            self.refresh()
+        finally:
+            # This thread is about to end, so its connection would never be used again
+            read_db.shutdown()
+
+    def _refresh(self) -> None:
+        # Queried on read_db directly, so a refresh never changes which database the models are bound to
+        read_db.connect()
+        # Each text once per document, most repeat many times
+        rows = list(OcrBlock
+                    .select(OcrBlock.text, OcrPage.document, fn.MAX(OcrBlock.id))
+                    .join(OcrPage)
+                    .where(OcrBlock.id > self._last_id)
+                    .group_by(OcrBlock.text, OcrPage.document)
+                    .tuples()
+                    .bind(read_db))
+        for text, document_id, block_id in rows:
+            self._last_id = max(self._last_id, block_id)
+            word = FuzzyIndex.fold(text.strip())
+            if len(word) == 0:
+                continue
+            if word not in self._word_ids:
+                self._add_word(word)
+            self._documents[self._word_ids[word]].add(document_id)
+
+    def rewind(self) -> None:
+        """
+        Called after blocks are deleted. SQLite hands out the ids past the highest remaining block again,
+        the blocks given them are indexed on the next refresh. Words of deleted documents stay, so the ids of
+        documents that no longer exist may be among the matches.
+        """
+        read_db.connect()
+        last_id = OcrBlock.select(fn.MAX(OcrBlock.id)).bind(read_db).scalar() or 0
+        with self._lock:
+            self._last_id = min(self._last_id, last_id)
+
+    def _add_word(self, word: str) -> None:
+        index = len(self._words)
+        self._word_ids[word] = index
+        self._words.append(word)
+        self._documents.append(set())
+        for trigram in FuzzyIndex.trigrams(word):
+            self._postings.setdefault(trigram, array('i')).append(index)
+        # Grow the character matrix by doubling, in whichever dimension is too small
+        rows, columns = self._chars.shape
+        if index >= rows or len(word) > columns:
+            chars = np.zeros((rows * 2 if index >= rows else rows, max(columns, len(word))), dtype=np.uint16)
+            chars[:rows, :columns] = self._chars
+            self._chars = chars
+            lengths = np.zeros(chars.shape[0], dtype=np.int32)
+            lengths[:rows] = self._lengths
+            self._lengths = lengths
+        for position, character in enumerate(word):
+            # Ids past the uint16 range share the last one, at worst costing a spurious match
+            self._chars[index, position] = min(self._alphabet.setdefault(character, len(self._alphabet) + 1),
+                                               np.iinfo(np.uint16).max)
+        self._lengths[index] = len(word)
+
+    def candidates(self, word: str, max_edits: int) -> np.ndarray:
+        """
+        Vocabulary indexes of the words that may contain word within max_edits edits.
+        Each edit changes at most 3 of a word's trigrams, so the rest of its trigrams have to be there.
+        """
+        vocabulary = len(self._words)
+        query_trigrams = FuzzyIndex.trigrams(word)
+        required = len(query_trigrams) - 3 * max_edits
+        if required <= 0:
+            # Too short to filter on trigrams, every word long enough is a candidate
+            return np.nonzero(self._lengths[:vocabulary] >= len(word) - max_edits)[0]
+        postings = [np.frombuffer(self._postings[trigram], dtype=np.int32)
+                    for trigram in query_trigrams if trigram in self._postings]
+        if len(postings) < required:
+            return np.zeros(0, dtype=np.int64)
+        counts = np.bincount(np.concatenate(postings), minlength=vocabulary)
+        return np.nonzero(counts >= required)[0]
+
+    def distances(self, word: str, indexes: np.ndarray) -> np.ndarray:
+        """
+        Fewest edits turning word into a substring of each of the words at the vocabulary indexes, with
+        Myers' bit-parallel algorithm: a column of the edit distance matrix is a pair of bit vectors,
+        advanced a character at a time for every word at once
+
+        Parameters
+        word - folded query word, up to MAX_QUERY_CHARS long
+        indexes - vocabulary indexes of the words to compare with
+        """
+        one = np.uint64(1)
+        high_bit = one << np.uint64(len(word) - 1)
+        # Bit i of peq[c] is set where character i of the query is c, alphabet id 0 (past a word's end) has none
+        peq = np.zeros(len(self._alphabet) + 2, dtype=np.uint64)
+        for position, character in enumerate(word):
+            if character in self._alphabet:
+                peq[min(self._alphabet[character], np.iinfo(np.uint16).max)] |= one << np.uint64(position)
+        chars = self._chars[indexes]
+        lengths = self._lengths[indexes]
+        positive = np.full(len(indexes), ~np.uint64(0), dtype=np.uint64)
+        negative = np.zeros(len(indexes), dtype=np.uint64)
+        score = np.full(len(indexes), len(word), dtype=np.int32)
+        best = score.copy()
+        for column in range(int(lengths.max(initial=0))):
+            eq = peq[chars[:, column]]
+            xv = eq | negative
+            xh = (((eq & positive) + positive) ^ positive) | eq
+            ph = negative | ~(xh | positive)
+            mh = positive & xh
+            score += ((ph & high_bit) != 0).astype(np.int32) - ((mh & high_bit) != 0).astype(np.int32)
+            # Nothing is shifted in, so a match may start anywhere in the word
+            ph <<= one
+            mh <<= one
+            positive = mh | ~(xv | ph)
+            negative = ph & xv
+            # Columns past the end of a word do not count
+            best = np.where(column < lengths, np.minimum(best, score), best)
+        return best
+
+    def search_document_ids(self, words: list) -> set:
+        """
+        Returns the ids of the documents having a block that contains an approximate match of any of the given
+        words (case insensitive). A word of n characters, after folding CONFUSIONS, matches with up to
+        n // CHARS_PER_EDIT edits.
+        """
+        document_ids = set()
+        with self._lock:
+            self._refresh()
+            for word in words:
+                word = FuzzyIndex.fold(word)[:FuzzyIndex.MAX_QUERY_CHARS]
+                if len(word) == 0:
+                    continue
+                max_edits = len(word) // FuzzyIndex.CHARS_PER_EDIT
+                indexes = self.candidates(word, max_edits)
+                if len(indexes) == 0:
+                    continue
+                for index in indexes[self.distances(word, indexes) <= max_edits]:
+                    document_ids.update(self._documents[index])
+        return document_ids
@@ -43,6 +43,19 @@ class ImagePipeline:
         """Check if any steps exist in pipeline"""
         return self.size() > 0
 
+    def signature(self) -> str:
+        """Text identifying the steps and their parameters, equal for pipelines that process images identically"""
+        def function_name(function: Any) -> str:
+            return function if type(function) == str else getattr(function, '__qualname__', repr(function))
+
+        return repr([(name, function_name(step.new_step), step.image_param_name,
+                      None if step.outer_function is None else function_name(
+                          step.outer_function),
+                      None if step.other_params is None else sorted(
+                          step.other_params.items()),
+                      step.capture_index)
+                     for name, step in self.pipeline.items()])
+
     def clear(self) -> None:
         """Erase all steps from pipeline"""
         self.pipeline = OrderedDict([])
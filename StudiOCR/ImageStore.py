@@ -0,0 +1,93 @@
+from abc import ABC, abstractmethod
+import hashlib
+import os
+import tempfile
+
+
+class ImageStore(ABC):
+    """Interface for where page images are kept, each image is keyed by the SHA-256 of its bytes"""
+
+    @staticmethod
+    def key(data: bytes) -> str:
+        """Content hash identifying the given image bytes"""
+        return hashlib.sha256(data).hexdigest()
+
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        """Stores the image bytes (once, no matter how often they are put) and returns their key"""
+
+    @abstractmethod
+    def get(self, key: str) -> bytes:
+        """Returns the image bytes stored under key"""
+
+    @abstractmethod
+    def remove(self, key: str) -> None:
+        """Removes the image stored under key, if there is one"""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Whether an image is stored under key"""
+
+    @abstractmethod
+    def keys(self) -> list:
+        """Keys of every stored image"""
+
+
+class FileImageStore(ImageStore):
+    """Stores every image as a file named by its key, under a library directory"""
+
+    def __init__(self, root: str) -> None:
+        """
+        Parameters
+        root - library directory holding the image files, created if missing
+        """
+        self._root = root
+        os.makedirs(self._root, exist_ok=True)
+
+    @property
+    def root(self) -> str:
+        """Library directory holding the image files"""
+        return self._root
+
+    def path(self, key: str) -> str:
+        """Filepath of the image stored under key, spread over subdirectories by key prefix"""
+        return os.path.join(self._root, key[:2], key)
+
+    def put(self, data: bytes) -> str:
+        key = self.key(data)
+        path = self.path(key)
+        # Identical images share one file
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so readers never see a partially written image
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, 'wb') as temp_file:
+                    temp_file.write(data)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        return key
+
+    def get(self, key: str) -> bytes:
+        with open(self.path(key), 'rb') as image_file:
+            return image_file.read()
+
+    def remove(self, key: str) -> None:
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def keys(self) -> list:
+        keys = []
+        for prefix in os.listdir(self._root):
+            if os.path.isdir(os.path.join(self._root, prefix)):
+                # Temporary files of puts in progress are not named by a key
+                keys.extend(name for name in os.listdir(os.path.join(self._root, prefix))
+                            if len(name) == 64 and name.startswith(prefix))
+        return keys
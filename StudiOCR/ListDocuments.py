@@ -3,8 +3,10 @@ from PySide2 import QtWidgets as Qw
 from PySide2 import QtGui as Qg
 
 from StudiOCR.util import get_absolute_path
-from StudiOCR.db import (db, OcrDocument, OcrPage, OcrBlock, create_tables)
+from StudiOCR.db import (db, OcrDocument, OcrPage, OcrBlock, OcrThumbnail, create_tables,
+                         documents_with_thumbnails, read_only, search_document_ids, ranked_search)
 from StudiOCR.DocWindow import DocWindow
+from StudiOCR.FuzzyIndex import FuzzyIndex
 from StudiOCR.EditDocWindow import EditDocWindow
 
 
@@ -16,8 +18,6 @@ class ListDocuments(Qw.QWidget):
     def __init__(self, new_doc_cb, parent=None):
         super().__init__(parent)
 
-        db.connect(reuse_if_open=True)
-
         self._filter = ''
 
         self.new_doc_cb = new_doc_cb
@@ -38,13 +38,23 @@ class ListDocuments(Qw.QWidget):
 
         self.search_bar = Qw.QLineEdit()
         self.search_bar.setPlaceholderText("Search for document name...")
-        self.search_bar.textChanged.connect(self.update_filter)
+        self.search_bar.textChanged.connect(self.search_text_changed)
+        # OCR and FUZZY searches run once typing pauses, not on every keystroke
+        self._search_timer = Qc.QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(250)
+        self._search_timer.timeout.connect(self.update_filter)
 
         self.doc_search = Qw.QRadioButton("DOC")
         self.doc_search.clicked.connect(self.update_filter)
         self.doc_search.setChecked(True)
         self.ocr_search = Qw.QRadioButton("OCR")
         self.ocr_search.clicked.connect(self.update_filter)
+        # Searches the OCR text, also finding words OCR misread
+        self.fuzzy_search = Qw.QRadioButton("FUZZY")
+        self.fuzzy_search.clicked.connect(self.update_filter)
+        self.fuzzy_index = FuzzyIndex()
+        self.fuzzy_index.refresh_in_background()
 
         self.remove_mode = Qw.QPushButton("Enable remove mode")
         self.remove_mode.setCheckable(True)
@@ -52,15 +62,21 @@ class ListDocuments(Qw.QWidget):
 
         self.ui_box.addWidget(self.doc_search)
         self.ui_box.addWidget(self.ocr_search)
+        self.ui_box.addWidget(self.fuzzy_search)
         self.ui_box.addWidget(self.search_bar)
         self.ui_box.addWidget(self.remove_mode)
+
+        # pages matching the OCR search, best first
+        self.search_results = SearchResults(self)
+        self.search_results.page_selected.connect(self.create_doc_window_at_page)
+        self.search_results.hide()
         # produces the document buttons that users can interact with
-        for doc in OcrDocument.select():
-            # assuming that each doc will surely have at least one page
-            img = doc.pages[0].image
+        with read_only():
+            documents = documents_with_thumbnails()
+        for doc, thumbnail in documents:
             name = doc.name
 
-            doc_button = SingleDocumentButton(name, img, doc)
+            doc_button = SingleDocumentButton(name, thumbnail, doc)
             doc_button.pressed.connect(
                 lambda doc=doc: self.create_doc_window(doc))
             doc_button.setVisible(True)
@@ -78,10 +94,10 @@ class ListDocuments(Qw.QWidget):
         self.render_doc_grid()
 
         self._layout.addLayout(self.ui_box)
+        self._layout.addWidget(self.search_results)
         self._layout.addWidget(self.scroll_area)
 
         self.setLayout(self._layout)
-        db.close()
 
     def set_remove_mode(self):
         """
@@ -117,14 +133,13 @@ class ListDocuments(Qw.QWidget):
         self.scroll_area.setWidget(temp_widget)
 
     def update_button_name_docid(self, doc_id):
-        db.connect(reuse_if_open=True)
-        for button in self._doc_buttons:
-            if button.doc.id == doc_id:
-                doc = OcrDocument.get(OcrDocument.id == doc_id)
-                button.name = doc.name
-                break
+        with read_only():
+            for button in self._doc_buttons:
+                if button.doc.id == doc_id:
+                    doc = OcrDocument.get(OcrDocument.id == doc_id)
+                    button.name = doc.name
+                    break
         self.update_filter()
-        db.close()
 
     @Qc.Slot(int)
     def display_new_document(self, doc_id):
@@ -132,7 +147,6 @@ class ListDocuments(Qw.QWidget):
         Display the new document added by creating a button for the new doc and re-rendering the doc grid
         :param doc_id: ID of the new document in the database
         """
-        db.connect(reuse_if_open=True)
         add_button = True
         # only append the document if the document isn't in the grid yet
         for button in self._doc_buttons:
@@ -140,15 +154,19 @@ class ListDocuments(Qw.QWidget):
                 add_button = False
 
         if add_button:
-            doc = OcrDocument.get(OcrDocument.id == doc_id)
-            # assuming that each doc will surely have at least one page
+            with read_only():
+                doc = OcrDocument.get_or_none(OcrDocument.id == doc_id)
+                thumbnail = OcrThumbnail.get_or_none(
+                    OcrThumbnail.document == doc_id)
+            # the document may have been deleted while its pages were being processed
+            if doc is None:
+                return
             doc_button = SingleDocumentButton(
-                doc.name, doc.pages[0].image, doc)
+                doc.name, None if thumbnail is None else thumbnail.image, doc)
             doc_button.pressed.connect(
                 lambda doc=doc: self.create_doc_window(doc))
             self._doc_buttons.append(doc_button)
         self.update_filter()
-        db.close()
 
     def create_doc_window(self, doc):
         """
@@ -179,23 +197,44 @@ class ListDocuments(Qw.QWidget):
                 db.connect(reuse_if_open=True)
                 doc.delete_document()
                 db.close()
+                self.fuzzy_index.rewind()
         else:
             if self.ocr_search.isChecked():
+                # open with the blocks matching any of the words highlighted, the ones the document matched
                 self.doc_window = DocWindow(
-                    doc, parent=self, filter=self._filter)
+                    doc, parent=self, filter=self._filter, any_word=True)
             else:
                 self.doc_window = DocWindow(doc, parent=self)
             self.doc_window.show()
 
+    def create_doc_window_at_page(self, doc, page_number):
+        """
+        Spawns a document window showing the OCR search on the given page
+        :param doc: document to display
+        :param page_number: number of the page to open at
+        """
+        self.doc_window = DocWindow(
+            doc, parent=self, filter=self._filter, page=page_number, any_word=True)
+        self.doc_window.show()
+
     def create_new_doc_window(self):
         self.new_doc_window = EditDocWindow(self.new_doc_cb, parent=self)
         self.new_doc_window.show()
 
+    def search_text_changed(self):
+        """
+        Filters document names right away, and waits for typing to pause before searching the OCR text
+        """
+        if self.doc_search.isChecked():
+            self.update_filter()
+        else:
+            self._search_timer.start()
+
     def update_filter(self):
         """
         Updates the filter after the input in the search bar is changed
         """
-        db.connect(reuse_if_open=True)
+        self._search_timer.stop()
         self._filter = self.search_bar.text()
 
         self._active_docs = []
@@ -203,26 +242,56 @@ class ListDocuments(Qw.QWidget):
             for button in self._doc_buttons:
                 if(self._filter.lower() in button.name.lower()):
                     self._active_docs.append(button)
-        elif self.ocr_search.isChecked():
+        elif self.ocr_search.isChecked() or self.fuzzy_search.isChecked():
             words = self._filter.lower().split()
-            for button in self._doc_buttons:
-                text_found = False
-                if len(words) == 0:
-                    self._active_docs.append(button)
-                    continue
-                for page in button.doc.pages:
-                    for block in page.blocks:
-                        text = block.text.lower()
-                        for word in words:
-                            if word in text:
-                                if not text_found:
-                                    self._active_docs.append(button)
-                                    text_found = True
-                                    break
-        db.close()
+            if len(words) == 0:
+                self._active_docs = list(self._doc_buttons)
+            else:
+                if self.ocr_search.isChecked():
+                    # one indexed query over OcrBlockFts finds every document containing any word
+                    with read_only():
+                        matched_doc_ids = search_document_ids(words)
+                        results = ranked_search(words)
+                    self.search_results.show_results(results)
+                else:
+                    # approximate matches of any word, from the in-memory trigram index
+                    matched_doc_ids = self.fuzzy_index.search_document_ids(words)
+                for button in self._doc_buttons:
+                    if button.doc.id in matched_doc_ids:
+                        self._active_docs.append(button)
+        self.search_results.setVisible(
+            self.ocr_search.isChecked() and len(self._filter.split()) > 0 and self.search_results.count() > 0)
         self.render_doc_grid()
 
 
+class SearchResults(Qw.QListWidget):
+    """
+    Pages matching an OCR search, ranked best first, showing the words matched on each
+    """
+
+    # Document and number of the page clicked
+    page_selected = Qc.Signal(object, int)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._results = []
+        self.setMaximumHeight(160)
+        self.itemClicked.connect(
+            lambda item: self.page_selected.emit(*self._results[self.row(item)]))
+
+    def show_results(self, results):
+        """
+        Lists the results of ranked_search
+        :param results: (document, page, blocks, score) tuples, best first
+        """
+        self.clear()
+        self._results = [(doc, page.number) for doc, page, _, _ in results]
+        # the BM25 score has no meaning to users, the rank is shown instead
+        for rank, (doc, page, blocks, _) in enumerate(results, start=1):
+            matched = ', '.join(sorted({block.text for block in blocks}))
+            self.addItem(f"#{rank} {doc.name}, page {page.number + 1}: {matched}")
+
+
 class SingleDocumentButton(Qw.QToolButton):
     """
     Custom Button Class for Document Button which has a thumbnail of the first page
@@ -267,7 +336,7 @@ class SingleDocumentButton(Qw.QToolButton):
 
 class DocumentThumbnail(Qw.QLabel):
     """
-    Class for creating the pixmap from page.imageblobdata
+    Class for creating the pixmap from the thumbnail image data
     """
 
     def __init__(self, image, *args, **kwargs):
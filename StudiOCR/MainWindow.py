@@ -1,10 +1,12 @@
+from collections import OrderedDict
 from multiprocessing import Queue
 
 from PySide2 import QtCore as Qc
 from PySide2 import QtWidgets as Qw
 from PySide2 import QtGui as Qg
 
-from StudiOCR.db import (db, OcrDocument, OcrPage, OcrBlock, create_tables)
+from StudiOCR.db import (db, OcrDocument, OcrPage, OcrBlock, create_tables,
+                         create_job, read_only, unfinished_jobs)
 from StudiOCR.OcrWorker import StatusEmitter
 from StudiOCR.ListDocuments import ListDocuments
 
@@ -32,37 +34,84 @@ class MainWindow(Qw.QMainWindow):
         self.setCentralWidget(self.main_widget)
 
         # Configure emitter
-        self.emitter.document_process_status.connect(
-            self.set_document_process_status)
+        self.emitter.job_progress.connect(self.set_job_progress)
 
         self.emitter.data_available.connect(
             self.main_widget.documents.display_new_document)
 
-        self.docs_in_queue = 0
-        self.current_doc_process_status = 0
+        self.emitter.cache_stats.connect(self.set_cache_stats)
+
+        # Cancels a queued document, chosen from the menu of every document in queue
+        self.cancel_button = Qw.QToolButton()
+        self.cancel_button.setText("Cancel")
+        self.cancel_button.setPopupMode(Qw.QToolButton.InstantPopup)
+        self.cancel_menu = Qw.QMenu(self.cancel_button)
+        self.cancel_button.setMenu(self.cancel_menu)
+        self.statusBar().addPermanentWidget(self.cancel_button)
+        self.cancel_button.hide()
+
+        # job id -> [document name, pages processed, pages in document] of every document in queue
+        self.jobs = OrderedDict()
+        self.status_message = ""
+        self.cache_hits = None
+        self.cache_misses = None
+
+        # Documents left in queue when the app last closed are resumed by the OCR process
+        with read_only():
+            for job, done, pages in unfinished_jobs():
+                self.jobs[job.id] = [job.name, done, pages]
+        if len(self.jobs) > 0:
+            self.update_status_bar()
+
+    def new_doc(self, name, doc_id, pages, oem, psm, best, preprocessing, codec, quality, priority, render):
+        """Queue the document in the database, then send its job to ocr process"""
+        job_id = create_job(name, doc_id, pages,
+                            (oem, psm, best, preprocessing, codec, quality), priority, render)
+        self.process_queue.put(('job', job_id))
+        self.jobs[job_id] = [name, 0, len(pages)]
+        self.update_status_bar()
 
-    def new_doc(self, name, doc_id, temp_folders, filenames, oem, psm, best, preprocessing):
-        """Send filenames and doc name to ocr process"""
-        self.process_queue.put(
-            (name, doc_id, temp_folders, filenames, (oem, psm, best, preprocessing)))
-        self.docs_in_queue += 1
+    def cancel_job(self, job_id):
+        """Stops processing a queued document, the pages already processed stay in the document"""
+        self.process_queue.put(('cancel', job_id))
+        self.jobs.pop(job_id, None)
         self.update_status_bar()
 
-    @ Qc.Slot(int)
-    def set_document_process_status(self, current_doc_process_status):
-        self.current_doc_process_status = current_doc_process_status
+    @ Qc.Slot(int, int, int)
+    def set_job_progress(self, job_id, processed, total):
+        if job_id in self.jobs:
+            if processed == total:
+                del self.jobs[job_id]
+            else:
+                self.jobs[job_id][1:] = [processed, total]
         self.update_status_bar()
 
+    @ Qc.Slot(int, int)
+    def set_cache_stats(self, hits, misses):
+        self.cache_hits = hits
+        self.cache_misses = misses
+        self.show_status(self.status_message)
+
+    def show_status(self, message):
+        """Shows message in the status bar, followed by the OCR cache counters once they are known"""
+        self.status_message = message
+        if self.cache_hits is not None:
+            message = f"{message} OCR cache: {self.cache_hits} hits, {self.cache_misses} misses.".strip()
+        self.statusBar().showMessage(message)
+
     def update_status_bar(self):
-        self.statusBar().showMessage(
-            f"{self.docs_in_queue} documents in queue. Current document {self.current_doc_process_status}% complete.")
-        if self.current_doc_process_status == 100:
-            self.docs_in_queue -= 1
-            self.current_doc_process_status = 0
-            if self.docs_in_queue == 0:
-                self.statusBar().showMessage("All documents processed.")
-            else:
-                self.update_status_bar()
+        self.cancel_menu.clear()
+        for job_id, (name, _, _) in self.jobs.items():
+            self.cancel_menu.addAction(
+                name, lambda job_id=job_id: self.cancel_job(job_id))
+        self.cancel_button.setVisible(len(self.jobs) > 0)
+        if len(self.jobs) == 0:
+            self.show_status("All documents processed.")
+        else:
+            progress = ", ".join(f"{name} {processed * 100 // total}%"
+                                 for name, processed, total in self.jobs.values())
+            self.show_status(
+                f"{len(self.jobs)} documents in queue: {progress}.")
 
 
 class MainUI(Qw.QWidget):
@@ -0,0 +1,116 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from peewee import DatabaseProxy
+from playhouse.sqlite_ext import SqliteExtDatabase
+
+
+class ManagedDatabase(SqliteExtDatabase):
+    """
+    SqliteExtDatabase that keeps one long-lived connection per thread.
+    connect() reuses the thread's connection and close() leaves it open, so the connect / close
+    pairs around UI actions cost nothing and sqlite3's prepared statement cache stays warm.
+    Call shutdown() to really close the calling thread's connection.
+    """
+
+    def __init__(self, database, cached_statements: int = 512, **kwargs) -> None:
+        """
+        Parameters
+        database - filepath (or URI, with uri=True) of the database
+        cached_statements - prepared statements kept per connection for reuse
+        kwargs - passed on to SqliteExtDatabase
+        """
+        self._counter_lock = threading.Lock()
+        self._connections_opened = 0
+        self._statements_executed = 0
+        # Connections inherited through fork are kept referenced, never closed or used (see _after_fork)
+        self._inherited_connections = []
+        # sqlite3 caches prepared statements per connection, keyed by SQL text
+        super().__init__(database, cached_statements=cached_statements, **kwargs)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    @property
+    def connections_opened(self) -> int:
+        """Number of connections opened since startup"""
+        return self._connections_opened
+
+    @property
+    def statements_executed(self) -> int:
+        """Number of SQL statements executed since startup"""
+        return self._statements_executed
+
+    def init(self, database, **kwargs) -> None:
+        # Really close the connection to the previous database
+        if hasattr(self, 'deferred') and not self.deferred:
+            self.shutdown()
+        super().init(database, **kwargs)
+
+    def _connect(self):
+        with self._counter_lock:
+            self._connections_opened += 1
+        return super()._connect()
+
+    def connect(self, reuse_if_open: bool = True) -> bool:
+        return super().connect(reuse_if_open=reuse_if_open)
+
+    def close(self) -> bool:
+        # The connection stays open for the next action of this thread
+        return False
+
+    def shutdown(self) -> bool:
+        """Closes the calling thread's connection"""
+        return super().close()
+
+    def execute_sql(self, sql, params=None, **kwargs):
+        with self._counter_lock:
+            self._statements_executed += 1
+        return super().execute_sql(sql, params, **kwargs)
+
+    def _after_fork(self) -> None:
+        """
+        A SQLite connection must not be used, or closed, by a forked child. Forget the inherited
+        one so the child opens its own, while keeping it referenced so it is never finalized.
+        """
+        if not self._state.closed:
+            self._inherited_connections.append(self._state.conn)
+        self._state = type(self._state)()
+        self._lock = threading.Lock()
+        self._counter_lock = threading.Lock()
+
+
+class ThreadBoundDatabase(DatabaseProxy):
+    """
+    Database for models to be bound to, standing for the database it is initialized with, or on a thread
+    within bind_thread, for the database given to it. Unlike Model.bind_ctx, which rebinds the models
+    for every thread at once, each thread binds on its own.
+    """
+    __slots__ = ('_default', '_local')
+    # Proxy only lets its own slots be set, obj is a property here
+    __setattr__ = object.__setattr__
+
+    def __init__(self, database) -> None:
+        self._local = threading.local()
+        super().__init__()
+        self.initialize(database)
+
+    @property
+    def obj(self):
+        database = getattr(self._local, 'database', None)
+        return self._default if database is None else database
+
+    @obj.setter
+    def obj(self, database) -> None:
+        # Set by initialize, for every thread
+        self._default = database
+
+    @contextmanager
+    def bind_thread(self, database):
+        """Stands for database on the calling thread within the block"""
+        previous = getattr(self._local, 'database', None)
+        self._local.database = database
+        try:
+            yield
+        finally:
+            self._local.database = previous
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import time
+import zlib
+
+import numpy as np
+from peewee import Model, CharField, BlobField, IntegerField, FloatField, fn
+
+from StudiOCR.util import get_absolute_path
+from StudiOCR.ManagedDatabase import ManagedDatabase
+
+# Tesseract results are cached in their own database, next to the document database
+CACHE_DATABASE = get_absolute_path('ocr_cache.db')
+# Total size of the cached results, least recently used results are evicted past it
+CACHE_MAX_BYTES = 128 * 1024 * 1024
+
+# Every OCR worker process looks up and stores results concurrently
+cache_db = ManagedDatabase(CACHE_DATABASE, autoconnect=False, c_extensions=None, timeout=30, pragmas={
+    'journal_mode': 'wal',
+    'synchronous': 'normal'})
+
+
+class OcrCacheEntry(Model):
+    # OcrCache.key of the page and OCR settings
+    key = CharField(primary_key=True)
+    # image_to_data dict as compressed JSON
+    data = BlobField(null=False)
+    size = IntegerField(null=False)
+    last_used = FloatField(null=False, index=True)
+
+    class Meta:
+        database = cache_db
+
+
+# Lookups since the cache was created, a single row
+class OcrCacheStats(Model):
+    hits = IntegerField(default=0)
+    misses = IntegerField(default=0)
+
+    class Meta:
+        database = cache_db
+
+
+class OcrCache:
+    """
+    Persistent cache of Tesseract results (image_to_data dicts), so pages that were already recognized with the
+    same settings skip OCR. Kept to max_bytes by evicting the least recently used results.
+    """
+
+    def __init__(self, path: str = CACHE_DATABASE, max_bytes: int = CACHE_MAX_BYTES) -> None:
+        """
+        Parameters
+        path - filepath of the cache database, created if missing
+        max_bytes - total size of the cached results to keep
+        """
+        self._max_bytes = max_bytes
+        if cache_db.database != path:
+            cache_db.init(path)
+        self._tables_created = False
+
+    @staticmethod
+    def key(image: np.ndarray, oem: int, psm: int, model: str, pipeline_signature: str) -> str:
+        """
+        Identifies a page and the settings it is recognized with
+
+        Parameters
+        image - decoded page image, hashed by its pixels so re-encoded copies of a page match
+        oem - OCR engine mode (0-3)
+        psm - page segmentation mode (3-13)
+        model - name of the model ('best' or 'fast')
+        pipeline_signature - ImagePipeline.signature of the preprocessing, or None without preprocessing
+        """
+        digest = hashlib.sha256()
+        digest.update(f'{image.shape} {image.dtype}'.encode('utf-8'))
+        digest.update(np.ascontiguousarray(image).data)
+        digest.update(
+            f'{oem} {psm} {model} {pipeline_signature}'.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _connect(self) -> None:
+        cache_db.connect()
+        if not self._tables_created:
+            with cache_db.atomic('IMMEDIATE'):
+                cache_db.create_tables(
+                    [OcrCacheEntry, OcrCacheStats], safe=True)
+                if not OcrCacheStats.select().exists():
+                    OcrCacheStats.create()
+            self._tables_created = True
+
+    def get(self, key: str) -> dict:
+        """image_to_data dict cached under key, None on a miss. Counts the hit or miss."""
+        self._connect()
+        # Take the write lock up front, upgrading a read lock fails instead of waiting when workers contend
+        with cache_db.atomic('IMMEDIATE'):
+            entry = OcrCacheEntry.get_or_none(OcrCacheEntry.key == key)
+            if entry is None:
+                OcrCacheStats.update(misses=OcrCacheStats.misses + 1).execute()
+                return None
+            OcrCacheStats.update(hits=OcrCacheStats.hits + 1).execute()
+            (OcrCacheEntry
+             .update(last_used=time.time())
+             .where(OcrCacheEntry.key == key)
+             .execute())
+        return json.loads(zlib.decompress(entry.data))
+
+    def put(self, key: str, page_data: dict) -> None:
+        """Caches an image_to_data dict under key, then evicts results past max_bytes"""
+        self._connect()
+        data = zlib.compress(json.dumps(page_data).encode('utf-8'))
+        with cache_db.atomic('IMMEDIATE'):
+            (OcrCacheEntry
+             .replace(key=key, data=data, size=len(data), last_used=time.time())
+             .execute())
+            total = OcrCacheEntry.select(fn.SUM(OcrCacheEntry.size)).scalar()
+            if total > self._max_bytes:
+                # Keep the most recently used results that fit within max_bytes
+                cache_db.execute_sql('''DELETE FROM ocrcacheentry WHERE key IN (
+                                          SELECT key FROM (
+                                            SELECT key, SUM(size) OVER (ORDER BY last_used DESC) AS kept
+                                            FROM ocrcacheentry)
+                                          WHERE kept > ?);''', (self._max_bytes,))
+
+    def stats(self) -> tuple:
+        """(hits, misses) counted since the cache was created"""
+        self._connect()
+        row = OcrCacheStats.select().first()
+        return (row.hits, row.misses)
+
+
+_ocr_cache = None
+
+
+def ocr_cache() -> OcrCache:
+    """Cache of this process, an OcrCache of CACHE_DATABASE unless set_ocr_cache was called"""
+    global _ocr_cache
+    if _ocr_cache is None:
+        _ocr_cache = OcrCache()
+    return _ocr_cache
+
+
+def set_ocr_cache(cache: OcrCache) -> None:
+    """Replaces the cache OCR results are looked up in and stored to"""
+    global _ocr_cache
+    _ocr_cache = cache
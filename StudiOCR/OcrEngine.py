@@ -1,28 +1,88 @@
-import pickle
-import os
+import io
+from multiprocessing.pool import Pool
 
 import numpy as np
-from peewee import fn
+from peewee import fn, chunked
 import cv2
-import pytesseract
-from pytesseract import Output
+from PIL import Image
 
 from pdf2image import convert_from_path, convert_from_bytes
 
 
 from StudiOCR.util import get_absolute_path
-from StudiOCR.db import (db, OcrDocument, OcrPage, OcrBlock, create_tables)
+from StudiOCR.db import (db, OcrDocument, OcrPage, OcrBlock, OcrPageFts, OcrThumbnail,
+                         image_store, make_thumbnail, SQLITE_MAX_VARIABLES)
 from StudiOCR.ImagePipeline import ImagePipeline
 from StudiOCR.OcrPageData import OcrPageData
+from StudiOCR.PageImageCodec import PageImageCodec
+from StudiOCR.SharedImage import SharedImage, SharedImageBuffer
+from StudiOCR.TesseractEngine import engine_for
+from StudiOCR.OcrCache import OcrCache, ocr_cache
+from StudiOCR.RasterCache import raster_cache
+
+
+# Columns of an OcrBlock row, in the order block_rows builds them
+BLOCK_FIELDS = [OcrBlock.left, OcrBlock.top, OcrBlock.width,
+                OcrBlock.height, OcrBlock.conf, OcrBlock.text,
+                OcrBlock.block_num, OcrBlock.par_num, OcrBlock.line_num, OcrBlock.word_num,
+                OcrBlock.position, OcrBlock.page]
+# Rows per INSERT, as many as fit within the statement's host parameter limit
+BLOCK_BATCH_SIZE = SQLITE_MAX_VARIABLES // len(BLOCK_FIELDS)
+
+
+class PageWork:
+    """A page going through the ingest stages, with what each stage has produced for it so far"""
+
+    def __init__(self, idx: int, filepath: str, oem: int = 3, psm: int = 3, best: bool = True,
+                 preprocessing: bool = False, codec: str = PageImageCodec.PASSTHROUGH,
+                 quality: int = PageImageCodec.DEFAULT_QUALITY, job_id: int = None, page_data: dict = None,
+                 pdf_page: tuple = None) -> None:
+        """
+        Parameters
+        idx - index of the page among the pages processed together
+        filepath, oem, psm, best, preprocessing, codec, quality - as in OcrEngine.process_image
+        job_id - id of the OcrJob the page belongs to, if any
+        page_data - image_to_data dict of the page when its words are already known, such as from a PDF
+                    text layer, the page then skips OCR
+        pdf_page - (PDF filepath, page number, DPI, color mode) of a page rasterized into the RasterCache
+        """
+        self.idx = idx
+        self.filepath = filepath
+        self.oem = oem
+        self.psm = psm
+        self.best = best
+        self.preprocessing = preprocessing
+        self.codec = codec
+        self.quality = quality
+        self.job_id = job_id
+        self.pdf_page = pdf_page
+        # Set by decode_page
+        self.original_bytes = None
+        self.image = None
+        self.cache_key = None
+        # Set by preprocess_page, the image handed to Tesseract
+        self.ocr_image = None
+        # image_to_data dict, given or from the cache or the OCR stage
+        self.page_data = page_data
+        # (page_data, image_stored_bytes, OcrPageData) as committed, set by encode_page
+        self.result = None
+        # Exception raised by a stage, the stages after it skip the page
+        self.error = None
+
+    @property
+    def tessdata_path(self) -> str:
+        """Directory of the model the page is recognized with"""
+        return get_absolute_path('tessdata/best' if self.best else 'tessdata/fast')
 
 
 class OcrEngine:
     """Processes image for each page of a document and then integrates with Sqlite database"""
 
     @staticmethod
-    def process_image(idx: int, filepath: str, oem: int = 3, psm: int = 3, best: bool = True, preprocessing: bool = False) -> tuple:
+    def process_image(idx: int, filepath: str, oem: int = 3, psm: int = 3, best: bool = True, preprocessing: bool = False,
+                      codec: str = PageImageCodec.PASSTHROUGH, quality: int = PageImageCodec.DEFAULT_QUALITY) -> tuple:
         """
-        Processes image using ImagePipeline
+        Processes image using ImagePipeline, running the ingest stages one after the other
 
         Parameters
         filepath - filepath where image or PDF is stored
@@ -30,84 +90,182 @@ class OcrEngine:
         psm - page segmentation mode (0-13) Modes 0-2 don't perform OCR, so don't allow those
         best - whether to use the best model (or fast model)
         preprocessing - whether to refine image temporarily with ImagePipeline before running pytesseract
+        codec - PageImageCodec codec the page image is stored with
+        quality - quality (1-100) of the lossy codecs
         """
-
+        work = PageWork(idx, filepath, oem, psm, best,
+                        preprocessing, codec, quality)
         try:
-            if oem not in range(4):
-                raise ValueError(
-                    'oem must be an integer between 0 and 3 inclusive')
-            if psm not in range(3, 14):
-                raise ValueError(
-                    'psm must be an integer between 3 and 13 inclusive')
+            OcrEngine.decode_page(work)
         except ValueError as error:
             print(str(error))
             return
+        OcrEngine.preprocess_page(work)
+        OcrEngine.recognize_page(work)
+        OcrEngine.encode_page(work)
+        return (idx, work.result)
 
-        image_cv2 = cv2.imread(
-            filename=filepath, flags=cv2.IMREAD_COLOR)
+    @staticmethod
+    def grayscale_flat_field_correction(src: np.ndarray, ksize: int = 99) -> np.ndarray:
+        image_grayscale = src if src.ndim == 2 else cv2.cvtColor(
+            src=src, code=cv2.COLOR_BGR2GRAY)
+        blur = cv2.medianBlur(src=image_grayscale, ksize=ksize)
+        mean = cv2.mean(src=blur)[0]
 
-        tessdata_best_path = get_absolute_path('tessdata/best')
-        tessdata_fast_path = get_absolute_path('tessdata/fast')
+        # It's fine if we divide by zero
+        with np.errstate(divide='ignore', invalid='ignore'):
+            flat_field = (image_grayscale * mean) / blur
+        return flat_field
 
-        tessdata_path = tessdata_best_path if best else tessdata_fast_path
+    @staticmethod
+    def image_pipeline() -> ImagePipeline:
+        """Preprocessing run on pages before OCR when preprocessing is enabled"""
+        image_pipeline = ImagePipeline()
+        image_pipeline.add_step(name='Grayscale', new_step=cv2.cvtColor,
+                                image_param_name='src', other_params={'code': cv2.COLOR_RGB2GRAY})
+        image_pipeline.add_step(name='Flat-Field', new_step=OcrEngine.grayscale_flat_field_correction,
+                                image_param_name='src', other_params={'ksize': 91})
+        return image_pipeline
 
-        custom_config = f'--oem {oem} --psm {psm} --tessdata-dir "{tessdata_path}"'
+    @staticmethod
+    def decode_page(work: PageWork) -> PageWork:
+        """
+        Decode stage: checks the settings, reads and decodes the page image and looks up its OCR results in the cache.
+        Raises ValueError for invalid settings.
+        """
+        if work.oem not in range(4):
+            raise ValueError(
+                'oem must be an integer between 0 and 3 inclusive')
+        if work.psm not in range(3, 14):
+            raise ValueError(
+                'psm must be an integer between 3 and 13 inclusive')
+        PageImageCodec(codec=work.codec, quality=work.quality)
+        if work.filepath is None:
+            raise ValueError('the page could not be rasterized')
 
-        # Running pipeline and collecting image metadata
+        # The file is read once, for decoding and possibly for storing as is
+        try:
+            with open(work.filepath, 'rb') as image_file:
+                work.original_bytes = image_file.read()
+        except FileNotFoundError:
+            if work.pdf_page is None:
+                raise
+            # Evicted from the RasterCache by another process since it was rasterized, render it again
+            filepath, page, dpi, color = work.pdf_page
+            work.filepath = raster_cache().pages(filepath, [page], dpi, color)[0]
+            with open(work.filepath, 'rb') as image_file:
+                work.original_bytes = image_file.read()
+        work.image = cv2.imdecode(buf=np.frombuffer(
+            work.original_bytes, dtype=np.uint8), flags=cv2.IMREAD_COLOR)
 
-        # Image to be stored - cv2 / numpy array format
-        # cv2 stores images in BGR format, but pytesseract assumes RGB format. Perform conversion.
-        rgb_image_cv2 = cv2.cvtColor(src=image_cv2, code=cv2.COLOR_BGR2RGB)
+        # Pages already recognized with the same settings skip preprocessing and OCR
+        if work.page_data is None:
+            work.cache_key = OcrCache.key(image=work.image, oem=work.oem, psm=work.psm,
+                                          model='best' if work.best else 'fast',
+                                          pipeline_signature=OcrEngine.image_pipeline().signature() if work.preprocessing else None)
+            work.page_data = ocr_cache().get(work.cache_key)
+        return work
 
-        # Setting up and running image processing pipeline, if necessary
-        def grayscale_flat_field_correction(src: np.ndarray, ksize: int = 99) -> np.ndarray:
-            image_grayscale = src if src.ndim == 2 else cv2.cvtColor(
-                src=src, code=cv2.COLOR_BGR2GRAY)
-            blur = cv2.medianBlur(src=image_grayscale, ksize=ksize)
-            mean = cv2.mean(src=blur)[0]
+    @staticmethod
+    def preprocess_page(work: PageWork) -> PageWork:
+        """Preprocess stage: prepares the image handed to Tesseract, unless the page's results were cached"""
+        if work.page_data is None:
+            # cv2 stores images in BGR format, but pytesseract assumes RGB format. Perform conversion.
+            rgb_image_cv2 = cv2.cvtColor(src=work.image, code=cv2.COLOR_BGR2RGB)
+            work.ocr_image = OcrEngine.image_pipeline().run(
+                image=rgb_image_cv2) if work.preprocessing else rgb_image_cv2
+        return work
 
-            # It's fine if we divide by zero
-            with np.errstate(divide='ignore', invalid='ignore'):
-                flat_field = (image_grayscale * mean) / blur
-            return flat_field
+    @staticmethod
+    def recognize(image: np.ndarray, tessdata_path: str, oem: int, psm: int) -> dict:
+        """
+        Collects metadata on page text, the image_to_data dict of the image.
+        The calling process keeps its engine, and the model it loaded, for the following pages.
+        """
+        return engine_for(tessdata_path, oem).image_to_data(image=image, psm=psm)
 
-        image_pipeline = ImagePipeline()
-        image_pipeline.add_step(name='Grayscale', new_step=cv2.cvtColor,
-                                image_param_name='src', other_params={'code': cv2.COLOR_RGB2GRAY})
-        image_pipeline.add_step(name='Flat-Field', new_step=grayscale_flat_field_correction,
-                                image_param_name='src', other_params={'ksize': 91})
+    @staticmethod
+    def recognize_shared(image: SharedImage, tessdata_path: str, oem: int, psm: int) -> dict:
+        """recognize, reading the image from shared memory"""
+        return image.apply(OcrEngine.recognize, tessdata_path, oem, psm)
 
-        # Image to be directly stored in db as RGB image in bytes with no loss during compression
-        # cv2.imencode is expecting BGR image, not RGB
-        image_stored_bytes = cv2.imencode(ext='.jpg', img=image_cv2, params=[
-                                          cv2.IMWRITE_JPEG_QUALITY, 100])[1].tostring()
-        image_for_pytesseract = image_pipeline.run(
-            image=rgb_image_cv2) if preprocessing else rgb_image_cv2
-        # Collects metadata on page text after refining with pipeline
-        os.environ['OMP_THREAD_LIMIT'] = '1'
-        page_data = pytesseract.image_to_data(
-            image=image_for_pytesseract, config=custom_config, output_type=Output.DICT)
+    @staticmethod
+    def recognize_page(work: PageWork, pool: Pool = None, buffer: SharedImageBuffer = None) -> PageWork:
+        """
+        OCR stage: recognizes the page, unless its results were cached, and caches them
 
+        Parameters
+        work - the page, through the preprocess stage
+        pool - process pool Tesseract runs in, the calling process if None
+        buffer - shared memory the image is handed to the pool through, instead of pickling its pixels.
+                 Owned by the calling thread, as it holds the image until the pool is done with it.
+        """
+        if work.page_data is None:
+            settings = (work.tessdata_path, work.oem, work.psm)
+            if pool is None:
+                work.page_data = OcrEngine.recognize(work.ocr_image, *settings)
+            elif buffer is None:
+                work.page_data = pool.apply(
+                    OcrEngine.recognize, (work.ocr_image, *settings))
+            else:
+                work.page_data = pool.apply(
+                    OcrEngine.recognize_shared, (buffer.share(work.ocr_image), *settings))
+            ocr_cache().put(work.cache_key, work.page_data)
+        work.ocr_image = None
+        return work
+
+    @staticmethod
+    def encode_page(work: PageWork) -> PageWork:
+        """Encode stage: encodes the image to be stored according to the storage policy and sets the page's result"""
+        # cv2.imencode is expecting BGR image, not RGB
+        image_stored_bytes = PageImageCodec(codec=work.codec, quality=work.quality).encode(
+            image=work.image, original=work.original_bytes)
         # OCRPageData object creation
         # Metadata on pipeline-refined image
-        ocr_page_data = OcrPageData(image_to_data=page_data)
+        ocr_page_data = OcrPageData(image_to_data=work.page_data)
+        work.result = (work.page_data, image_stored_bytes, ocr_page_data)
+        # Only the result is kept until the page is committed
+        work.original_bytes = None
+        work.image = None
+        return work
 
-        return (idx, (page_data, image_stored_bytes, ocr_page_data))
+    @staticmethod
+    def warm_up(best: bool = True, oem: int = 3) -> None:
+        """
+        Loads the Tesseract model of the default settings ahead of the first page.
+        Run by every process of the OCR pool as it starts.
+
+        Parameters
+        best - whether to load the best model (or fast model)
+        oem - OCR engine mode (0-3)
+        """
+        tessdata_path = get_absolute_path(
+            'tessdata/best' if best else 'tessdata/fast')
+        engine_for(tessdata_path, oem)
 
     @staticmethod
     def commit_data(name, doc_id, data) -> int:
-        # If the database doesn't exist yet, generate it
-        create_tables()
+        # create_tables has run by now: once when the OCR process starts, not on every batch
         db.connect(reuse_if_open=True)
-        with db.atomic():
+        block_rows = []
+        page_rows = []
+        # Page images are put under the write lock, which delete_document and collect_unused_images take
+        # before removing the images no page uses
+        with db.atomic('IMMEDIATE'):
             # Create a new entry for the document to link the pages and boxes to
 
             num_pages = 0
 
             # If the document already exists, then append pages to the end of it.
+            # Raises OcrDocument.DoesNotExist if it was deleted meanwhile.
             if doc_id is not None:
                 doc = OcrDocument.get(OcrDocument.id == doc_id)
-                num_pages = len(doc.pages)
+                # Read from the end of the (document, number) index, rather than loading every page
+                last_page = (OcrPage
+                             .select(fn.MAX(OcrPage.number))
+                             .where(OcrPage.document == doc.id)
+                             .scalar())
+                num_pages = 0 if last_page is None else last_page + 1
             else:
                 # If multiple documents with the same name are in queue, avoid crashing
                 # by appending numbers to the name until the name is unique
@@ -123,14 +281,48 @@ class OcrEngine:
 
             data.sort(key=lambda x: x[0])
 
-            # Adding OcrPage objects to database
+            # Adding OcrPage objects to database, their blocks are gathered and inserted in batches
             for page_number, (_, (page_data, image_file, ocr_page_data)) in enumerate(data):
-                page = OcrPage.create(number=page_number+num_pages, image=image_file,
-                                      document=doc.id, ocr_page_data=pickle.dumps(obj=ocr_page_data))
-                for text_index, text in enumerate(page_data['text']):
-                    if not text.isspace():  # Uploads non-space text pieces only
-                        OcrBlock.create(page=page.id, left=page_data['left'][text_index],
-                                        top=page_data['top'][text_index],
-                                        width=page_data['width'][text_index], height=page_data['height'][text_index],
-                                        conf=page_data['conf'][text_index], text=text)
+                # Only the header is read to get the dimensions
+                width, height = Image.open(io.BytesIO(image_file)).size
+                page = OcrPage.create(number=page_number+num_pages, image_hash=image_store().put(image_file),
+                                      width=width, height=height, document=doc.id,
+                                      ocr_page_data=ocr_page_data.serialize())
+                block_rows.extend(OcrEngine.block_rows(page.id, page_data))
+                # The page's words in reading order, as ranked_search scores them
+                page_rows.append((page.id, ' '.join(text for text in page_data['text'] if text.strip()), doc.id))
+                # The thumbnail shown in the document grid is made once, from the first page
+                if page.number == 0:
+                    OcrThumbnail.create(
+                        document=doc.id, image=make_thumbnail(image_file))
+            for batch in chunked(block_rows, BLOCK_BATCH_SIZE):
+                OcrBlock.insert_many(batch, fields=BLOCK_FIELDS).execute()
+            for batch in chunked(page_rows, SQLITE_MAX_VARIABLES // 3):
+                OcrPageFts.insert_many(batch, fields=[OcrPageFts.rowid, OcrPageFts.text,
+                                                      OcrPageFts.document_id]).execute()
         return doc_id
+
+    @staticmethod
+    def block_rows(page_id: int, page_data: dict) -> list:
+        """
+        Builds OcrBlock rows (in BLOCK_FIELDS order) column by column from an image_to_data dict
+
+        Parameters
+        page_id - id of the OcrPage the blocks belong to
+        page_data - pytesseract image_to_data output for the page
+        """
+        # Uploads non-space text pieces only
+        keep = [index for index, text in enumerate(
+            page_data['text']) if not text.isspace()]
+        columns = [[page_data[key][index] for index in keep]
+                   for key in ('left', 'top', 'width', 'height', 'conf', 'text')]
+        # Results cached before the layout keys were kept have none
+        layout = [page_data.get(key) for key in OcrPageData.LAYOUT_KEYS]
+        columns.extend([[None if column is None else column[index] for index in keep] for column in layout])
+        # Words are numbered in reading order, by their block, paragraph, line and word numbers
+        words = [index for index in keep if page_data['text'][index].strip()]
+        if all(column is not None for column in layout):
+            words.sort(key=lambda index: tuple(column[index] for column in layout))
+        positions = {index: position for position, index in enumerate(words)}
+        columns.append([positions.get(index) for index in keep])
+        return list(zip(*columns, [page_id] * len(keep)))
@@ -1,4 +1,6 @@
+from __future__ import annotations
 from collections import Counter, OrderedDict
+import io
 import numpy as np
 import pytesseract
 from pytesseract import Output
@@ -7,6 +9,12 @@ from pytesseract import Output
 class OcrPageData:
     """Container for raw image data and detected words"""
 
+    # Version of the serialize format, stored alongside the columns
+    FORMAT_VERSION = 2
+    # Tesseract's numbering of each word within its page, in reading order.
+    # Pages without them, serialized before FORMAT_VERSION 2, read them as 0.
+    LAYOUT_KEYS = ('block_num', 'par_num', 'line_num', 'word_num')
+
     def __init__(self, image_to_data: dict) -> None:
         """
         Gathers pytesseract data on image of a page
@@ -27,59 +35,129 @@ class OcrPageData:
 
         result_data = image_to_data
         # index of text in original image_to_data['text'] array
-        text_index = np.array([], dtype=int)
-        for index, text in enumerate(np.asarray(a=result_data['text']), start=0):
-            if not text.isspace():
-                text_index = np.append(arr=text_index, values=index)
-
-        raw_texts = result_data['text']
-        texts = np.asarray(a=raw_texts)[text_index]
-        # Counts number of occurrences of each text piece
-        self.__text_counter = Counter(texts)
-        # Unique detected texts, sorted alphabetically
-        self.__texts = np.asarray(a=sorted(list(self.text_counter.keys())))
-        chars = list(''.join(result_data['text']))
-        # Counts number of occurences of each character
-        self.__char_counter = Counter(chars)
-        # Unique number of occurrences of each character, sorted alphabetically
-        self.__chars = np.asarray(a=sorted(list(self.char_counter.keys())))
-
-        # Retrieving text bounding box information
-        self.__left = np.asarray(a=result_data['left'])[text_index]
-        self.__top = np.asarray(a=result_data['top'])[text_index]
-        self.__width = np.asarray(a=result_data['width'])[text_index]
-        self.__height = np.asarray(a=result_data['height'])[text_index]
-
-        # Retrieving confidence level information as a dict of sets of conf values for a unique text
-        raw_confidence_levels = result_data['conf']
-        confidence_levels = np.asarray(a=raw_confidence_levels)[
-            text_index]  # Corresponds to kept texts
-        self.__confidence_level = dict()
-        for text, conf in zip(texts, confidence_levels):
-            if text in self.__confidence_level:  # Check if text is already added
-                self.__confidence_level[text].add(conf)
+        text_index = np.array([index for index, text in enumerate(result_data['text'])
+                               if not text.isspace()], dtype=int)
+
+        texts = [result_data['text'][index] for index in text_index]
+        self.__columns = OcrPageData.text_table(texts)
+        # Retrieving text bounding box and confidence level information
+        for key in ('left', 'top', 'width', 'height'):
+            self.__columns[key] = np.asarray(
+                a=result_data[key], dtype=np.int32)[text_index]
+        self.__columns['conf'] = np.asarray(
+            a=result_data['conf'], dtype=np.float32)[text_index]
+        for key in OcrPageData.LAYOUT_KEYS:
+            self.__columns[key] = (np.asarray(a=result_data[key], dtype=np.int32)[text_index] if key in result_data
+                                   else np.zeros(len(text_index), dtype=np.int32))
+        self.__cache = dict()
+
+    @classmethod
+    def from_columns(cls, columns: dict) -> OcrPageData:
+        """
+        Builds page data from per-word columns, as stored in OcrBlock rows
+
+        Parameters
+        columns - dict of equal length sequences for 'left', 'top', 'width', 'height', 'conf' and 'text',
+                  optionally LAYOUT_KEYS
+        """
+        page_data = cls.__new__(cls)
+        page_data.__columns = OcrPageData.text_table(list(columns['text']))
+        for key in ('left', 'top', 'width', 'height'):
+            page_data.__columns[key] = np.asarray(
+                a=columns[key], dtype=np.int32)
+        page_data.__columns['conf'] = np.asarray(
+            a=columns['conf'], dtype=np.float32)
+        for key in OcrPageData.LAYOUT_KEYS:
+            page_data.__columns[key] = (np.asarray(a=columns[key], dtype=np.int32) if key in columns
+                                        else np.zeros(len(columns['text']), dtype=np.int32))
+        page_data.__cache = dict()
+        return page_data
+
+    @staticmethod
+    def text_table(texts: list) -> dict:
+        """String table for texts: their UTF-8 bytes back to back, and offsets where each one starts and ends"""
+        encoded = [text.encode('utf-8') for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in encoded], out=offsets[1:])
+        return {'text_data': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+                'text_offsets': offsets}
+
+    def serialize(self) -> bytes:
+        """
+        Encodes the page data as an uncompressed npz archive, one array per column plus a string table
+        """
+        output = io.BytesIO()
+        np.savez(output, version=np.array(OcrPageData.FORMAT_VERSION),
+                 **{key: self.__column(key) for key in ('left', 'top', 'width', 'height', 'conf',
+                                                        'text_data', 'text_offsets', *OcrPageData.LAYOUT_KEYS)})
+        return output.getvalue()
+
+    @classmethod
+    def deserialize(cls, data: bytes) -> OcrPageData:
+        """
+        Opens page data written by serialize. Columns are only read once they are accessed.
+        """
+        columns = np.load(io.BytesIO(data), allow_pickle=False)
+        version = int(columns['version'])
+        if version > OcrPageData.FORMAT_VERSION:
+            raise ValueError(
+                f'page data format version {version} is newer than the supported version {OcrPageData.FORMAT_VERSION}')
+        page_data = cls.__new__(cls)
+        page_data.__columns = columns
+        page_data.__cache = dict()
+        return page_data
+
+    def __column(self, key: str) -> np.ndarray:
+        """Reads a column once, from the npz archive if deserialized"""
+        if key not in self.__cache:
+            if key in OcrPageData.LAYOUT_KEYS and key not in self.__columns:
+                self.__cache[key] = np.zeros(len(self.__column('text_offsets')) - 1, dtype=np.int32)
             else:
-                self.__confidence_level.update({text: {conf}})
+                self.__cache[key] = self.__columns[key]
+        return self.__cache[key]
+
+    @property
+    def words(self) -> np.ndarray:
+        """Gets each detected text, in detection order"""
+        if 'words' not in self.__cache:
+            text_data = self.__column('text_data').tobytes()
+            offsets = self.__column('text_offsets')
+            self.__cache['words'] = np.asarray(a=[text_data[start:end].decode('utf-8')
+                                                  for start, end in zip(offsets[:-1], offsets[1:])], dtype=str)
+        return self.__cache['words']
 
     @property
     def char_counter(self) -> Counter:
         """Get Counter object for detected characters"""
-        return self.__char_counter
+        if 'char_counter' not in self.__cache:
+            # Counts number of occurences of each character
+            self.__cache['char_counter'] = Counter(''.join(self.words))
+        return self.__cache['char_counter']
 
     @property
     def chars(self) -> np.ndarray:
         """Gets list of unique characters detected from image"""
-        return self.__chars
+        # Unique number of occurrences of each character, sorted alphabetically
+        return np.asarray(a=sorted(list(self.char_counter.keys())))
 
     @property
     def confidence_level(self) -> dict:
         """Gets a dict of confidence levels for each unique text"""
-        return self.__confidence_level
+        if 'confidence_level' not in self.__cache:
+            # Confidence level information as a dict of sets of conf values for a unique text
+            confidence_level = dict()
+            for text, conf in zip(self.words, self.__column('conf')):
+                confidence_level.setdefault(text, set()).add(conf)
+            self.__cache['confidence_level'] = confidence_level
+        return self.__cache['confidence_level']
 
     @property
     def text_counter(self) -> Counter:
         """Get Counter object for detected words"""
-        return self.__text_counter
+        if 'text_counter' not in self.__cache:
+            # Counts number of occurrences of each text piece
+            self.__cache['text_counter'] = Counter(self.words)
+        return self.__cache['text_counter']
 
     def char_histogram(self) -> (np.ndarray, np.ndarray):
         """Histogram of frequencies for each ASCII character"""
@@ -93,24 +171,50 @@ class OcrPageData:
     @property
     def texts(self) -> np.ndarray:
         """Gets list of unique text (both alpha and numerical) detected from image"""
-        return self.__texts
+        # Unique detected texts, sorted alphabetically
+        return np.asarray(a=sorted(list(self.text_counter.keys())))
 
     @property
     def left(self) -> np.ndarray:
         """Gets left x-value of bounding box for each detected text"""
-        return self.__left
+        return self.__column('left')
 
     @property
     def top(self) -> np.ndarray:
         """Gets top y-value of bounding box for each detected text"""
-        return self.__top
+        return self.__column('top')
 
     @property
     def width(self) -> np.ndarray:
         """Gets width of bounding box for each detected text"""
-        return self.__width
+        return self.__column('width')
 
     @property
     def height(self) -> np.ndarray:
         """Gets height of each bounding box for each detected text"""
-        return self.__height
+        return self.__column('height')
+
+    @property
+    def conf(self) -> np.ndarray:
+        """Gets confidence level for each detected text"""
+        return self.__column('conf')
+
+    @property
+    def block_num(self) -> np.ndarray:
+        """Gets the number of the block each detected text is in"""
+        return self.__column('block_num')
+
+    @property
+    def par_num(self) -> np.ndarray:
+        """Gets the number of the paragraph each detected text is in, within its block"""
+        return self.__column('par_num')
+
+    @property
+    def line_num(self) -> np.ndarray:
+        """Gets the number of the line each detected text is in, within its paragraph"""
+        return self.__column('line_num')
+
+    @property
+    def word_num(self) -> np.ndarray:
+        """Gets the number of each detected text within its line"""
+        return self.__column('word_num')
@@ -1,13 +1,26 @@
 from collections import OrderedDict
+import json
 from multiprocessing import Process, Queue, Pipe, Pool
-import shutil
+import queue
+import subprocess
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
 
 from PySide2 import QtCore as Qc
 from PySide2 import QtWidgets as Qw
 from PySide2 import QtGui as Qg
 
-from StudiOCR.db import (db, OcrDocument, OcrPage, OcrBlock, create_tables)
-from StudiOCR.OcrEngine import OcrEngine
+from StudiOCR.db import (db, OcrDocument, OcrPage, OcrBlock, OcrJob, OcrPageTask,
+                         create_tables, unfinished_jobs)
+from StudiOCR.OcrEngine import OcrEngine, PageWork
+from StudiOCR.OcrCache import ocr_cache
+from StudiOCR.PageScheduler import PageScheduler
+from StudiOCR.PdfToImage import PDFToImage
+from StudiOCR.RasterCache import raster_cache
+from StudiOCR.SharedImage import SharedImageBuffer, share_with_child_processes
+from StudiOCR.StagedPipeline import StagedPipeline, StageStats
+from StudiOCR.util import get_ocr_processes
 
 
 class StatusEmitter(Qc.QThread):
@@ -16,8 +29,11 @@ class StatusEmitter(Qc.QThread):
     """
 
     # These need to be declared as part of the class, not as part of an instance
-    document_process_status = Qc.Signal(int)
+    # Job id, pages processed and pages in the document
+    job_progress = Qc.Signal(int, int, int)
     data_available = Qc.Signal(int)
+    # OCR cache hits and misses
+    cache_stats = Qc.Signal(int, int)
 
     def __init__(self, from_ocr_process: Pipe, parent=None):
         super().__init__(parent=parent)
@@ -33,14 +49,60 @@ class StatusEmitter(Qc.QThread):
         self.running = True
         while self.running:
             try:
-                status, doc_id = self.data_from_process.recv()
+                progress, doc_id, cache_stats = self.data_from_process.recv()
             except EOFError:
                 break
             else:
-                if status is not None:
-                    self.document_process_status.emit(status)
+                if progress is not None:
+                    self.job_progress.emit(*progress)
                 if doc_id is not None:
                     self.data_available.emit(doc_id)
+                if cache_stats is not None:
+                    self.cache_stats.emit(*cache_stats)
+
+
+class DocumentJob:
+    """An OcrJob being processed, with its processed pages waiting to be committed in order"""
+
+    def __init__(self, job: OcrJob):
+        """
+        Parameters
+        job - the persisted job, its pages not done yet are processed
+        """
+        self.job_id = job.id
+        self.name = job.name
+        self.doc_id = job.document_id
+        self.options = tuple(json.loads(job.options))
+        self.priority = job.priority
+        self.render = job.render
+        tasks = list(job.tasks.order_by(OcrPageTask.number))
+        self.pages = len(tasks)
+        # The pages left, resuming after the ones committed before a restart
+        pending = [task for task in tasks if not task.done]
+        self.task_ids = [task.id for task in pending]
+        # Image files and PDFs the pages come from, with the number of each PDF page
+        self.sources = [task.filepath for task in pending]
+        self.pdf_pages = [task.pdf_page for task in pending]
+        # Image file of each page, PDF pages get theirs as they are rasterized
+        self.filepaths = [None] * len(pending)
+        # image_to_data dicts of the PDF pages with a usable text layer, which skip OCR
+        self.text_layers = [None] * len(pending)
+        # (DPI, color mode) each PDF page was rasterized at, to render it again if it is evicted before it is read
+        self.renders = [None] * len(pending)
+        self.text_layer_pages = 0
+        # Rasterized PDF pages not processed yet. Rasterizing no further ahead keeps this process from evicting
+        # them before they are read, decode_page renders again the ones evicted by the preview in the app process.
+        self.read_ahead = threading.Semaphore(OcrWorker.READ_AHEAD_PAGES)
+        # Processed pages by index into filepaths, until they are committed
+        self.results = {}
+        self.processed = self.pages - len(pending)
+        self.next_commit = 0
+        self.committed = 0
+
+    @property
+    def done(self) -> bool:
+        """Whether every page has been processed and committed"""
+        return self.next_commit == len(self.filepaths)
 
 
 class OcrWorker(Process):
@@ -48,46 +110,324 @@ class OcrWorker(Process):
     Process to parse images using OCR and populate database
     """
 
-    def __init__(self, to_output: Pipe, input_data: Queue, daemon=False):
+    # Most pages committed together, finished pages are also committed whenever the next one is not ready yet
+    COMMIT_BATCH_PAGES = 16
+    # Pages a pool process recognizes before it is replaced, which returns any memory it has accumulated
+    PAGES_PER_PROCESS = 100
+    # Pages handed to the pool per process at a time. Few enough that pages of a newly queued document
+    # start right away, enough that no process waits for its next page.
+    PAGES_IN_FLIGHT_PER_PROCESS = 2
+    # Threads of the ingest stages around OCR, whose work mostly runs in OpenCV and SQLite without holding the GIL.
+    # The OCR stage has a thread per pool process, the commit stage is the worker's main thread.
+    STAGE_WORKERS = {'decode': 1, 'preprocess': 1, 'encode': 1}
+    # Seconds between the stage reports printed while pages are processed
+    STAGE_REPORT_INTERVAL = 30
+    # Most PDF pages of a job rasterized ahead of the pages being processed
+    READ_AHEAD_PAGES = 32
+
+    def __init__(self, to_output: Pipe, input_data: Queue, daemon=False, processes: int = None,
+                 pages_per_process: int = PAGES_PER_PROCESS, policy: str = PageScheduler.SHORTEST_JOB_FIRST,
+                 stage_workers: dict = None):
+        """
+        Parameters
+        to_output - pipe to the StatusEmitter
+        input_data - queue of ('job', job_id) and ('cancel', job_id) messages, None stops the worker
+        processes - size of the OCR process pool, get_ocr_processes() if None
+        pages_per_process - pages a pool process recognizes before it is replaced
+        policy - PageScheduler policy sharing the pool between documents of equal priority
+        stage_workers - threads by stage name, overriding STAGE_WORKERS
+        """
         super().__init__()
         self.daemon = daemon
         self.to_output = to_output
         self.data_to_process = input_data
-        self.curr_page_length = 0
-        self.curr_amount_processed = 0
-        self.data = []
+        self.processes = get_ocr_processes() if processes is None else processes
+        self.pages_per_process = pages_per_process
+        self.policy = policy
+        self.stage_workers = {**OcrWorker.STAGE_WORKERS, **(stage_workers or {})}
 
     def run(self):
         """
         Wait for any data to process and then process it and sent status updates
         """
-        while True:
-            value = self.data_to_process.get()
+        # One pool serves every document. Its processes load the model as they start, while the app
+        # sits idle waiting for a document, and so do the ones replacing them after pages_per_process pages.
+        share_with_child_processes()
+        pool = Pool(processes=self.processes, initializer=OcrEngine.warm_up,
+                    maxtasksperchild=self.pages_per_process)
+        scheduler = PageScheduler(self.policy)
+        jobs = {}
+        in_flight = 0
+        max_in_flight = (self.processes * OcrWorker.PAGES_IN_FLIGHT_PER_PROCESS
+                         + sum(self.stage_workers.values()))
+
+        # Queued documents and processed pages both arrive as events, so neither waits on the other
+        events = queue.Queue()
+
+        def stage(function):
+            # Pages of cancelled jobs, and pages that failed in an earlier stage, pass through the rest
+            def run_stage(work):
+                if work.error is None and work.job_id in jobs:
+                    try:
+                        function(work)
+                    except Exception as error:
+                        work.error = error
+                return work
+            return run_stage
+
+        # Each OCR thread hands its page to the pool through its own shared memory, reused for every page
+        buffers = threading.local()
+        all_buffers = []
+
+        def recognize_page(work):
+            if not hasattr(buffers, 'buffer'):
+                buffers.buffer = SharedImageBuffer()
+                all_buffers.append(buffers.buffer)
+            OcrEngine.recognize_page(work, pool, buffers.buffer)
+
+        # Pages are decoded, preprocessed, recognized in the pool and encoded by separate threads, so reading
+        # and encoding pages overlaps with OCR. Processed pages come back as events to be committed by this thread.
+        self.pipeline = StagedPipeline(
+            sink=lambda work: events.put(('page', work)))
+        self.pipeline.add_stage('decode', stage(OcrEngine.decode_page),
+                                self.stage_workers['decode'])
+        self.pipeline.add_stage('preprocess', stage(OcrEngine.preprocess_page),
+                                self.stage_workers['preprocess'])
+        self.pipeline.add_stage('ocr', stage(recognize_page),
+                                self.processes)
+        self.pipeline.add_stage('encode', stage(OcrEngine.encode_page),
+                                self.stage_workers['encode'])
+        self.pipeline.start()
+        self.commit_stats = StageStats('commit', 1)
+        self.events = events
+        last_report = time.monotonic()
+
+        def forward_documents():
             # if sent None then terminate process
-            if value is None:
+            for value in iter(self.data_to_process.get, None):
+                events.put(value)
+            events.put(('stop', None))
+
+        threading.Thread(target=forward_documents, daemon=True).start()
+
+        def load_job(job_id):
+            # Jobs are loaded once, whether found at startup or queued afterwards
+            if job_id in jobs:
+                return
+            job = OcrJob.get_or_none(OcrJob.id == job_id)
+            if job is None:
+                return
+            jobs[job_id] = DocumentJob(job)
+            if jobs[job_id].done:
+                # Such as a job whose document was deleted
+                finished = jobs.pop(job_id)
+                self.finish(finished)
+                self.to_output.send(((job_id, finished.pages, finished.pages), None, None))
+            else:
+                # Pages are handed out as they become ready
+                scheduler.add(job_id, len(jobs[job_id].filepaths), job.priority, ready=0)
+                threading.Thread(target=self.prepare_pages, args=(jobs[job_id], jobs, events),
+                                 daemon=True).start()
+
+        create_tables()
+        db.connect()
+        # Resume the jobs left unfinished when the app last closed
+        for job, _, _ in unfinished_jobs():
+            load_job(job.id)
+
+        self.to_output.send((None, None, ocr_cache().stats()))
+        while True:
+            # Keep the pool busy with pages picked by the scheduler
+            while in_flight < max_in_flight and scheduler.has_pages():
+                job_id, idx = scheduler.next_page()
+                job = jobs[job_id]
+                self.pipeline.put(PageWork(idx, job.filepaths[idx], *job.options, job_id=job_id,
+                                           page_data=job.text_layers[idx],
+                                           pdf_page=None if job.renders[idx] is None else
+                                           (job.sources[idx], job.pdf_pages[idx], *job.renders[idx])))
+                job.text_layers[idx] = None
+                in_flight += 1
+
+            kind, value = events.get()
+            if kind == 'stop':
+                # Unfinished jobs are resumed on the next start
                 break
-            (name, doc_id, pdf_previews, filepaths,
-             (oem, psm, best, preprocessing)) = value
-            self.curr_page_length = len(filepaths)
-            self.curr_amount_processed = 0
-            self.data = []
-            pool = Pool()
-            for idx, filepath in enumerate(filepaths):
-                pool.apply_async(OcrEngine.process_image, args=[
-                    idx, filepath, oem, psm, best, preprocessing], callback=self.emit_result)
-            pool.close()
-            pool.join()
-            if len(self.data) == 0:
-                print("ERROR: DATA TO COMMIT IS EMPTY. THIS SHOULD NEVER HAPPEN!")
+            elif kind == 'job':
+                load_job(value)
+            elif kind == 'pages':
+                job_id, first, filepaths, text_layers, renders = value
+                if job_id in jobs:
+                    jobs[job_id].filepaths[first:first + len(filepaths)] = filepaths
+                    jobs[job_id].text_layers[first:first + len(filepaths)] = text_layers
+                    jobs[job_id].renders[first:first + len(filepaths)] = renders
+                    jobs[job_id].text_layer_pages += sum(layer is not None for layer in text_layers)
+                    scheduler.set_ready(job_id, first + len(filepaths))
+            elif kind == 'cancel':
+                if value in jobs:
+                    scheduler.remove(value)
+                    self.finish(jobs.pop(value))
             else:
-                doc_id = OcrEngine.commit_data(name, doc_id, self.data)
-                self.to_output.send((None, doc_id))
-            # Cleanup temporary files from PDF Previews
-            for key in pdf_previews:
-                shutil.rmtree(pdf_previews[key][1])
-
-    def emit_result(self, single_result):
-        self.data.append(single_result)
-        self.curr_amount_processed += 1
-        self.to_output.send(
-            ((self.curr_amount_processed / self.curr_page_length)*100, None))
+                job_id, idx, result = value.job_id, value.idx, (value.idx, value.result)
+                in_flight -= 1
+                scheduler.page_done(job_id)
+                # Pages of cancelled jobs are dropped
+                if job_id not in jobs:
+                    continue
+                job = jobs[job_id]
+                if job.pdf_pages[idx] is not None and job.filepaths[idx] is not None:
+                    job.read_ahead.release()
+                if value.error is not None:
+                    print(f'Page {idx + 1} of {job.name} failed: {value.error}')
+                    result = None
+                job.results[idx] = result
+                job.processed += 1
+                self.to_output.send(((job_id, job.processed, job.pages), None, ocr_cache().stats()))
+                if not self.commit_ready_pages(job):
+                    # The document was deleted while its pages were processed, which ends the job
+                    print(f'{job.name} was deleted, its remaining pages are not processed')
+                    scheduler.remove(job_id)
+                    self.finish(jobs.pop(job_id))
+                    self.to_output.send(((job_id, job.pages, job.pages), None, None))
+                elif job.done:
+                    scheduler.remove(job_id)
+                    self.finish(jobs.pop(job_id))
+                    if job.text_layer_pages > 0:
+                        print(f'{job.text_layer_pages} of {len(job.filepaths)} pages of {job.name} '
+                              f'were read from the PDF text layer instead of OCR')
+                    self.report_stages()
+                    last_report = time.monotonic()
+                elif time.monotonic() - last_report > OcrWorker.STAGE_REPORT_INTERVAL:
+                    self.report_stages()
+                    last_report = time.monotonic()
+        self.pipeline.stop()
+        pool.terminate()
+        pool.join()
+        for buffer in all_buffers:
+            buffer.close()
+
+    def prepare_pages(self, job: DocumentJob, jobs: dict, events: queue.Queue):
+        """
+        Makes the job's pages ready in order, sending a
+        ('pages', (job_id, first index, image filepaths, text layers, (DPI, color mode) of PDF pages)) event for each
+        run of them. Image files are ready as they are, PDF pages are rasterized a chunk at a time
+        into the RasterCache, so the first ones are recognized while the rest of the PDF is still being converted,
+        and pages already rendered for the preview or an earlier document are not converted again.
+        At most READ_AHEAD_PAGES PDF pages are rasterized ahead of the pages processed.
+        The words of PDF pages that have a usable text layer are read from it, those pages skip OCR.
+        Stops early if the job is cancelled.
+        """
+        start = 0
+        use_text_layer = True
+        while start < len(job.sources) and job.job_id in jobs:
+            end = start + 1
+            if job.pdf_pages[start] is None:
+                while end < len(job.sources) and job.pdf_pages[end] is None:
+                    end += 1
+                events.put(('pages', (job.job_id, start, job.sources[start:end], [None] * (end - start),
+                                      [None] * (end - start))))
+                start = end
+                continue
+
+            # The following pages of the same PDF
+            while end < len(job.sources) and job.sources[end] == job.sources[start] and job.pdf_pages[end] is not None:
+                end += 1
+            filepath, pages = job.sources[start], job.pdf_pages[start:end]
+            index = start
+            # Pages read ahead not handed over yet
+            reserved = 0
+            try:
+                # AUTO samples the middle page, past any title pages
+                dpi, color = PDFToImage.profile(filepath, job.render, pages[len(pages) // 2])
+                print(f'Rendering {len(pages)} pages of {filepath} at {dpi} DPI in {color}')
+                for chunk in PDFToImage.chunks(pages):
+                    for _ in chunk:
+                        while not job.read_ahead.acquire(timeout=1):
+                            if job.job_id not in jobs:
+                                return
+                        reserved += 1
+                    text_layers = {}
+                    if use_text_layer:
+                        try:
+                            text_layers = PDFToImage.text_layer(filepath, chunk[0], chunk[-1])
+                        except (OSError, subprocess.CalledProcessError, ElementTree.ParseError) as error:
+                            # The pages are recognized with OCR instead
+                            print(f'Could not read the text layer of {filepath}: {error}')
+                            use_text_layer = False
+                    chunk_dpi = dpi
+                    if job.render == PDFToImage.AUTO and all(page in text_layers for page in chunk):
+                        # None of the pages are recognized, they are only rendered to be viewed
+                        chunk_dpi = min(dpi, PDFToImage.TEXT_LAYER_DPI)
+                    filepaths = raster_cache().pages(filepath, chunk, chunk_dpi, color)
+                    events.put(('pages', (job.job_id, index, filepaths,
+                                          [PDFToImage.to_pixels(text_layers[page], chunk_dpi) if page in text_layers
+                                           else None for page in chunk],
+                                          [(chunk_dpi, color)] * len(chunk))))
+                    reserved = 0
+                    index += len(chunk)
+                    if job.job_id not in jobs:
+                        return
+            except Exception as error:
+                print(f'Could not rasterize {job.sources[start]}: {error}')
+                # The pages left are processed without an image, and fail
+                for _ in range(reserved):
+                    job.read_ahead.release()
+                events.put(('pages', (job.job_id, index, [None] * (end - index), [None] * (end - index),
+                                      [None] * (end - index))))
+            start = end
+
+    def commit_ready_pages(self, job: DocumentJob):
+        """
+        Commits the job's processed pages that follow the last committed one, in small batches as they
+        finish, so only those are held in memory and the document becomes searchable while the rest is processed.
+        Their OcrPageTasks are marked done in the same transaction, so no page is committed twice.
+        Returns False if the job's document has been deleted, the pages are then not committed.
+        """
+        batch = []
+        task_ids = []
+        while job.next_commit in job.results:
+            result = job.results.pop(job.next_commit)
+            task_ids.append(job.task_ids[job.next_commit])
+            job.next_commit += 1
+            if result is not None:
+                batch.append(result)
+            if len(task_ids) >= OcrWorker.COMMIT_BATCH_PAGES or job.next_commit not in job.results:
+                start = time.perf_counter()
+                # commit_data puts the page images under the write lock, take it up front
+                with db.atomic('IMMEDIATE'):
+                    # Pages committed so far make the document visible, and deletable, before the job is done.
+                    # Deleting it sets the job's document to NULL, its id may already belong to a new document.
+                    if job.doc_id is not None and not (OcrJob
+                                                       .select()
+                                                       .where((OcrJob.id == job.job_id) &
+                                                              (OcrJob.document == job.doc_id))
+                                                       .exists()):
+                        return False
+                    if len(batch) > 0:
+                        job.doc_id = OcrEngine.commit_data(
+                            job.name, job.doc_id, batch)
+                        OcrJob.update(document=job.doc_id).where(
+                            OcrJob.id == job.job_id).execute()
+                    OcrPageTask.update(done=True).where(
+                        OcrPageTask.id.in_(task_ids)).execute()
+                self.commit_stats.record(
+                    time.perf_counter() - start, len(task_ids))
+                if len(batch) > 0:
+                    job.committed += len(batch)
+                    self.to_output.send((None, job.doc_id, None))
+                batch = []
+                task_ids = []
+        return True
+
+    def report_stages(self):
+        """Prints the pages queued for each ingest stage and the pages/sec it gets through"""
+        # Pages waiting to be committed are processed pages not taken off the event queue yet
+        stages = self.pipeline.stats() + [(self.commit_stats.name, self.commit_stats.workers, self.events.qsize(),
+                                           self.commit_stats.processed, self.commit_stats.throughput)]
+        print('Ingest stages: ' + ', '.join(
+            f'{name} ({workers} {"thread" if workers == 1 else "threads"}) {queued} queued, '
+            f'{processed} pages at {throughput:.1f} pages/sec'
+            for name, workers, queued, processed, throughput in stages))
+
+    def finish(self, job: DocumentJob):
+        """Removes a job that is done or cancelled"""
+        OcrJob.delete().where(OcrJob.id == job.job_id).execute()
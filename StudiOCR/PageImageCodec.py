@@ -0,0 +1,111 @@
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+class PageImageCodec:
+    """Storage policy for page images: how the image of each page is encoded before it is stored"""
+
+    # Keep the original file when it is already a JPEG or PNG, otherwise fall back to JPEG at PASSTHROUGH_QUALITY
+    PASSTHROUGH = 'passthrough'
+    # Lossy WebP at the given quality
+    WEBP = 'webp'
+    # Lossy JPEG at the given quality
+    JPEG = 'jpeg'
+    # Black and white PNG at 1 bit per pixel, for binarized scans
+    BILEVEL = 'bilevel'
+
+    CODECS = (PASSTHROUGH, WEBP, JPEG, BILEVEL)
+
+    # Quality (1-100) of the lossy codecs unless told otherwise
+    DEFAULT_QUALITY = 80
+    # Quality of the JPEG PASSTHROUGH stores when the original cannot be kept, as every page was stored before
+    PASSTHROUGH_QUALITY = 100
+
+    # File signatures of the formats that can be stored as they are
+    _SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n')
+
+    def __init__(self, codec: str = PASSTHROUGH, quality: int = DEFAULT_QUALITY) -> None:
+        """
+        Parameters
+        codec - one of CODECS
+        quality - quality (1-100) of the WebP and JPEG codecs
+        """
+        if codec not in PageImageCodec.CODECS:
+            raise ValueError(
+                f'codec must be one of {", ".join(PageImageCodec.CODECS)}')
+        if quality not in range(1, 101):
+            raise ValueError(
+                'quality must be an integer between 1 and 100 inclusive')
+        self._codec = codec
+        self._quality = quality
+
+    @property
+    def codec(self) -> str:
+        """One of CODECS"""
+        return self._codec
+
+    @property
+    def quality(self) -> int:
+        """Quality (1-100) of the WebP and JPEG codecs"""
+        return self._quality
+
+    @staticmethod
+    def can_pass_through(original: bytes) -> bool:
+        """
+        Whether the original file can be stored as it is: a JPEG or PNG that is displayed upright
+        without applying an EXIF orientation, so block coordinates line up with the decoded image
+        """
+        if not original.startswith(PageImageCodec._SIGNATURES):
+            return False
+        try:
+            return Image.open(io.BytesIO(original)).getexif().get(0x0112, 1) == 1
+        except (OSError, SyntaxError):
+            return False
+
+    def encode(self, image: np.ndarray, original: bytes = None) -> bytes:
+        """
+        Encodes a page image for storage
+
+        Parameters
+        image - decoded page image, BGR as returned by cv2.imread
+        original - bytes of the file the image was decoded from, stored as they are by PASSTHROUGH when possible
+        """
+        if self._codec == PageImageCodec.PASSTHROUGH:
+            if original is not None and PageImageCodec.can_pass_through(original):
+                return original
+            return PageImageCodec._encode_jpeg(image, PageImageCodec.PASSTHROUGH_QUALITY)
+        if self._codec == PageImageCodec.WEBP:
+            return cv2.imencode(ext='.webp', img=image, params=[
+                cv2.IMWRITE_WEBP_QUALITY, self._quality])[1].tobytes()
+        if self._codec == PageImageCodec.JPEG:
+            return PageImageCodec._encode_jpeg(image, self._quality)
+        # Otsu's method picks the threshold between ink and paper
+        grayscale = image if image.ndim == 2 else cv2.cvtColor(
+            src=image, code=cv2.COLOR_BGR2GRAY)
+        _, binary = cv2.threshold(src=grayscale, thresh=0, maxval=255,
+                                  type=cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return cv2.imencode(ext='.png', img=binary, params=[
+            cv2.IMWRITE_PNG_BILEVEL, 1, cv2.IMWRITE_PNG_COMPRESSION, 9])[1].tobytes()
+
+    @staticmethod
+    def for_pdf(stored: bytes) -> bytes:
+        """
+        A stored page image in a format img2pdf embeds: JPEG and PNG as they are, others (WebP) converted to
+        lossless PNG
+
+        Parameters
+        stored - page image as returned by encode
+        """
+        if stored.startswith(PageImageCodec._SIGNATURES):
+            return stored
+        image = cv2.imdecode(np.frombuffer(stored, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        return cv2.imencode(ext='.png', img=image)[1].tobytes()
+
+    @staticmethod
+    def _encode_jpeg(image: np.ndarray, quality: int) -> bytes:
+        return cv2.imencode(ext='.jpg', img=image, params=[
+            cv2.IMWRITE_JPEG_QUALITY, quality,
+            cv2.IMWRITE_JPEG_OPTIMIZE, 1])[1].tobytes()
@@ -0,0 +1,111 @@
+import itertools
+
+
+class PageJob:
+    """Scheduling state of a document: its pages still to hand out and the ones being processed"""
+
+    def __init__(self, job_id: int, pages: int, priority: int, arrival: int, ready: int) -> None:
+        """
+        Parameters
+        job_id - identifies the document's job
+        pages - number of pages in the document
+        priority - one of PageScheduler.PRIORITIES, higher runs first
+        arrival - order in which the job was added
+        ready - number of leading pages that can be processed already
+        """
+        self.job_id = job_id
+        self.pages = pages
+        self.ready = ready
+        self.priority = priority
+        self.arrival = arrival
+        self.next_page = 0
+        self.in_flight = 0
+        self.last_served = -1
+
+    @property
+    def remaining(self) -> int:
+        """Pages not handed out yet"""
+        return self.pages - self.next_page
+
+
+class PageScheduler:
+    """
+    Decides which document the next page to process comes from, so pages of every queued document share the
+    OCR processes instead of each document waiting for the ones before it. Pages of a document are handed out
+    in order. Jobs of a higher priority go first, jobs of equal priority are picked by the scheduling policy.
+    """
+
+    LOW = 0
+    NORMAL = 1
+    HIGH = 2
+
+    PRIORITIES = (LOW, NORMAL, HIGH)
+
+    # The job with the fewest pages left goes first, so short documents are not stuck behind long ones
+    SHORTEST_JOB_FIRST = 'sjf'
+    # Jobs take turns, the one with the fewest pages being processed goes first
+    FAIR_SHARE = 'fair'
+
+    POLICIES = (SHORTEST_JOB_FIRST, FAIR_SHARE)
+
+    def __init__(self, policy: str = SHORTEST_JOB_FIRST) -> None:
+        """
+        Parameters
+        policy - one of POLICIES, how jobs of equal priority are picked
+        """
+        if policy not in PageScheduler.POLICIES:
+            raise ValueError(
+                f'policy must be one of {", ".join(PageScheduler.POLICIES)}')
+        self._policy = policy
+        self._jobs = {}
+        self._arrivals = itertools.count()
+        self._turns = itertools.count()
+
+    def add(self, job_id: int, pages: int, priority: int = NORMAL, ready: int = None) -> None:
+        """
+        Queues the pages of a document
+
+        Parameters
+        job_id - identifies the document's job
+        pages - number of pages in the document
+        priority - one of PRIORITIES, higher runs first
+        ready - number of leading pages that can be processed already, every page if None
+        """
+        if priority not in PageScheduler.PRIORITIES:
+            raise ValueError(
+                f'priority must be one of {", ".join(map(str, PageScheduler.PRIORITIES))}')
+        self._jobs[job_id] = PageJob(job_id, pages, priority, next(self._arrivals),
+                                     pages if ready is None else ready)
+
+    def set_ready(self, job_id: int, ready: int) -> None:
+        """Records that the job's leading ready pages can be processed, as they are rasterized"""
+        if job_id in self._jobs:
+            self._jobs[job_id].ready = max(self._jobs[job_id].ready, ready)
+
+    def remove(self, job_id: int) -> None:
+        """Forgets a job, its pages left are never handed out"""
+        self._jobs.pop(job_id, None)
+
+    def has_pages(self) -> bool:
+        """Whether any job has pages ready to hand out"""
+        return any(job.next_page < job.ready for job in self._jobs.values())
+
+    def next_page(self) -> tuple:
+        """Hands out the next page to process as (job_id, page index), None if no job has pages ready"""
+        candidates = [job for job in self._jobs.values() if job.next_page < job.ready]
+        if len(candidates) == 0:
+            return None
+        if self._policy == PageScheduler.SHORTEST_JOB_FIRST:
+            job = min(candidates, key=lambda job: (-job.priority, job.remaining + job.in_flight, job.arrival))
+        else:
+            job = min(candidates, key=lambda job: (-job.priority, job.in_flight, job.last_served, job.arrival))
+        page = job.next_page
+        job.next_page += 1
+        job.in_flight += 1
+        job.last_served = next(self._turns)
+        return (job.job_id, page)
+
+    def page_done(self, job_id: int) -> None:
+        """Records that a page handed out for the job has been processed"""
+        if job_id in self._jobs:
+            self._jobs[job_id].in_flight -= 1
@@ -1,51 +1,212 @@
+import glob
+import os
+import subprocess
 import tempfile
-from multiprocessing import Pool
+import uuid
+import xml.etree.ElementTree as ElementTree
 
-from PySide2 import QtCore as Qc
-from PySide2 import QtWidgets as Qw
-from PySide2 import QtGui as Qg
+import cv2
+import numpy as np
+from pdf2image import convert_from_path, pdfinfo_from_path
 
-from pdf2image import convert_from_path, convert_from_bytes
 
-from StudiOCR.util import get_threads
-
-
-class PDFToImage(Qc.QThread):
+class PDFToImage:
     """
-    Process the list of PDF files using multiple processes.
-    Emit a dictionary when done: PDF filepath -> ([image filepaths], temp_dir)
+    Rasterizes PDF pages to JPEG files on demand, a range of pages at a time,
+    so OCR and the preview can start on the first pages without waiting for the whole PDF
     """
-    done_signal = Qc.Signal(object)
-    status_signal = Qc.Signal(int, int)  # done, total
 
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.pdf_filenames = []
-        self.result = {}
-        self._processed_so_far = 0
+    # Most pages rasterized by one pdftocairo run. Fewer runs spare reparsing the PDF, smaller chunks
+    # hand the first pages over sooner.
+    CHUNK_PAGES = 8
+    # Resolution pages are rasterized at when no other is given
+    DPI = 200
+
+    # Color modes of the rendered pages
+    COLOR = 'color'
+    GRAY = 'gray'
+    # 1 bit per pixel, rendered as PNG since JPEG has no such mode
+    MONO = 'mono'
+
+    # Profile picking the DPI and color mode of each PDF of a job from a sample page
+    AUTO = 'auto'
+    # Fixed profiles as (DPI, color mode)
+    RENDER_PROFILES = {
+        'color-150': (150, COLOR),
+        'color-200': (200, COLOR),
+        'gray-300': (300, GRAY),
+        'mono-300': (300, MONO),
+    }
+    # Every profile, in the order EditDocWindow lists them
+    PROFILES = (AUTO, *RENDER_PROFILES)
+
+    # The AUTO profile samples a page at this resolution, enough to find the glyphs of body text
+    SAMPLE_DPI = 100
+    # Median glyph height (pixels) AUTO renders text at, within the range Tesseract is most accurate at
+    TARGET_TEXT_HEIGHT = 25
+    # Range of resolutions AUTO picks from, in steps of 50
+    MIN_DPI = 150
+    MAX_DPI = 400
+    # Glyphs the sample page needs for its text height to count, pages with less text are rendered at DPI
+    MIN_SAMPLE_GLYPHS = 20
+    # Mean difference (0-255) between the channels of a pixel past which AUTO keeps the page in color
+    COLOR_SPREAD = 8
+    # Pages whose words all come from the text layer skip OCR, AUTO renders them for viewing only
+    TEXT_LAYER_DPI = 150
+    # Words with a letter or digit a page's text layer needs to be used instead of OCR.
+    # Scanned pages often carry a few words of text, such as a stamped page number, with the rest only in the image.
+    MIN_TEXT_LAYER_WORDS = 3
+
+    @staticmethod
+    def page_count(filepath: str) -> int:
+        """Number of pages in the PDF, read from its header without rasterizing anything"""
+        return int(pdfinfo_from_path(filepath)['Pages'])
+
+    @staticmethod
+    def rasterize(filepath: str, first_page: int, last_page: int, output_folder: str,
+                  dpi: int = DPI, color: str = COLOR) -> list:
+        """
+        Rasterizes a range of pages and returns the filepaths of their images, in page order
+
+        Parameters
+        filepath - filepath of the PDF
+        first_page - number of the first page to rasterize, starting from 1
+        last_page - number of the last page to rasterize, inclusive
+        output_folder - directory the images are written to
+        dpi - resolution to render at
+        color - COLOR, GRAY or MONO
+        """
+        if color == PDFToImage.MONO:
+            # pdf2image has no option for pdftocairo's -mono
+            prefix = os.path.join(output_folder, str(uuid.uuid4()))
+            subprocess.run(['pdftocairo', '-png', '-mono', '-r', str(dpi), '-f', str(first_page),
+                            '-l', str(last_page), filepath, prefix], capture_output=True, check=True)
+            # Page numbers are zero padded to the same width, so names sort in page order
+            return sorted(glob.glob(prefix + '-*.png'))
+        # A single thread, the OCR processes already keep every core busy
+        return convert_from_path(filepath, dpi=dpi, fmt='jpeg', paths_only=True, output_folder=output_folder,
+                                 first_page=first_page, last_page=last_page, thread_count=1, use_pdftocairo=True,
+                                 grayscale=color == PDFToImage.GRAY)
 
     @staticmethod
-    def pdf_to_img(filepath):
+    def profile(filepath: str, render: str, page: int) -> tuple:
+        """
+        (DPI, color mode) a render profile renders a PDF at
+
+        Parameters
+        filepath - filepath of the PDF
+        render - one of PROFILES
+        page - number of the page AUTO samples, starting from 1
+        """
+        if render == PDFToImage.AUTO:
+            return PDFToImage.auto_profile(filepath, page)
+        return PDFToImage.RENDER_PROFILES.get(render, (PDFToImage.DPI, PDFToImage.COLOR))
+
+    @staticmethod
+    def auto_profile(filepath: str, page: int) -> tuple:
+        """
+        Picks the (DPI, color mode) to render a PDF at from one of its pages. Pages without color are rendered in
+        grayscale. The DPI brings the median height of the glyphs on the page to TARGET_TEXT_HEIGHT, so large print
+        is not rendered with more pixels than OCR needs and small print gets enough of them.
+
+        Parameters
+        filepath - filepath of the PDF
+        page - number of the page to sample, starting from 1
+        """
+        sample = np.asarray(convert_from_path(filepath, dpi=PDFToImage.SAMPLE_DPI, first_page=page, last_page=page,
+                                              use_pdftocairo=True)[0].convert('RGB'))
+        spread = (sample.max(axis=2).astype(np.int16) - sample.min(axis=2)).mean()
+        color = PDFToImage.COLOR if spread > PDFToImage.COLOR_SPREAD else PDFToImage.GRAY
+
+        grayscale = cv2.cvtColor(src=sample, code=cv2.COLOR_RGB2GRAY)
+        _, ink = cv2.threshold(grayscale, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+        heights = stats[1:, cv2.CC_STAT_HEIGHT]
+        widths = stats[1:, cv2.CC_STAT_WIDTH]
+        # Components shaped like glyphs: a few pixels up to an inch tall, not much wider than tall
+        glyphs = heights[(heights >= 3) & (heights <= PDFToImage.SAMPLE_DPI) & (widths <= 3 * heights)]
+        if len(glyphs) < PDFToImage.MIN_SAMPLE_GLYPHS:
+            return (PDFToImage.DPI, color)
+        dpi = PDFToImage.SAMPLE_DPI * PDFToImage.TARGET_TEXT_HEIGHT / np.median(glyphs)
+        dpi = int(round(dpi / 50) * 50)
+        return (min(max(dpi, PDFToImage.MIN_DPI), PDFToImage.MAX_DPI), color)
+
+    @staticmethod
+    def text_layer(filepath: str, first_page: int, last_page: int) -> dict:
+        """
+        Reads the words of a range of pages from the PDF's text layer with pdftotext, for the pages that have usable text.
+        Returns page number -> image_to_data dict of the words, with their boxes in points, see to_pixels.
+        Flows, blocks and lines of the layout are numbered as Tesseract's blocks, paragraphs and lines.
+        Pages without usable text are left out, they have to be recognized with OCR.
+
+        Parameters
+        filepath - filepath of the PDF
+        first_page - number of the first page to read, starting from 1
+        last_page - number of the last page to read, inclusive
+        """
+        output = subprocess.run(['pdftotext', '-bbox-layout', '-f', str(first_page), '-l', str(last_page),
+                                 filepath, '-'], capture_output=True, check=True).stdout
+        layers = {}
+        pages = [element for element in ElementTree.fromstring(output).iter()
+                 if element.tag.split('}')[-1] == 'page']
+        for page_number, page in enumerate(pages, start=first_page):
+            data = {column: [] for column in ('level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+                                              'left', 'top', 'width', 'height', 'conf', 'text')}
+            for block_num, flow in enumerate(PDFToImage._children(page, 'flow'), start=1):
+                for par_num, block in enumerate(PDFToImage._children(flow, 'block'), start=1):
+                    for line_num, line in enumerate(PDFToImage._children(block, 'line'), start=1):
+                        for word_num, word in enumerate(PDFToImage._children(line, 'word'), start=1):
+                            left, top, right, bottom = (float(word.get(key))
+                                                        for key in ('xMin', 'yMin', 'xMax', 'yMax'))
+                            # Words of the text layer are exact, they get full confidence
+                            row = {'level': 5, 'page_num': 1, 'block_num': block_num, 'par_num': par_num,
+                                   'line_num': line_num, 'word_num': word_num,
+                                   'left': left, 'top': top, 'width': right - left, 'height': bottom - top,
+                                   'conf': 100, 'text': word.text or ''}
+                            for column, value in row.items():
+                                data[column].append(value)
+            words = sum(any(character.isalnum() for character in text) for text in data['text'])
+            if words >= PDFToImage.MIN_TEXT_LAYER_WORDS:
+                layers[page_number] = data
+        return layers
+
+    @staticmethod
+    def to_pixels(text_layer: dict, dpi: int) -> dict:
+        """A page's text_layer with its word boxes in pixels of the page rendered at dpi"""
+        # Points are 1/72 inch
+        scale = dpi / 72
+        pixels = dict(text_layer)
+        for key in ('left', 'top', 'width', 'height'):
+            pixels[key] = [round(value * scale) for value in text_layer[key]]
+        return pixels
+
+    @staticmethod
+    def _children(element: ElementTree.Element, tag: str) -> list:
+        # pdftotext writes XHTML, its tags are namespaced
+        return [child for child in element if child.tag.split('}')[-1] == tag]
+
+    @staticmethod
+    def chunks(pages: list, chunk_pages: int = CHUNK_PAGES) -> list:
+        """
+        Splits page numbers, in increasing order, into the chunks rasterized together: runs of consecutive pages,
+        at most chunk_pages long
+        """
+        chunks = []
+        for page in pages:
+            if len(chunks) > 0 and len(chunks[-1]) < chunk_pages and chunks[-1][-1] == page - 1:
+                chunks[-1].append(page)
+            else:
+                chunks.append([page])
+        return chunks
+
+    @staticmethod
+    def pdf_to_img(filepath: str) -> tuple:
+        """
+        Rasterizes every page of the PDF into a new temp dir, returns (filepath, ([image filepaths], temp_dir))
+        """
         temp_dir = tempfile.mkdtemp()
         # NOTE: Must remove temp dir with shutil.rmtree(temp_dir) once done with PDF images files
-        num_threads = get_threads()
-        # Use 4 threads at max to prevent I/O bottleneck
-        use_threads = num_threads if num_threads <= 4 else 4
-        images_from_path = convert_from_path(
-            filepath, fmt='jpeg', paths_only=True, output_folder=temp_dir, thread_count=use_threads, use_pdftocairo=True)
+        pages = list(range(1, PDFToImage.page_count(filepath) + 1))
+        images_from_path = [image for chunk in PDFToImage.chunks(pages)
+                            for image in PDFToImage.rasterize(filepath, chunk[0], chunk[-1], temp_dir)]
         return (filepath, (images_from_path, temp_dir))
-
-    def run(self):
-        self.p = Pool()
-        for filename in self.pdf_filenames:
-            self.p.apply_async(PDFToImage.pdf_to_img,
-                               args=[filename], callback=self.emit_result)
-
-    def emit_result(self, single_result):
-        self.result[single_result[0]] = single_result[1]
-        self._processed_so_far += 1
-        len_to_process = len(self.pdf_filenames)
-        self.status_signal.emit(self._processed_so_far, len_to_process)
-        if len_to_process == self._processed_so_far:
-            self.done_signal.emit(self.result)
-            self.p.close()
@@ -0,0 +1,183 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from peewee import Model, CharField, IntegerField, FloatField, fn
+
+from StudiOCR.util import get_absolute_path
+from StudiOCR.ManagedDatabase import ManagedDatabase
+from StudiOCR.PdfToImage import PDFToImage
+
+# Rasterized PDF pages are kept in this folder, along with the database indexing them
+CACHE_FOLDER = get_absolute_path('raster_cache')
+# Total size of the cached page images, least recently used images are evicted past it
+CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# The preview in the app process and the OCR process use the cache concurrently
+raster_cache_db = ManagedDatabase(None, autoconnect=False, c_extensions=None, timeout=30, pragmas={
+    'journal_mode': 'wal',
+    'synchronous': 'normal'})
+
+
+class RasterCacheEntry(Model):
+    # RasterCache.key of the page and its rendering
+    key = CharField(primary_key=True)
+    # Name of the image file in the cache folder
+    filename = CharField(null=False)
+    size = IntegerField(null=False)
+    last_used = FloatField(null=False, index=True)
+
+    class Meta:
+        database = raster_cache_db
+
+
+class RasterCache:
+    """
+    Persistent cache of rasterized PDF pages, keyed by the PDF's content, the page number and how it is rendered,
+    so a PDF previewed, processed or added to another document again is not converted again.
+    Kept to max_bytes by evicting the least recently used pages.
+    """
+
+    def __init__(self, folder: str = CACHE_FOLDER, max_bytes: int = CACHE_MAX_BYTES) -> None:
+        """
+        Parameters
+        folder - folder holding the page images and the database indexing them, created if missing
+        max_bytes - total size of the page images to keep
+        """
+        self._folder = folder
+        self._max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+        database = os.path.join(folder, 'index.db')
+        if raster_cache_db.database != database:
+            raster_cache_db.init(database)
+        self._tables_created = False
+        # PDF content hashes by (filepath, modification time, size), so a PDF is only read through once
+        self._hashes = {}
+        self._hashes_lock = threading.Lock()
+
+    def pdf_hash(self, filepath: str) -> str:
+        """sha256 of the PDF's content"""
+        stat = os.stat(filepath)
+        identity = (os.path.realpath(filepath), stat.st_mtime_ns, stat.st_size)
+        with self._hashes_lock:
+            if identity in self._hashes:
+                return self._hashes[identity]
+        digest = hashlib.sha256()
+        with open(filepath, 'rb') as pdf_file:
+            for block in iter(lambda: pdf_file.read(1024 * 1024), b''):
+                digest.update(block)
+        with self._hashes_lock:
+            self._hashes[identity] = digest.hexdigest()
+        return self._hashes[identity]
+
+    @staticmethod
+    def key(pdf_hash: str, page: int, dpi: int, color: str) -> str:
+        """
+        Identifies a rendered page
+
+        Parameters
+        pdf_hash - pdf_hash of the PDF
+        page - number of the page, starting from 1
+        dpi - resolution the page is rendered at
+        color - PDFToImage color mode the page is rendered in
+        """
+        return f'{pdf_hash}-{page}-{dpi}-{color}'
+
+    def _connect(self) -> None:
+        raster_cache_db.connect()
+        if not self._tables_created:
+            with raster_cache_db.atomic('IMMEDIATE'):
+                raster_cache_db.create_tables([RasterCacheEntry], safe=True)
+            self._tables_created = True
+
+    def pages(self, filepath: str, pages: list, dpi: int = PDFToImage.DPI, color: str = PDFToImage.COLOR) -> list:
+        """
+        Image filepaths of the given pages of a PDF, in order. Pages not cached yet are rasterized and cached.
+        The images stay in the cache folder until they are evicted, which only happens to the least recently used.
+
+        Parameters
+        filepath - filepath of the PDF
+        pages - numbers of the pages, starting from 1, in increasing order
+        dpi - resolution to render at
+        color - PDFToImage color mode to render in
+        """
+        self._connect()
+        digest = self.pdf_hash(filepath)
+        keys = [RasterCache.key(digest, page, dpi, color) for page in pages]
+        # Take the write lock up front, upgrading a read lock fails instead of waiting when processes contend
+        with raster_cache_db.atomic('IMMEDIATE'):
+            filenames = {entry.key: entry.filename
+                         for entry in RasterCacheEntry.select().where(RasterCacheEntry.key.in_(keys))}
+            (RasterCacheEntry
+             .update(last_used=time.time())
+             .where(RasterCacheEntry.key.in_(list(filenames)))
+             .execute())
+        filepaths = {key: os.path.join(self._folder, filename) for key, filename in filenames.items()
+                     if os.path.exists(os.path.join(self._folder, filename))}
+
+        missing = [page for page, key in zip(pages, keys) if key not in filepaths]
+        for chunk in PDFToImage.chunks(missing):
+            # Rendered next to the cache, so the images are moved in rather than copied
+            render_dir = tempfile.mkdtemp(dir=self._folder)
+            try:
+                images = PDFToImage.rasterize(filepath, chunk[0], chunk[-1], render_dir, dpi, color)
+                rows = []
+                for page, image in zip(chunk, images):
+                    key = RasterCache.key(digest, page, dpi, color)
+                    filename = key + os.path.splitext(image)[1]
+                    os.replace(image, os.path.join(self._folder, filename))
+                    filepaths[key] = os.path.join(self._folder, filename)
+                    rows.append({'key': key, 'filename': filename, 'last_used': time.time(),
+                                 'size': os.path.getsize(filepaths[key])})
+            finally:
+                shutil.rmtree(render_dir, ignore_errors=True)
+            with raster_cache_db.atomic('IMMEDIATE'):
+                RasterCacheEntry.replace_many(rows).execute()
+            self._evict(keys)
+        return [filepaths[key] for key in keys]
+
+    def _evict(self, keep: list) -> None:
+        """Deletes the least recently used page images past max_bytes, except the ones under the keys in keep"""
+        with raster_cache_db.atomic('IMMEDIATE'):
+            total = RasterCacheEntry.select(fn.SUM(RasterCacheEntry.size)).scalar() or 0
+            if total <= self._max_bytes:
+                return
+            # Keep the most recently used images that fit within max_bytes, after the ones being returned
+            kept = RasterCacheEntry.key.in_(keep)
+            window = (RasterCacheEntry
+                      .select(RasterCacheEntry.key, RasterCacheEntry.filename,
+                              fn.SUM(RasterCacheEntry.size).over(
+                                  order_by=[kept.desc(), RasterCacheEntry.last_used.desc()]).alias('kept'))
+                      .alias('window'))
+            evicted = [(key, filename) for key, filename in RasterCacheEntry
+                       .select(window.c.key, window.c.filename)
+                       .from_(window)
+                       .where((window.c.kept > self._max_bytes) & ~(window.c.key.in_(keep)))
+                       .tuples()]
+            RasterCacheEntry.delete().where(
+                RasterCacheEntry.key.in_([key for key, _ in evicted])).execute()
+        for _, filename in evicted:
+            try:
+                os.remove(os.path.join(self._folder, filename))
+            except OSError:
+                pass
+
+
+_raster_cache = None
+
+
+def raster_cache() -> RasterCache:
+    """Cache of this process, a RasterCache of CACHE_FOLDER unless set_raster_cache was called"""
+    global _raster_cache
+    if _raster_cache is None:
+        _raster_cache = RasterCache()
+    return _raster_cache
+
+
+def set_raster_cache(cache: RasterCache) -> None:
+    """Replaces the cache rasterized PDF pages are read from and stored to"""
+    global _raster_cache
+    _raster_cache = cache
@@ -0,0 +1,79 @@
+from multiprocessing import shared_memory
+import os
+from typing import Any, Callable
+
+import numpy as np
+
+
+def share_with_child_processes() -> None:
+    """
+    Must be called before starting the processes SharedImages are handed to. Otherwise each of them starts its own
+    resource tracker, which unlinks the shared memory the process opened when it exits, while it is still in use.
+    """
+    if os.name == 'posix':
+        from multiprocessing import resource_tracker
+        resource_tracker.ensure_running()
+
+
+class SharedImage:
+    """
+    An image held in shared memory. Pickling it, to hand it to another process, only copies its name and shape,
+    the other process maps the same pixels instead of receiving a copy.
+    """
+
+    def __init__(self, name: str, shape: tuple, dtype: str) -> None:
+        """
+        Parameters
+        name - name of the SharedMemory block holding the pixels
+        shape - shape of the image array
+        dtype - name of the image array's dtype
+        """
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+    def apply(self, function: Callable[..., Any], *args) -> Any:
+        """
+        Calls function with the image as an array, followed by args, and returns its result.
+        The array maps the shared memory, so function must not keep it after returning.
+        """
+        memory = shared_memory.SharedMemory(name=self.name)
+        image = None
+        try:
+            image = np.ndarray(self.shape, dtype=np.dtype(self.dtype), buffer=memory.buf)
+            return function(image, *args)
+        finally:
+            # The block can only be closed once no array maps it
+            image = None
+            memory.close()
+
+
+class SharedImageBuffer:
+    """
+    A block of shared memory images are copied into, one at a time, to be handed to another process as a SharedImage.
+    The block is reused for every image and grows to fit the largest one.
+    """
+
+    # Blocks are allocated in multiples of this many bytes, so slightly larger pages reuse the block
+    GROWTH_BYTES = 4 * 1024 * 1024
+
+    def __init__(self) -> None:
+        self._memory = None
+
+    def share(self, image: np.ndarray) -> SharedImage:
+        """Copies image into the block, replacing the previous image, and returns the reference to it"""
+        if self._memory is None or self._memory.size < image.nbytes:
+            self.close()
+            size = -(-max(image.nbytes, 1) // SharedImageBuffer.GROWTH_BYTES) * SharedImageBuffer.GROWTH_BYTES
+            self._memory = shared_memory.SharedMemory(create=True, size=size)
+        shared = np.ndarray(image.shape, dtype=image.dtype, buffer=self._memory.buf)
+        np.copyto(shared, image)
+        del shared
+        return SharedImage(self._memory.name, image.shape, image.dtype.str)
+
+    def close(self) -> None:
+        """Frees the block, SharedImages handed out become invalid"""
+        if self._memory is not None:
+            self._memory.close()
+            self._memory.unlink()
+            self._memory = None
@@ -0,0 +1,112 @@
+import queue
+import threading
+import time
+from typing import Any, Callable
+
+
+class StageStats:
+    """Throughput counters of a pipeline stage"""
+
+    def __init__(self, name: str, workers: int) -> None:
+        """
+        Parameters
+        name - name of the stage
+        workers - number of threads running the stage
+        """
+        self.name = name
+        self.workers = workers
+        self.processed = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, items: int = 1) -> None:
+        """Counts items the stage took seconds to process"""
+        with self._lock:
+            self.processed += items
+            self.busy_seconds += seconds
+
+    @property
+    def throughput(self) -> float:
+        """Items per second the stage gets through with all its workers busy"""
+        if self.busy_seconds == 0:
+            return 0.0
+        return self.processed * self.workers / self.busy_seconds
+
+
+class StagedPipeline:
+    """
+    Runs items through a sequence of stages, each on its own threads and connected by bounded queues,
+    so the stages work on different items at the same time and a slow stage holds back the ones before it
+    instead of letting items pile up in memory. Items may leave the pipeline in a different order than they entered.
+    """
+
+    def __init__(self, sink: Callable[[Any], None]) -> None:
+        """
+        Parameters
+        sink - called with each item coming out of the last stage, from that stage's threads
+        """
+        self._sink = sink
+        self._stages = []
+        self._started = False
+
+    def add_stage(self, name: str, function: Callable[[Any], Any], workers: int = 1, capacity: int = None) -> None:
+        """
+        Appends a stage, stages must be added before the pipeline starts
+
+        Parameters
+        name - name of the stage in stats
+        function - takes an item and returns the item passed on to the next stage
+        workers - number of threads running the stage
+        capacity - most items waiting for the stage, twice the workers if None
+        """
+        if self._started:
+            raise RuntimeError('stages must be added before the pipeline starts')
+        capacity = 2 * workers if capacity is None else capacity
+        self._stages.append((function, queue.Queue(maxsize=capacity), StageStats(name, workers)))
+
+    def start(self) -> None:
+        """Starts the threads of every stage"""
+        self._started = True
+        for index, (function, inbox, stats) in enumerate(self._stages):
+            outbox = self._stages[index + 1][1] if index + 1 < len(self._stages) else None
+            for _ in range(stats.workers):
+                threading.Thread(target=self._run_stage, args=(function, inbox, outbox, stats),
+                                 daemon=True).start()
+
+    def put(self, item: Any) -> None:
+        """Feeds an item to the first stage, waiting while its queue is full"""
+        self._stages[0][1].put(item)
+
+    def stop(self) -> None:
+        """Stops every thread once it finishes its current item, items still queued are dropped"""
+        for _, inbox, stats in self._stages:
+            for _ in range(stats.workers):
+                # Make room for the stop marker if the queue is full
+                while True:
+                    try:
+                        inbox.put_nowait(None)
+                        break
+                    except queue.Full:
+                        try:
+                            inbox.get_nowait()
+                        except queue.Empty:
+                            pass
+
+    def _run_stage(self, function: Callable[[Any], Any], inbox: queue.Queue, outbox: queue.Queue,
+                   stats: StageStats) -> None:
+        while True:
+            item = inbox.get()
+            if item is None:
+                break
+            start = time.perf_counter()
+            item = function(item)
+            stats.record(time.perf_counter() - start)
+            if outbox is None:
+                self._sink(item)
+            else:
+                outbox.put(item)
+
+    def stats(self) -> list:
+        """(name, workers, items queued for the stage, items processed, items/sec) of every stage in order"""
+        return [(stats.name, stats.workers, inbox.qsize(), stats.processed, stats.throughput)
+                for _, inbox, stats in self._stages]
@@ -0,0 +1,170 @@
+from abc import ABC, abstractmethod
+import ctypes
+import ctypes.util
+import os
+
+import numpy as np
+import pytesseract
+from pytesseract import Output
+
+
+class TesseractEngine(ABC):
+    """Runs Tesseract on page images with a fixed model (tessdata directory and OCR engine mode)"""
+
+    def __init__(self, tessdata_path: str, oem: int) -> None:
+        """
+        Parameters
+        tessdata_path - directory holding the traineddata files
+        oem - OCR engine mode (0-3)
+        """
+        self._tessdata_path = tessdata_path
+        self._oem = oem
+
+    @abstractmethod
+    def image_to_data(self, image: np.ndarray, psm: int) -> dict:
+        """
+        Recognizes the words on a page, with the same output as pytesseract.image_to_data(output_type=Output.DICT)
+
+        Parameters
+        image - RGB or grayscale page image
+        psm - page segmentation mode (3-13)
+        """
+
+
+class PytesseractEngine(TesseractEngine):
+    """Runs the tesseract executable through pytesseract, which reloads the model on every page"""
+
+    def image_to_data(self, image: np.ndarray, psm: int) -> dict:
+        custom_config = f'--oem {self._oem} --psm {psm} --tessdata-dir "{self._tessdata_path}"'
+        return pytesseract.image_to_data(image=image, config=custom_config, output_type=Output.DICT)
+
+
+class LibTesseractEngine(TesseractEngine):
+    """
+    Calls the libtesseract C API through ctypes. The model is loaded once, when the engine is created,
+    and the page images are handed over in memory instead of through temporary files.
+    """
+
+    # Columns of Tesseract's TSV output, the keys of image_to_data
+    COLUMNS = ('level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+               'left', 'top', 'width', 'height', 'conf', 'text')
+
+    # Names of the shared library on the supported platforms
+    LIBRARY_NAMES = ('tesseract', 'libtesseract.so.5', 'libtesseract.so.4',
+                     'libtesseract-5', 'libtesseract-4', 'libtesseract.5.dylib', 'libtesseract.4.dylib')
+
+    _library = None
+
+    @classmethod
+    def library(cls) -> ctypes.CDLL:
+        """Loads libtesseract and declares the C API functions used, raises OSError if it is not installed"""
+        if cls._library is None:
+            library = None
+            for name in cls.LIBRARY_NAMES:
+                path = ctypes.util.find_library(name) or name
+                try:
+                    library = ctypes.CDLL(path)
+                    break
+                except OSError:
+                    continue
+            if library is None:
+                raise OSError('libtesseract is not installed')
+
+            library.TessVersion.restype = ctypes.c_char_p
+            library.TessBaseAPICreate.restype = ctypes.c_void_p
+            library.TessBaseAPIInit2.argtypes = [
+                ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int]
+            library.TessBaseAPISetPageSegMode.argtypes = [
+                ctypes.c_void_p, ctypes.c_int]
+            library.TessBaseAPISetImage.argtypes = [
+                ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int]
+            library.TessBaseAPIRecognize.argtypes = [
+                ctypes.c_void_p, ctypes.c_void_p]
+            library.TessBaseAPIGetTsvText.argtypes = [
+                ctypes.c_void_p, ctypes.c_int]
+            library.TessBaseAPIGetTsvText.restype = ctypes.c_void_p
+            library.TessDeleteText.argtypes = [ctypes.c_void_p]
+            library.TessBaseAPIClear.argtypes = [ctypes.c_void_p]
+            library.TessBaseAPIEnd.argtypes = [ctypes.c_void_p]
+            library.TessBaseAPIDelete.argtypes = [ctypes.c_void_p]
+            cls._library = library
+        return cls._library
+
+    def __init__(self, tessdata_path: str, oem: int) -> None:
+        super().__init__(tessdata_path, oem)
+        library = LibTesseractEngine.library()
+        self._api = library.TessBaseAPICreate()
+        if library.TessBaseAPIInit2(self._api, tessdata_path.encode('utf-8'), b'eng', oem) != 0:
+            library.TessBaseAPIDelete(self._api)
+            self._api = None
+            raise OSError(
+                f'libtesseract could not load the eng model from {tessdata_path}')
+
+    def image_to_data(self, image: np.ndarray, psm: int) -> dict:
+        library = LibTesseractEngine.library()
+        # Tesseract reads 8 bits per channel, the preprocessing pipeline may hand over floats
+        if image.dtype != np.uint8:
+            image = np.clip(image, 0, 255).astype(np.uint8)
+        image = np.ascontiguousarray(image)
+        height, width = image.shape[:2]
+        bytes_per_pixel = 1 if image.ndim == 2 else image.shape[2]
+
+        library.TessBaseAPISetPageSegMode(self._api, psm)
+        library.TessBaseAPISetImage(self._api, image.ctypes.data, width, height,
+                                    bytes_per_pixel, image.strides[0])
+        try:
+            if library.TessBaseAPIRecognize(self._api, None) != 0:
+                raise RuntimeError('libtesseract failed to recognize the page')
+            tsv = library.TessBaseAPIGetTsvText(self._api, 0)
+            try:
+                lines = ctypes.string_at(tsv).decode('utf-8').splitlines()
+            finally:
+                library.TessDeleteText(tsv)
+        finally:
+            # Drops the page but keeps the model loaded
+            library.TessBaseAPIClear(self._api)
+
+        data = {column: [] for column in LibTesseractEngine.COLUMNS}
+        for line in lines:
+            values = line.split('\t')
+            if len(values) < len(LibTesseractEngine.COLUMNS) - 1:
+                continue
+            # Rows above word level have no text column
+            text = values[11] if len(values) > 11 else ''
+            # Numbers are truncated to integers, as pytesseract does
+            for column, value in zip(LibTesseractEngine.COLUMNS[:11], values[:11]):
+                data[column].append(int(float(value)))
+            data['text'].append(text)
+        return data
+
+    def __del__(self) -> None:
+        if getattr(self, '_api', None) is not None:
+            library = LibTesseractEngine.library()
+            library.TessBaseAPIEnd(self._api)
+            library.TessBaseAPIDelete(self._api)
+            self._api = None
+
+
+# Engines of this process, by (tessdata_path, oem), so each worker loads a model only once
+_engines = {}
+
+
+def engine_for(tessdata_path: str, oem: int) -> TesseractEngine:
+    """
+    The calling process's engine for the given model, created on first use.
+    A LibTesseractEngine when libtesseract is installed, PytesseractEngine otherwise.
+
+    Parameters
+    tessdata_path - directory holding the traineddata files
+    oem - OCR engine mode (0-3)
+    """
+    key = (tessdata_path, oem)
+    if key not in _engines:
+        # Recognize a page on one thread, pages are spread over worker processes instead
+        os.environ['OMP_THREAD_LIMIT'] = '1'
+        try:
+            _engines[key] = LibTesseractEngine(tessdata_path, oem)
+        except (OSError, AttributeError) as error:
+            print(f'{error}, falling back to pytesseract')
+            _engines[key] = PytesseractEngine(tessdata_path, oem)
+    return _engines[key]
@@ -1,21 +1,102 @@
-from peewee import (Model, Check, PrimaryKeyField, CharField,
-                    IntegerField, BlobField, ForeignKeyField, TextField)
-from playhouse.sqlite_ext import SqliteExtDatabase
+import io
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from functools import reduce
+import operator
+
+from peewee import (Model, Check, PrimaryKeyField, CharField, JOIN, fn,
+                    IntegerField, BlobField, ForeignKeyField, TextField, BooleanField, chunked)
+from playhouse.sqlite_ext import FTS5Model, SearchField
+from PIL import Image
 
 from StudiOCR.util import get_absolute_path
+from StudiOCR.ImageStore import ImageStore, FileImageStore
+from StudiOCR.ManagedDatabase import ManagedDatabase, ThreadBoundDatabase
 
 # Should likely change where the database files are stored
 DATABASE = get_absolute_path('ocr_files.db')
+# Page images live outside of the database, in this library directory
+IMAGE_LIBRARY = get_absolute_path('page_images')
+
+# The trigram tokenizer (SQLite 3.34+) lets MATCH answer the same substring searches
+# the UI has always done. Older SQLite builds fall back to prefix matching on words.
+FTS_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+# Most host parameters a single statement may bind (SQLITE_MAX_VARIABLE_NUMBER), raised from 999 in SQLite 3.32
+SQLITE_MAX_VARIABLES = 32766 if sqlite3.sqlite_version_info >= (3, 32, 0) else 999
 
-# Do we need c extensions?
-db = SqliteExtDatabase(DATABASE, autoconnect=False, c_extensions=False, pragmas={
-    'journal_mode': 'delete',  # Use DELETE mode
+# Pages the write-ahead log may grow to before a commit checkpoints it back into the database (~16MB)
+WAL_AUTOCHECKPOINT_PAGES = 4096
+# Bytes of the write-ahead log kept on disk after a checkpoint
+WAL_SIZE_LIMIT = 64 * 1024 * 1024
+
+# Each thread keeps its connection open, so db.connect() / db.close() around an action are free
+# The C extensions are used whenever peewee was built with them
+# auto_vacuum comes first: switching to WAL writes the header of a new database, after which it cannot change
+db = ManagedDatabase(DATABASE, autoconnect=False, c_extensions=None, pragmas={
+    'auto_vacuum': 'incremental',  # Free pages are kept until incremental_vacuum returns them
+    'journal_mode': 'wal',  # Readers see a consistent snapshot while a commit is in flight
+    'synchronous': 'normal',  # WAL stays consistent without syncing on every commit
+    'wal_autocheckpoint': WAL_AUTOCHECKPOINT_PAGES,
+    'journal_size_limit': WAL_SIZE_LIMIT,
     'foreign_keys': 1})  # Enforce foreign-key constraints
 
+# Read-only connection for the GUI, so reads never wait on the OCR process committing through db
+read_db = ManagedDatabase(f'file:{DATABASE}?mode=ro', uri=True, autoconnect=False, c_extensions=None, pragmas={
+    'query_only': 1})
+
+# Database the models run their queries on: db, or read_db on a thread within read_only()
+models_db = ThreadBoundDatabase(db)
+
+# Longest side, in pixels, of the document thumbnails shown in the document grid
+THUMBNAIL_SIZE = 256
+
+# Number of free pages each incremental_vacuum step returns to the filesystem
+VACUUM_STEP_PAGES = 256
+
+
+_image_store = None
+
+
+def image_store() -> ImageStore:
+    """Store holding the page images, a FileImageStore under IMAGE_LIBRARY unless set_image_store was called"""
+    global _image_store
+    if _image_store is None:
+        _image_store = FileImageStore(IMAGE_LIBRARY)
+    return _image_store
+
+
+def set_image_store(store: ImageStore) -> None:
+    """Replaces the store page images are read from and written to"""
+    global _image_store
+    _image_store = store
+
+
+def connection_stats() -> dict:
+    """Connections opened and statements executed so far by db and read_db"""
+    return {'connections_opened': db.connections_opened + read_db.connections_opened,
+            'statements_executed': db.statements_executed + read_db.statements_executed}
+
+
+def init_database(path: str) -> None:
+    """Points db and read_db at the database file at path instead of DATABASE"""
+    db.init(path)
+    read_db.init(f'file:{path}?mode=ro', uri=True)
+
 
 class BaseModel(Model):
     class Meta:
-        database = db
+        database = models_db
+
+
+# Version of the database schema: the number of migrations applied to it
+class SchemaVersion(BaseModel):
+    version = IntegerField()
+
+    class Meta:
+        table_name = 'schema_version'
 
 
 # Table entry for an OCR'ed document
@@ -24,28 +105,86 @@ class OcrDocument(BaseModel):
     name = CharField(unique=True)
 
     def delete_document(self):
-        num_rows_deleted = 0
-        with db.atomic():
-            for page in self.pages:
-                for block in page.blocks:
-                    block.delete_instance()
-                    num_rows_deleted += 1
-                page.delete_instance()
-                num_rows_deleted += 1
-            self.delete_instance()
-        # remove dead rows from DB
-        db.execute_sql('VACUUM;')
-        return num_rows_deleted + 1
+        """
+        Deletes the document with its pages and blocks, one DELETE statement per table
+
+        Space freed in the database file is reclaimed in the background afterwards
+        """
+        pages = OcrPage.select(OcrPage.id).where(OcrPage.document == self.id)
+        # The write lock is taken up front, so no commit can add a page sharing one of the images meanwhile
+        with db.atomic('IMMEDIATE'):
+            image_hashes = {image_hash for (image_hash,) in
+                            OcrPage.select(OcrPage.image_hash).where(OcrPage.document == self.id).tuples()}
+            # Deleting blocks also removes them from OcrBlockFts through the ocrblock_fts_delete trigger
+            num_rows_deleted = OcrBlock.delete().where(OcrBlock.page.in_(pages)).execute()
+            num_rows_deleted += OcrPage.delete().where(OcrPage.document == self.id).execute()
+            # Jobs still adding pages to the document have none left, rather than starting a new document after
+            # a restart. The OCR process removes them, their ids are not handed to new jobs until then.
+            jobs = OcrJob.select(OcrJob.id).where(OcrJob.document == self.id)
+            OcrPageTask.update(done=True).where(OcrPageTask.job.in_(jobs)).execute()
+            num_rows_deleted += OcrDocument.delete().where(OcrDocument.id == self.id).execute()
+            # Images are shared between identical pages, only remove the ones no other page uses.
+            # Removed while the lock is held, as commits put the images of their pages under it.
+            still_used = {image_hash for (image_hash,) in
+                          OcrPage.select(OcrPage.image_hash)
+                                 .where(OcrPage.image_hash.in_(list(image_hashes))).tuples()}
+            for image_hash in image_hashes - still_used:
+                image_store().remove(image_hash)
+        reclaim_free_pages_in_background()
+        return num_rows_deleted
 
 
 # Stores an individual page of OCR'ed document
-# Also stores the original image file of the page
+# The original image file of the page is kept in the image store under image_hash
 class OcrPage(BaseModel):
     id = PrimaryKeyField(null=False)
     number = IntegerField(null=False and Check('number >= 0'))
-    image = BlobField(null=False)
+    image_hash = CharField(index=True)
+    width = IntegerField()
+    height = IntegerField()
+    # OcrPageData in its serialize format
     ocr_page_data = BlobField(null=False)
-    document = ForeignKeyField(OcrDocument, backref='pages')
+    # Indexed by the (document, number) index below
+    document = ForeignKeyField(
+        OcrDocument, backref='pages', on_delete='CASCADE', index=False)
+
+    class Meta:
+        # Pages of a document in order
+        indexes = ((('document', 'number'), False),)
+
+    @property
+    def image(self) -> bytes:
+        """Original image file of the page"""
+        return image_store().get(self.image_hash)
+
+
+# Small JPEG of the first page of a document, shown in the document grid
+class OcrThumbnail(BaseModel):
+    id = PrimaryKeyField(null=False)
+    image = BlobField(null=False)
+    document = ForeignKeyField(
+        OcrDocument, backref='thumbnails', unique=True, on_delete='CASCADE')
+
+
+def make_thumbnail(image: bytes) -> bytes:
+    """Downscales image bytes so the longest side is at most THUMBNAIL_SIZE and encodes them as JPEG"""
+    thumbnail = Image.open(io.BytesIO(image))
+    # draft lets the JPEG decoder skip straight to a reduced scale
+    thumbnail.draft('RGB', (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    thumbnail = thumbnail.convert('RGB')
+    thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    output = io.BytesIO()
+    thumbnail.save(output, format='JPEG', quality=85)
+    return output.getvalue()
+
+
+def documents_with_thumbnails() -> list:
+    """Every document paired with its thumbnail bytes (None if it has none), loaded in one query"""
+    query = (OcrDocument
+             .select(OcrDocument, OcrThumbnail.image)
+             .join(OcrThumbnail, JOIN.LEFT_OUTER)
+             .objects())
+    return [(doc, doc.image) for doc in query]
 
 
 # Stores an individual text block with coordinates
@@ -58,10 +197,355 @@ class OcrBlock(BaseModel):
     # Should we store confidence values?
     conf = IntegerField()
     text = TextField()
-    page = ForeignKeyField(OcrPage, backref='blocks')
+    # Tesseract's block, paragraph, line and word numbers, NULL for blocks committed before they were kept
+    block_num = IntegerField(null=True)
+    par_num = IntegerField(null=True)
+    line_num = IntegerField(null=True)
+    word_num = IntegerField(null=True)
+    # Reading order of the word on its page, counting from 0, NULL for blocks without text.
+    # Indexed by the (page, position) index below.
+    position = IntegerField(null=True)
+    # Indexed by the (page, conf) and (page, position) indexes below
+    page = ForeignKeyField(OcrPage, backref='blocks',
+                           on_delete='CASCADE', index=False)
+
+    class Meta:
+        # Blocks of a page, with their confidence levels read from the index alone,
+        # and the words following a block on its page, looked up by their position
+        indexes = ((('page', 'conf'), False),
+                   (('page', 'position'), False))
+
+
+# Full-text index over OcrBlock.text, the rowid of each entry is the id of its OcrBlock
+# Rows are kept in sync with OcrBlock by the triggers created in create_tables
+class OcrBlockFts(FTS5Model):
+    text = SearchField()
+    page_id = SearchField(unindexed=True)
+    document_id = SearchField(unindexed=True)
+
+    class Meta:
+        database = models_db
+        options = {'tokenize': 'trigram' if FTS_TRIGRAM else 'unicode61'}
+
+
+# Full-text index over the text of each page, its words in reading order, for ranking pages by BM25.
+# The rowid of each entry is the id of its OcrPage. Rows are added by OcrEngine.commit_data along with the page's
+# blocks, and removed by the trigger in PAGE_FTS_TRIGGERS.
+class OcrPageFts(FTS5Model):
+    text = SearchField()
+    document_id = SearchField(unindexed=True)
+
+    class Meta:
+        database = models_db
+        options = {'tokenize': 'trigram' if FTS_TRIGRAM else 'unicode61'}
+
+
+PAGE_FTS_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS ocrpage_fts_delete AFTER DELETE ON ocrpage BEGIN
+        DELETE FROM ocrpagefts WHERE rowid = old.id;
+    END;""",
+)
+
+
+FTS_TRIGGERS = (
+    """CREATE TRIGGER IF NOT EXISTS ocrblock_fts_insert AFTER INSERT ON ocrblock BEGIN
+        INSERT INTO ocrblockfts (rowid, text, page_id, document_id)
+        SELECT new.id, new.text, new.page_id, ocrpage.document_id FROM ocrpage WHERE ocrpage.id = new.page_id;
+    END;""",
+    """CREATE TRIGGER IF NOT EXISTS ocrblock_fts_delete AFTER DELETE ON ocrblock BEGIN
+        DELETE FROM ocrblockfts WHERE rowid = old.id;
+    END;""",
+)
+
+
+# A document queued for OCR, kept until all its pages are committed so unfinished work resumes after a restart
+class OcrJob(BaseModel):
+    id = PrimaryKeyField(null=False)
+    name = CharField(null=False)
+    # Document the pages are added to, set by the first commit of a new document.
+    # Set to NULL when the document is deleted, which tells the OCR process to drop the job's pages.
+    document = ForeignKeyField(
+        OcrDocument, backref='jobs', null=True, on_delete='SET NULL')
+    priority = IntegerField(null=False)
+    # process_image settings as a JSON list: [oem, psm, best, preprocessing, codec, quality]
+    options = TextField(null=False)
+    # PDFToImage profile the PDF pages are rendered with
+    render = CharField(null=False, default='auto')
+
+
+# A page of an OcrJob, done once it is committed (or could not be processed)
+class OcrPageTask(BaseModel):
+    id = PrimaryKeyField(null=False)
+    number = IntegerField(null=False)
+    # Image file of the page, or the PDF it is rasterized from
+    filepath = TextField(null=False)
+    # Number of the page in the PDF, starting from 1, None for image files
+    pdf_page = IntegerField(null=True)
+    done = BooleanField(null=False, default=False)
+    # Indexed by the (job, number) index below
+    job = ForeignKeyField(OcrJob, backref='tasks',
+                          on_delete='CASCADE', index=False)
+
+    class Meta:
+        # Pages of a job in order
+        indexes = ((('job', 'number'), False),)
+
+
+def create_job(name: str, doc_id: int, pages: list, options: tuple, priority: int, render: str = 'auto') -> int:
+    """
+    Persists a document queued for OCR and returns the id of its OcrJob
+
+    Parameters
+    name - name of the new document
+    doc_id - id of the document the pages are added to, None to create a new document
+    pages - every page in order, an image filepath or a (PDF filepath, page number) tuple
+    options - process_image settings: (oem, psm, best, preprocessing, codec, quality)
+    priority - PageScheduler priority
+    render - PDFToImage profile the PDF pages are rendered with
+    """
+    db.connect()
+    with db.atomic():
+        job = OcrJob.create(name=name, document=doc_id, priority=priority,
+                            options=json.dumps(list(options)), render=render)
+        rows = [(number, *(page if isinstance(page, tuple) else (page, None)), job.id)
+                for number, page in enumerate(pages)]
+        for batch in chunked(rows, SQLITE_MAX_VARIABLES // 4):
+            OcrPageTask.insert_many(batch, fields=[
+                OcrPageTask.number, OcrPageTask.filepath, OcrPageTask.pdf_page, OcrPageTask.job]).execute()
+    return job.id
+
+
+def unfinished_jobs() -> list:
+    """Every OcrJob with pages left, as (job, pages done, pages in job) in the order they were queued"""
+    done = fn.COALESCE(fn.SUM(OcrPageTask.done), 0)
+    return [(job, job.pages_done, job.pages) for job in (OcrJob
+                                                         .select(OcrJob, done.alias('pages_done'),
+                                                                 fn.COUNT(OcrPageTask.id).alias('pages'))
+                                                         .join(OcrPageTask, JOIN.LEFT_OUTER)
+                                                         .group_by(OcrJob.id)
+                                                         .order_by(OcrJob.id))]
+
+
+MODELS = [OcrDocument, OcrPage, OcrThumbnail, OcrBlock, OcrBlockFts, OcrPageFts, OcrJob, OcrPageTask]
+# Pages ranked_search returns
+SEARCH_RESULTS = 50
+
+
+@contextmanager
+def read_only():
+    """
+    Runs the model queries the calling thread makes within the block on its read-only read_db connection,
+    other threads keep running theirs on db. Blocks may be nested.
+    In WAL mode each query reads a consistent snapshot, even while the OCR process is committing.
+    """
+    read_db.connect()
+    with models_db.bind_thread(read_db):
+        yield
+
+
+def fts_condition(words: list):
+    """
+    Builds the OcrBlockFts condition matching any block that contains any of the given words
+    """
+    if FTS_TRIGRAM and all(len(word) >= 3 for word in words):
+        # Each quoted word is a trigram phrase, which matches it as a substring anywhere in the text
+        return OcrBlockFts.match(' OR '.join('"{}"'.format(word.replace('"', '""')) for word in words))
+    if FTS_TRIGRAM:
+        # Trigrams cannot match words shorter than 3 characters, LIKE on the index still can
+        return reduce(operator.or_, [OcrBlockFts.text.contains(word) for word in words])
+    return OcrBlockFts.match(' OR '.join('"{}"*'.format(word.replace('"', '""')) for word in words))
+
+
+def search_blocks(words: list, document_id: int = None):
+    """
+    Selects the OcrBlock rows containing any of the given words (case insensitive), ordered by page
+
+    Parameters
+    words - list of non-empty search words
+    document_id - restrict the search to the pages of this document
+    """
+    matches = OcrBlockFts.select(OcrBlockFts.rowid).where(fts_condition(words))
+    if document_id is not None:
+        matches = matches.where(OcrBlockFts.document_id == document_id)
+    return OcrBlock.select().where(OcrBlock.id.in_(matches)).order_by(OcrBlock.page, OcrBlock.id)
+
+
+def search_phrases(words: list, document_id: int = None) -> list:
+    """
+    Finds the runs of words adjacent in reading order whose blocks contain the given words, in order
+    (case insensitive). Returns a tuple of OcrBlock per run, ordered by page and position.
+    One query: the block of the longest word is looked up in OcrBlockFts, the blocks before and after it
+    on the (page, position) index.
+
+    Parameters
+    words - list of non-empty search words, in the order they are read
+    document_id - restrict the search to the pages of this document
+    """
+    anchor = max(range(len(words)), key=lambda index: len(words[index]))
+    blocks = [OcrBlock.alias(f'word{index}') for index in range(len(words))]
+    matches = OcrBlockFts.select(OcrBlockFts.rowid).where(fts_condition([words[anchor]]))
+    if document_id is not None:
+        matches = matches.where(OcrBlockFts.document_id == document_id)
+    query = blocks[anchor].select(*blocks).where(blocks[anchor].id.in_(matches))
+    for index, block in enumerate(blocks):
+        if index != anchor:
+            query = query.join(block, on=((block.page == blocks[anchor].page) &
+                                          (block.position == blocks[anchor].position + (index - anchor))),
+                               attr=f'word{index}').switch(blocks[anchor])
+            query = query.where(block.text.contains(words[index]))
+    query = query.order_by(blocks[anchor].page, blocks[anchor].position)
+    return [tuple(row if index == anchor else getattr(row, f'word{index}') for index in range(len(words)))
+            for row in query]
+
+
+def ranked_search(words: list, limit: int = SEARCH_RESULTS) -> list:
+    """
+    Finds the pages containing any of the given words (case insensitive), best first, ranked by the BM25 score
+    SQLite computes over OcrPageFts: pages with more of the words, more often, and rarer ones, rank higher.
+    Returns (OcrDocument, OcrPage, [OcrBlock containing a word, in reading order], score) tuples.
+    Pages matching only words too short for the trigram index are found as search_document_ids finds them,
+    and ranked after the others with a score of 0.
+
+    Parameters
+    words - list of non-empty search words
+    limit - most pages to return
+    """
+    if len(words) == 0:
+        return []
+    ranked_words = [word for word in words if len(word) >= 3] if FTS_TRIGRAM else words
+    ranked = []
+    if len(ranked_words) > 0:
+        if FTS_TRIGRAM:
+            expression = ' OR '.join('"{}"'.format(word.replace('"', '""')) for word in ranked_words)
+        else:
+            expression = ' OR '.join('"{}"*'.format(word.replace('"', '""')) for word in ranked_words)
+        # bm25 is lower for better matches
+        ranked = list(OcrPageFts
+                      .select(OcrPageFts.rowid, OcrPageFts.bm25().alias('score'))
+                      .where(OcrPageFts.match(expression))
+                      .order_by(OcrPageFts.bm25())
+                      .limit(limit)
+                      .tuples())
+    short_words = [word for word in words if word not in ranked_words]
+    if len(short_words) > 0 and len(ranked) < limit:
+        # Trigrams cannot match words shorter than 3 characters, LIKE on the index still can
+        unranked = (OcrPageFts
+                    .select(OcrPageFts.rowid)
+                    .where(reduce(operator.or_, [OcrPageFts.text.contains(word) for word in short_words]) &
+                           OcrPageFts.rowid.not_in([page_id for page_id, _ in ranked]))
+                    .order_by(OcrPageFts.rowid)
+                    .limit(limit - len(ranked)))
+        ranked += [(page_id, 0.0) for (page_id,) in unranked.tuples()]
+    page_ids = [page_id for page_id, _ in ranked]
+    pages = {page.id: page for page in (OcrPage
+                                        .select(OcrPage, OcrDocument)
+                                        .join(OcrDocument)
+                                        .where(OcrPage.id.in_(page_ids)))}
+    blocks = {}
+    for block in (OcrBlock
+                  .select()
+                  .where(OcrBlock.id.in_(OcrBlockFts
+                                         .select(OcrBlockFts.rowid)
+                                         .where(fts_condition(words) & OcrBlockFts.page_id.in_(page_ids))))
+                  .order_by(OcrBlock.page, OcrBlock.position, OcrBlock.id)):
+        blocks.setdefault(block.page_id, []).append(block)
+    return [(pages[page_id].document, pages[page_id], blocks.get(page_id, []), -score)
+            for page_id, score in ranked if page_id in pages]
+
+
+def search_document_ids(words: list) -> set:
+    """
+    Returns the ids of the documents having a block that contains any of the given words (case insensitive)
+    """
+    query = (OcrBlockFts
+             .select(OcrBlockFts.document_id)
+             .where(fts_condition(words))
+             .distinct())
+    return {int(document_id) for (document_id,) in query.tuples()}
+
+
+def reclaim_free_pages():
+    """
+    Returns the free pages of the database file to the filesystem, VACUUM_STEP_PAGES at a time
+    so that no step holds the write lock for long
+    """
+    db.connect()
+    try:
+        free_pages = db.execute_sql('PRAGMA freelist_count;').fetchone()[0]
+        while free_pages > 0:
+            # executescript steps the pragma to completion, a cursor would only free a single page
+            db.connection().executescript(
+                f'PRAGMA incremental_vacuum({VACUUM_STEP_PAGES});')
+            remaining = db.execute_sql('PRAGMA freelist_count;').fetchone()[0]
+            # Nothing is freed unless auto_vacuum is incremental
+            if remaining >= free_pages:
+                break
+            free_pages = remaining
+    finally:
+        # This thread is about to end, so its connection would never be used again
+        db.shutdown()
+
+
+def collect_unused_images() -> int:
+    """
+    Removes the images in the store that no page uses, such as ones put by a commit that was rolled back.
+    Returns the number of images removed.
+    """
+    db.connect()
+    try:
+        # Images put from here on are not looked at
+        keys = image_store().keys()
+        removed = 0
+        for batch in chunked(keys, SQLITE_MAX_VARIABLES):
+            # Commits put the images of their pages under the write lock, so while it is held every image
+            # listed either belongs to a committed page or to none
+            with db.atomic('IMMEDIATE'):
+                used = {image_hash for (image_hash,) in
+                        OcrPage.select(OcrPage.image_hash).where(OcrPage.image_hash.in_(batch)).tuples()}
+                for key in batch:
+                    if key not in used:
+                        image_store().remove(key)
+                        removed += 1
+        return removed
+    finally:
+        # This thread is about to end, so its connection would never be used again
+        db.shutdown()
+
+
+def collect_unused_images_in_background() -> threading.Thread:
+    """
+    Runs collect_unused_images on its own thread (and connection) so the caller is not blocked
+    """
+    thread = threading.Thread(target=collect_unused_images, daemon=True)
+    thread.start()
+    return thread
+
+
+def reclaim_free_pages_in_background() -> threading.Thread:
+    """
+    Runs reclaim_free_pages on its own thread (and connection) so the caller is not blocked
+    """
+    thread = threading.Thread(target=reclaim_free_pages, daemon=True)
+    thread.start()
+    return thread
 
 
 # Helper function to intially create the tables in the database
 def create_tables():
-    with db:
-        db.create_tables([OcrDocument, OcrPage, OcrBlock], safe=True)
+    # migrations works on the models defined here
+    from StudiOCR.migrations import MIGRATIONS, migrate
+
+    with db.connection_context():
+        if db.table_exists(OcrDocument._meta.table_name):
+            migrate()
+        else:
+            # A new database starts out with the current schema
+            with db.atomic():
+                db.create_tables(MODELS + [SchemaVersion])
+                for trigger in FTS_TRIGGERS + PAGE_FTS_TRIGGERS:
+                    db.execute_sql(trigger)
+                SchemaVersion.create(version=len(MIGRATIONS))
+        free_pages = db.execute_sql('PRAGMA freelist_count;').fetchone()[0]
+    # Space left behind by the migrations
+    if free_pages > 0:
+        reclaim_free_pages_in_background()
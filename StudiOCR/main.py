@@ -9,7 +9,7 @@ from PySide2 import QtGui as Qg
 import qdarkstyle
 
 import StudiOCR.wsl as wsl
-from StudiOCR.db import create_tables, db
+from StudiOCR.db import create_tables, db, read_db, collect_unused_images_in_background
 from StudiOCR.MainWindow import MainWindow
 from StudiOCR.OcrWorker import StatusEmitter, OcrWorker
 
@@ -22,6 +22,9 @@ def main():
     # If the database has not been created, then create it
     create_tables()
 
+    # Remove page images no page uses, put by commits that did not go through
+    collect_unused_images_in_background()
+
     # Set DISPLAY env variable accordingly if running under WSL
     wsl.set_display_to_host()
 
@@ -41,8 +44,12 @@ def main():
         status_emitter.stop()
         # stop process
         queue.put(None)
-        ocr_process.join()
-        db.close()
+        # Unfinished documents are resumed on the next start, so the process need not wait on anything
+        ocr_process.join(timeout=5)
+        if ocr_process.is_alive():
+            ocr_process.terminate()
+        db.shutdown()
+        read_db.shutdown()
         
     window = MainWindow(queue, status_emitter)  # Create main window
 
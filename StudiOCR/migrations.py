@@ -0,0 +1,283 @@
+"""
+Ordered, versioned migrations of the database schema
+
+Each step brings a database from the schema version before it to the next. SchemaVersion records how
+many steps a database has been through, so startup only runs the ones it is missing. Steps check the
+schema before changing it, so databases migrated by earlier releases, which had no version, are safe
+to run through them again. New steps go at the end of MIGRATIONS, never in between.
+"""
+import io
+
+from peewee import JOIN
+from PIL import Image
+
+from StudiOCR.db import (db, image_store, make_thumbnail, OcrDocument, OcrPage, OcrThumbnail,
+                         OcrBlock, OcrBlockFts, OcrPageFts, OcrJob, OcrPageTask, SchemaVersion,
+                         FTS_TRIGGERS, PAGE_FTS_TRIGGERS)
+from StudiOCR.OcrPageData import OcrPageData
+
+
+def backfill_fts():
+    """
+    Indexes the blocks of databases created before OcrBlockFts existed
+    """
+    if OcrBlockFts.select().exists() or not OcrBlock.select().exists():
+        return
+    with db.atomic():
+        db.execute_sql("""INSERT INTO ocrblockfts (rowid, text, page_id, document_id)
+                          SELECT ocrblock.id, ocrblock.text, ocrblock.page_id, ocrpage.document_id
+                          FROM ocrblock JOIN ocrpage ON ocrpage.id = ocrblock.page_id;""")
+
+
+def backfill_thumbnails():
+    """
+    Creates the missing thumbnails of documents added before OcrThumbnail existed
+    """
+    missing = (OcrDocument
+               .select()
+               .join(OcrThumbnail, JOIN.LEFT_OUTER)
+               .where(OcrThumbnail.id.is_null()))
+    for doc in missing:
+        first_page = doc.pages.order_by(OcrPage.number).first()
+        if first_page is not None:
+            OcrThumbnail.create(document=doc.id,
+                                image=make_thumbnail(first_page.image))
+
+
+def rebuild_tables(models: list):
+    """
+    Recreates the tables of the given models from their current definitions and copies their rows over.
+    SQLite cannot alter constraints or drop columns in place, so this is how migrations change them.
+    Columns only in the old tables are dropped, columns only in the new ones take their defaults.
+    """
+    # Constraints cannot be switched off inside a transaction
+    db.pragma('foreign_keys', 0)
+    # Keep the renames below from rewriting references to the old tables
+    db.pragma('legacy_alter_table', 1)
+    try:
+        with db.atomic():
+            for model in models:
+                table = model._meta.table_name
+                # The new tables recreate these indexes under the same names
+                for index in db.get_indexes(table):
+                    db.execute_sql(f'DROP INDEX "{index.name}";')
+                db.execute_sql(
+                    f'ALTER TABLE "{table}" RENAME TO "{table}_old";')
+            db.create_tables(models, safe=False)
+            for model in models:
+                table = model._meta.table_name
+                old_columns = {column.name for column in db.get_columns(f'{table}_old')}
+                columns = ', '.join(f'"{field.column_name}"' for field in model._meta.sorted_fields
+                                    if field.column_name in old_columns)
+                db.execute_sql(
+                    f'INSERT INTO "{table}" ({columns}) SELECT {columns} FROM "{table}_old";')
+            for model in reversed(models):
+                db.execute_sql(
+                    f'DROP TABLE "{model._meta.table_name}_old";')
+            # Dropping the old blocks table also dropped the OcrBlockFts triggers
+            if OcrBlock in models and db.table_exists(OcrBlockFts._meta.table_name):
+                for trigger in FTS_TRIGGERS:
+                    db.execute_sql(trigger)
+            # and dropping the old pages table the OcrPageFts trigger
+            if OcrPage in models and db.table_exists(OcrPageFts._meta.table_name):
+                for trigger in PAGE_FTS_TRIGGERS:
+                    db.execute_sql(trigger)
+    finally:
+        db.pragma('legacy_alter_table', 0)
+        db.pragma('foreign_keys', 1)
+
+
+def migrate_images_to_store():
+    """
+    One-time migration moving the page images of databases created before the image store
+    out of the OcrPage.image column and into image_store()
+    """
+    if not db.table_exists(OcrPage._meta.table_name):
+        return
+    columns = {column.name for column in db.get_columns('ocrpage')}
+    if 'image' not in columns:
+        return
+
+    for column in ('image_hash', 'width', 'height'):
+        if column not in columns:
+            db.execute_sql(f'ALTER TABLE ocrpage ADD COLUMN "{column}";')
+    # Go page by page so only one image is held in memory at a time
+    page_ids = [page_id for (page_id,) in db.execute_sql(
+        'SELECT id FROM ocrpage WHERE image_hash IS NULL;').fetchall()]
+    for page_id in page_ids:
+        (image,) = db.execute_sql(
+            'SELECT image FROM ocrpage WHERE id = ?;', (page_id,)).fetchone()
+        image = bytes(image)
+        width, height = Image.open(io.BytesIO(image)).size
+        db.execute_sql('UPDATE ocrpage SET image_hash = ?, width = ?, height = ? WHERE id = ?;',
+                       (image_store().put(image), width, height, page_id))
+    rebuild_tables([OcrPage])
+
+
+def migrate_page_data():
+    """
+    One-time migration rewriting the pickled OcrPageData of older pages in the OcrPageData.serialize format.
+    The pickles are never loaded, every column they were built from is also in the page's OcrBlock rows.
+    """
+    # Pickles start with the PROTO opcode, serialized page data with the zip signature
+    page_ids = [page_id for (page_id,) in db.execute_sql(
+        "SELECT id FROM ocrpage WHERE substr(ocr_page_data, 1, 1) = x'80';").fetchall()]
+    keys = ('left', 'top', 'width', 'height', 'conf', 'text')
+    with db.atomic():
+        for page_id in page_ids:
+            blocks = list(OcrBlock
+                          .select(OcrBlock.left, OcrBlock.top, OcrBlock.width,
+                                  OcrBlock.height, OcrBlock.conf, OcrBlock.text)
+                          .where(OcrBlock.page == page_id)
+                          .order_by(OcrBlock.id)
+                          .tuples())
+            columns = {key: [block[index] for block in blocks]
+                       for index, key in enumerate(keys)}
+            (OcrPage
+             .update(ocr_page_data=OcrPageData.from_columns(columns).serialize())
+             .where(OcrPage.id == page_id)
+             .execute())
+
+
+def migrate_cascading_deletes():
+    """
+    One-time migration for databases created before foreign keys cascaded on delete and before
+    incremental auto-vacuum was enabled
+    """
+    if not db.table_exists(OcrPage._meta.table_name):
+        return
+
+    def cascades(table):
+        return all(row[6] == 'CASCADE' for row in db.execute_sql(f'PRAGMA foreign_key_list({table});'))
+
+    if not (cascades('ocrpage') and cascades('ocrblock')):
+        rebuild_tables([OcrPage, OcrBlock])
+
+    # auto_vacuum only takes effect on an existing database after a full VACUUM
+    if db.pragma('auto_vacuum') != 2:
+        db.execute_sql('VACUUM;')
+
+
+def add_search_index():
+    """Creates the OcrBlockFts index of the blocks and the triggers keeping it up to date"""
+    db.create_tables([OcrBlockFts], safe=True)
+    for trigger in FTS_TRIGGERS:
+        db.execute_sql(trigger)
+    backfill_fts()
+
+
+def add_thumbnails():
+    """Creates the OcrThumbnail table and the thumbnails of existing documents"""
+    db.create_tables([OcrThumbnail], safe=True)
+    backfill_thumbnails()
+
+
+def add_composite_indexes():
+    """
+    Replaces the single column foreign key indexes with the (document, number) index on OcrPage
+    and the (page, conf) index on OcrBlock, which lead with the same column
+    """
+    for index in ('ocrpage_document_id', 'ocrblock_page_id'):
+        db.execute_sql(f'DROP INDEX IF EXISTS "{index}";')
+    # create_tables also creates the (page, position) index of add_word_positions, which needs its column
+    add_layout_columns()
+    db.create_tables([OcrPage, OcrBlock], safe=True)
+
+
+def add_job_tables():
+    """Creates the OcrJob and OcrPageTask tables of the durable OCR queue"""
+    db.create_tables([OcrJob, OcrPageTask], safe=True)
+
+
+def add_pdf_pages():
+    """Adds the OcrPageTask.pdf_page column, so queued PDF pages are rasterized as they are processed"""
+    columns = {column.name for column in db.get_columns('ocrpagetask')}
+    if 'pdf_page' not in columns:
+        db.execute_sql('ALTER TABLE ocrpagetask ADD COLUMN "pdf_page" INTEGER;')
+
+
+def add_render_profiles():
+    """Adds the OcrJob.render column, jobs queued before it render their PDF pages with the automatic profile"""
+    columns = {column.name for column in db.get_columns('ocrjob')}
+    if 'render' not in columns:
+        db.execute_sql("""ALTER TABLE ocrjob ADD COLUMN "render" VARCHAR(255) NOT NULL DEFAULT 'auto';""")
+
+
+def add_layout_columns():
+    """Adds the OcrBlock columns holding the layout keys and reading order of each word"""
+    columns = {column.name for column in db.get_columns('ocrblock')}
+    for column in ('block_num', 'par_num', 'line_num', 'word_num', 'position'):
+        if column not in columns:
+            db.execute_sql(f'ALTER TABLE ocrblock ADD COLUMN "{column}" INTEGER;')
+
+
+def add_word_positions():
+    """
+    Adds the layout columns of OcrBlock and the (page, position) index. Blocks committed before have no layout
+    keys, their words are numbered in the order they were inserted, which is the order Tesseract read them in.
+    """
+    add_layout_columns()
+    with db.atomic():
+        db.execute_sql('CREATE TEMP TABLE block_positions (id INTEGER PRIMARY KEY, position INTEGER);')
+        db.execute_sql("""INSERT INTO block_positions (id, position)
+                          SELECT id, ROW_NUMBER() OVER (PARTITION BY page_id ORDER BY id) - 1
+                          FROM ocrblock WHERE position IS NULL AND trim(text) != '';""")
+        db.execute_sql("""UPDATE ocrblock SET position = (
+                            SELECT position FROM block_positions WHERE block_positions.id = ocrblock.id)
+                          WHERE id IN (SELECT id FROM block_positions);""")
+        db.execute_sql('DROP TABLE block_positions;')
+    db.create_tables([OcrBlock], safe=True)
+
+
+def add_page_search_index():
+    """Creates the OcrPageFts index of the pages, from their blocks, and the trigger removing deleted pages from it"""
+    db.create_tables([OcrPageFts], safe=True)
+    for trigger in PAGE_FTS_TRIGGERS:
+        db.execute_sql(trigger)
+    if OcrPageFts.select().exists():
+        return
+    with db.atomic():
+        # group_concat takes the rows in the order of the subquery, the words of each page in reading order
+        db.execute_sql("""INSERT INTO ocrpagefts (rowid, text, document_id)
+                          SELECT ocrpage.id, group_concat(words.text, ' '), ocrpage.document_id
+                          FROM (SELECT page_id, text FROM ocrblock WHERE position IS NOT NULL
+                                ORDER BY page_id, position) AS words
+                          JOIN ocrpage ON ocrpage.id = words.page_id
+                          GROUP BY ocrpage.id;""")
+
+
+# Every migration step in order, a database at schema version N has been through the first N
+MIGRATIONS = [
+    migrate_images_to_store,
+    migrate_cascading_deletes,
+    add_search_index,
+    add_thumbnails,
+    migrate_page_data,
+    add_composite_indexes,
+    add_job_tables,
+    add_pdf_pages,
+    add_render_profiles,
+    add_word_positions,
+    add_page_search_index,
+]
+
+
+def schema_version() -> int:
+    """Schema version of the database, 0 if it predates SchemaVersion"""
+    db.create_tables([SchemaVersion], safe=True)
+    row = SchemaVersion.select().first()
+    return row.version if row is not None else 0
+
+
+def migrate() -> None:
+    """Runs the migrations the database has not been through yet, recording the version after each one"""
+    version = schema_version()
+    if version > len(MIGRATIONS):
+        raise RuntimeError(
+            f'database schema version {version} is newer than the supported version {len(MIGRATIONS)}')
+    for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        print(f'Migrating database to schema version {number}: {step.__name__}')
+        step()
+        with db.atomic():
+            SchemaVersion.delete().execute()
+            SchemaVersion.create(version=number)
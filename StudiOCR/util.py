@@ -14,3 +14,13 @@ def get_threads() -> int:
         return (int)(os.environ['NUMBER_OF_PROCESSORS'])
     else:
         return (int)(os.popen('grep -c cores /proc/cpuinfo').read())
+
+
+def get_ocr_processes() -> int:
+    """
+    CPU budget of the OCR process pool: the STUDIOCR_OCR_PROCESSES environment variable if set,
+    otherwise every available thread but one, which is left for the interface and PDF conversion
+    """
+    if 'STUDIOCR_OCR_PROCESSES' in os.environ:
+        return max(1, int(os.environ['STUDIOCR_OCR_PROCESSES']))
+    return max(1, get_threads() - 1)
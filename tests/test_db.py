@@ -0,0 +1,117 @@
+"""
+Space used by a new database is returned to the filesystem once documents are deleted, and searches of the
+document grid and of the ranked page list agree
+
+Run from the repository folder: python -m pytest tests (or python -m unittest discover tests)
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))  # Include StudiOCR folder
+import io
+import tempfile
+import threading
+import unittest
+
+from PIL import Image
+
+from StudiOCR.db import (db, read_db, init_database, set_image_store, create_tables, reclaim_free_pages, read_only,
+                         search_document_ids, ranked_search, OcrDocument, OcrPage, OcrBlock)
+from StudiOCR.ImageStore import FileImageStore
+from StudiOCR.OcrEngine import OcrEngine
+from StudiOCR.OcrPageData import OcrPageData
+
+
+def ocr_page(words: list) -> tuple:
+    """commit_data input for a page reading words, on a single line"""
+    count = len(words)
+    page_data = {'text': words, 'left': [10 * index for index in range(count)], 'top': [0] * count,
+                 'width': [10] * count, 'height': [10] * count, 'conf': [90] * count, 'block_num': [1] * count,
+                 'par_num': [1] * count, 'line_num': [1] * count, 'word_num': list(range(1, count + 1))}
+    image = io.BytesIO()
+    Image.new('RGB', (60, 40), 'white').save(image, format='PNG')
+    return page_data, image.getvalue(), OcrPageData(page_data)
+
+
+class ReclaimFreePagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        init_database(os.path.join(self.temp_dir.name, 'ocr_files.db'))
+        self.store = FileImageStore(os.path.join(self.temp_dir.name, 'page_images'))
+        set_image_store(self.store)
+        create_tables()
+        db.connect()
+
+    def tearDown(self):
+        db.shutdown()
+        read_db.shutdown()
+        set_image_store(None)
+        self.temp_dir.cleanup()
+
+    def pragma(self, name: str) -> int:
+        return db.execute_sql(f'PRAGMA {name};').fetchone()[0]
+
+    def test_new_database_is_incremental(self):
+        # 2 is INCREMENTAL, the setting only takes effect before the database header is written
+        self.assertEqual(self.pragma('auto_vacuum'), 2)
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+
+    def test_delete_shrinks_file(self):
+        with db.atomic():
+            for number in range(2):
+                doc = OcrDocument.create(name=f'lecture {number}')
+                for page_number in range(20):
+                    page = OcrPage.create(number=page_number, image_hash=self.store.put(os.urandom(64)),
+                                          width=60, height=40, ocr_page_data=os.urandom(8192), document=doc)
+                    OcrBlock.insert_many([dict(left=0, top=0, width=10, height=10, conf=90, text=f'word {index}',
+                                               page=page) for index in range(200)]).execute()
+        page_count = self.pragma('page_count')
+
+        with db.atomic():
+            OcrBlock.delete().execute()
+            OcrPage.delete().where(OcrPage.document == 1).execute()
+        self.assertGreater(self.pragma('freelist_count'), 0)
+        reclaim_free_pages()
+        db.connect()
+        self.assertEqual(self.pragma('freelist_count'), 0)
+        self.assertLess(self.pragma('page_count'), page_count)
+
+        # delete_document reclaims the space in the background
+        page_count = self.pragma('page_count')
+        OcrDocument.get(OcrDocument.name == 'lecture 1').delete_document()
+        for thread in threading.enumerate():
+            if thread is not threading.current_thread() and thread.daemon:
+                thread.join()
+        self.assertEqual(self.pragma('freelist_count'), 0)
+        self.assertLess(self.pragma('page_count'), page_count)
+
+
+class SearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        init_database(os.path.join(self.temp_dir.name, 'ocr_files.db'))
+        set_image_store(FileImageStore(os.path.join(self.temp_dir.name, 'page_images')))
+        create_tables()
+        OcrEngine.commit_data('lecture', None, list(enumerate(
+            [ocr_page(['binary', 'heap']), ocr_page(['binary', 'tree']), ocr_page(['an', 'ox'])])))
+
+    def tearDown(self):
+        db.shutdown()
+        read_db.shutdown()
+        set_image_store(None)
+        self.temp_dir.cleanup()
+
+    def test_short_words(self):
+        """Words too short for the trigram index find the same pages in the grid and in the ranked list"""
+        with read_only():
+            self.assertEqual(search_document_ids(['ox']), {1})
+            self.assertEqual([page.number for _, page, _, _ in ranked_search(['ox'])], [2])
+            results = ranked_search(['heap', 'ox'])
+        # Pages ranked by BM25 come first
+        self.assertEqual([page.number for _, page, _, _ in results], [0, 2])
+        self.assertEqual([[block.text for block in blocks] for _, _, blocks, _ in results], [['heap'], ['ox']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+"""
+Checks the bit-parallel edit distances of FuzzyIndex against the dynamic programming definition, and its searches
+of a database
+
+Run from the repository folder: python -m pytest tests (or python -m unittest discover tests)
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))  # Include StudiOCR folder
+import random
+import tempfile
+import unittest
+
+import numpy as np
+
+from StudiOCR.db import db, read_db, init_database, set_image_store, create_tables
+from StudiOCR.FuzzyIndex import FuzzyIndex
+from StudiOCR.ImageStore import FileImageStore
+from StudiOCR.OcrEngine import OcrEngine
+
+from test_db import ocr_page
+
+
+def substring_distance(pattern: str, text: str) -> int:
+    """Fewest edits turning pattern into a substring of text, a match may start at any column of the first row"""
+    previous = list(range(len(pattern) + 1))
+    best = previous[-1]
+    for character in text:
+        current = [0]
+        for row, pattern_character in enumerate(pattern, start=1):
+            current.append(min(previous[row] + 1, current[row - 1] + 1,
+                               previous[row - 1] + (pattern_character != character)))
+        best = min(best, current[-1])
+        previous = current
+    return best
+
+
+class DistanceTest(unittest.TestCase):
+
+    def test_brute_force(self):
+        generator = random.Random(0)
+        index = FuzzyIndex()
+        # A small alphabet makes near matches common
+        words = [''.join(generator.choice('abcde') for _ in range(generator.randint(1, 80))) for _ in range(300)]
+        for word in dict.fromkeys(words):
+            index._add_word(word)
+        indexes = np.arange(len(index._words))
+        mismatches = []
+        for length in list(range(1, 16)) + [31, 32, 33, 63, FuzzyIndex.MAX_QUERY_CHARS]:
+            query = ''.join(generator.choice('abcde') for _ in range(length))
+            distances = index.distances(query, indexes)
+            mismatches += [(query, word) for word, distance in zip(index._words, distances)
+                           if distance != substring_distance(query, word)]
+        self.assertEqual(mismatches, [])
+
+    def test_unknown_characters(self):
+        index = FuzzyIndex()
+        index._add_word('binary')
+        # Characters missing from the vocabulary never match
+        self.assertEqual(index.distances('bxnary', np.arange(1)).tolist(), [1])
+        self.assertEqual(index.distances('zzz', np.arange(1)).tolist(), [3])
+
+
+class SearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        init_database(os.path.join(self.temp_dir.name, 'ocr_files.db'))
+        set_image_store(FileImageStore(os.path.join(self.temp_dir.name, 'page_images')))
+        create_tables()
+        self.long_word = 'pneumonoultramicroscopicsilicovolcanoconiosis' * 2
+        OcrEngine.commit_data('lecture 1', None, [(0, ocr_page(['modern', 'algorithm']))])
+        OcrEngine.commit_data('lecture 2', None, [(0, ocr_page(['binary', self.long_word]))])
+        self.index = FuzzyIndex()
+
+    def tearDown(self):
+        db.shutdown()
+        read_db.shutdown()
+        set_image_store(None)
+        self.temp_dir.cleanup()
+
+    def test_ocr_errors(self):
+        self.assertEqual(self.index.search_document_ids(['modem']), {1})
+        self.assertEqual(self.index.search_document_ids(['a1gorithm']), {1})
+        self.assertEqual(self.index.search_document_ids(['bimary']), {2})
+        # 4 characters allow a single edit
+        self.assertEqual(self.index.search_document_ids(['bxxary']), set())
+
+    def test_long_query(self):
+        """Words longer than the bit vectors are compared on their first MAX_QUERY_CHARS characters"""
+        self.assertGreater(len(self.long_word), FuzzyIndex.MAX_QUERY_CHARS)
+        self.assertEqual(self.index.search_document_ids([self.long_word]), {2})
+        self.assertEqual(self.index.search_document_ids(['x' + self.long_word[1:]]), {2})
+
+    def test_new_blocks(self):
+        self.assertEqual(self.index.search_document_ids(['heap']), set())
+        OcrEngine.commit_data('lecture 3', None, [(0, ocr_page(['heap']))])
+        # Each search first indexes the blocks committed since the last one
+        self.assertEqual(self.index.search_document_ids(['heap']), {3})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+"""
+Migrates databases created by the release before schema versioning, with the page images in an OcrPage BLOB
+column, pickled OcrPageData and foreign keys that do not cascade, to the current schema
+
+Run from the repository folder: python -m pytest tests (or python -m unittest discover tests)
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))  # Include StudiOCR folder
+import io
+import pickle
+import sqlite3
+import tempfile
+import unittest
+
+from PIL import Image
+
+from StudiOCR.db import (db, read_db, init_database, set_image_store, create_tables, read_only, search_document_ids,
+                         ranked_search, SchemaVersion, OcrDocument, OcrPage, OcrBlock, OcrBlockFts, OcrPageFts,
+                         OcrThumbnail)
+from StudiOCR.ImageStore import FileImageStore
+from StudiOCR.migrations import MIGRATIONS, migrate
+from StudiOCR.OcrPageData import OcrPageData
+
+# The schema the release before schema versioning created, as peewee wrote it
+BASELINE_SCHEMA = (
+    'CREATE TABLE "ocrdocument" ("id" INTEGER NOT NULL PRIMARY KEY, "name" VARCHAR(255) NOT NULL);',
+    'CREATE UNIQUE INDEX "ocrdocument_name" ON "ocrdocument" ("name");',
+    'CREATE TABLE "ocrpage" ("id" INTEGER NOT NULL PRIMARY KEY, "number" INTEGER NOT NULL, "image" BLOB NOT NULL, '
+    '"ocr_page_data" BLOB NOT NULL, "document_id" INTEGER NOT NULL, '
+    'FOREIGN KEY ("document_id") REFERENCES "ocrdocument" ("id"));',
+    'CREATE INDEX "ocrpage_document_id" ON "ocrpage" ("document_id");',
+    'CREATE TABLE "ocrblock" ("id" INTEGER NOT NULL PRIMARY KEY, "left" INTEGER NOT NULL, "top" INTEGER NOT NULL, '
+    '"width" INTEGER NOT NULL, "height" INTEGER NOT NULL, "conf" INTEGER NOT NULL, "text" TEXT NOT NULL, '
+    '"page_id" INTEGER NOT NULL, FOREIGN KEY ("page_id") REFERENCES "ocrpage" ("id"));',
+    'CREATE INDEX "ocrblock_page_id" ON "ocrblock" ("page_id");',
+)
+
+# Words of each page of each document, in the order Tesseract read them
+DOCUMENTS = {'lecture 1': [['binary', 'search', 'tree'], ['hash', 'table', '']],
+             'lecture 2': [['binary', 'heap'], []]}
+
+
+def page_image(color: str) -> bytes:
+    output = io.BytesIO()
+    Image.new('RGB', (60, 40), color).save(output, format='JPEG')
+    return output.getvalue()
+
+
+class MigrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'ocr_files.db')
+        self.images = {}
+        connection = sqlite3.connect(self.path)
+        with connection:
+            for statement in BASELINE_SCHEMA:
+                connection.execute(statement)
+            colors = iter(['red', 'green', 'blue', 'red'])
+            for name, pages in DOCUMENTS.items():
+                doc_id = connection.execute('INSERT INTO ocrdocument (name) VALUES (?);', (name,)).lastrowid
+                for number, words in enumerate(pages):
+                    image = page_image(next(colors))
+                    # The release pickled an OcrPageData object, the migration only looks at the pickle's header
+                    page_id = connection.execute(
+                        'INSERT INTO ocrpage (number, image, ocr_page_data, document_id) VALUES (?, ?, ?, ?);',
+                        (number, image, pickle.dumps({'text': words}), doc_id)).lastrowid
+                    self.images[page_id] = image
+                    connection.executemany(
+                        'INSERT INTO ocrblock ("left", top, width, height, conf, text, page_id) '
+                        'VALUES (?, 0, 10, 10, 90, ?, ?);',
+                        [(index * 10, word, page_id) for index, word in enumerate(words)])
+        connection.close()
+        init_database(self.path)
+        set_image_store(FileImageStore(os.path.join(self.temp_dir.name, 'page_images')))
+
+    def tearDown(self):
+        db.shutdown()
+        read_db.shutdown()
+        set_image_store(None)
+        self.temp_dir.cleanup()
+
+    def test_migrate_twice(self):
+        create_tables()
+        # A database already at the current version goes through none of the steps again
+        create_tables()
+
+        db.connect()
+        self.assertEqual(SchemaVersion.select().count(), 1)
+        self.assertEqual(SchemaVersion.get().version, len(MIGRATIONS))
+
+        # Page images moved out of the database into the image store
+        columns = {column.name for column in db.get_columns('ocrpage')}
+        self.assertNotIn('image', columns)
+        for page in OcrPage.select():
+            self.assertEqual(page.image, self.images[page.id])
+            self.assertEqual((page.width, page.height), (60, 40))
+        # Pages with the same image share it
+        self.assertEqual(len({page.image_hash for page in OcrPage.select()}), 3)
+
+        # Page data rewritten from the pickles, from the blocks of each page
+        for page in OcrPage.select():
+            page_data = OcrPageData.deserialize(bytes(page.ocr_page_data))
+            blocks = [block.text for block in page.blocks.order_by(OcrBlock.id)]
+            self.assertEqual(sorted(page_data.texts.tolist()), sorted(set(blocks)))
+
+        # Foreign keys cascade and every table is searchable
+        for table in ('ocrpage', 'ocrblock'):
+            self.assertTrue(all(row[6] == 'CASCADE' for row in db.execute_sql(f'PRAGMA foreign_key_list({table});')))
+        self.assertEqual(OcrBlockFts.select().count(), OcrBlock.select().count())
+        self.assertEqual({text for (_, text) in OcrPageFts.select(OcrPageFts.rowid, OcrPageFts.text).tuples()},
+                         {'binary search tree', 'hash table', 'binary heap'})
+        self.assertEqual(OcrThumbnail.select().count(), len(DOCUMENTS))
+        self.assertEqual([block.position for block in OcrBlock.select().order_by(OcrBlock.id)],
+                         [0, 1, 2, 0, 1, None, 0, 1])
+
+        with read_only():
+            self.assertEqual(search_document_ids(['binary']), {1, 2})
+            self.assertEqual(search_document_ids(['table']), {1})
+            self.assertEqual([(doc.name, page.number) for doc, page, _, _ in ranked_search(['heap'])],
+                             [('lecture 2', 0)])
+
+        # Deletes cascade once migrated
+        OcrDocument.get(OcrDocument.name == 'lecture 1').delete_document()
+        self.assertEqual(OcrPage.select().count(), 2)
+        self.assertEqual(OcrBlockFts.select().count(), 2)
+
+    def test_rerun_unversioned(self):
+        """Databases migrated by releases before SchemaVersion have no version, and go through every step again"""
+        create_tables()
+        db.connect()
+        pages = list(OcrPage.select().order_by(OcrPage.id).tuples())
+        blocks = list(OcrBlock.select().order_by(OcrBlock.id).tuples())
+        SchemaVersion.delete().execute()
+        migrate()
+
+        self.assertEqual(SchemaVersion.get().version, len(MIGRATIONS))
+        self.assertEqual(list(OcrPage.select().order_by(OcrPage.id).tuples()), pages)
+        self.assertEqual(list(OcrBlock.select().order_by(OcrBlock.id).tuples()), blocks)
+        self.assertEqual(OcrBlockFts.select().count(), len(blocks))
+        self.assertEqual(OcrPageFts.select().count(), 3)
+        self.assertEqual(OcrThumbnail.select().count(), len(DOCUMENTS))
+
+
+if __name__ == '__main__':
+    unittest.main()
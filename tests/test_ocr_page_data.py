@@ -0,0 +1,77 @@
+"""
+Round trip of OcrPageData through its npz serialize format, and pages serialized by older format versions
+
+Run from the repository folder: python -m pytest tests (or python -m unittest discover tests)
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))  # Include StudiOCR folder
+import io
+import unittest
+
+import numpy as np
+
+from StudiOCR.OcrPageData import OcrPageData
+
+# image_to_data output of a page: blank text pieces are dropped, empty ones kept
+IMAGE_TO_DATA = {'text': ['', 'binary', ' ', 'süß', 'tree', 'binary'],
+                 'left': [0, 10, 20, 30, 40, 50], 'top': [0, 1, 2, 3, 4, 5],
+                 'width': [100, 11, 12, 13, 14, 15], 'height': [50, 21, 22, 23, 24, 25],
+                 'conf': ['-1', '96.5', '-1', 80, 70, 60],
+                 'block_num': [1, 1, 1, 1, 2, 2], 'par_num': [0, 1, 1, 1, 1, 1],
+                 'line_num': [0, 1, 1, 1, 1, 1], 'word_num': [0, 1, 2, 3, 1, 2]}
+# Indexes of the pieces kept
+KEPT = [0, 1, 3, 4, 5]
+
+
+class OcrPageDataTest(unittest.TestCase):
+
+    def assert_page(self, page_data: OcrPageData, layout: bool = True):
+        self.assertEqual(page_data.words.tolist(), [IMAGE_TO_DATA['text'][index] for index in KEPT])
+        for key in ('left', 'top', 'width', 'height'):
+            self.assertEqual(getattr(page_data, key).tolist(), [IMAGE_TO_DATA[key][index] for index in KEPT])
+        self.assertEqual(page_data.conf.tolist(), [-1.0, 96.5, 80.0, 70.0, 60.0])
+        for key in OcrPageData.LAYOUT_KEYS:
+            expected = [IMAGE_TO_DATA[key][index] for index in KEPT] if layout else [0] * len(KEPT)
+            self.assertEqual(getattr(page_data, key).tolist(), expected)
+        self.assertEqual(page_data.text_counter['binary'], 2)
+        self.assertEqual(page_data.texts.tolist(), ['', 'binary', 'süß', 'tree'])
+        self.assertEqual(page_data.confidence_level['binary'], {96.5, 60.0})
+
+    def test_round_trip(self):
+        page_data = OcrPageData(IMAGE_TO_DATA)
+        self.assert_page(page_data)
+        self.assert_page(OcrPageData.deserialize(page_data.serialize()))
+
+    def test_no_pickles(self):
+        """Every column is a plain array, so loading a page never runs code stored with it"""
+        columns = np.load(io.BytesIO(OcrPageData(IMAGE_TO_DATA).serialize()), allow_pickle=False)
+        self.assertEqual(int(columns['version']), OcrPageData.FORMAT_VERSION)
+        self.assertTrue(all(columns[key].dtype != object for key in columns.files))
+
+    def test_from_columns(self):
+        columns = {key: [IMAGE_TO_DATA[key][index] for index in KEPT] for key in IMAGE_TO_DATA}
+        self.assert_page(OcrPageData.deserialize(OcrPageData.from_columns(columns).serialize()))
+        del columns['block_num']
+        self.assertEqual(OcrPageData.from_columns(columns).block_num.tolist(), [0] * len(KEPT))
+
+    def test_version_1(self):
+        """Pages serialized before the layout columns were kept read them as zeros"""
+        page_data = OcrPageData(IMAGE_TO_DATA)
+        output = io.BytesIO()
+        np.savez(output, version=np.array(1), **OcrPageData.text_table(page_data.words.tolist()),
+                 **{key: getattr(page_data, key) for key in ('left', 'top', 'width', 'height', 'conf')})
+        old_page_data = OcrPageData.deserialize(output.getvalue())
+        self.assert_page(old_page_data, layout=False)
+        # Serialized again at the current version, with the zeros
+        self.assert_page(OcrPageData.deserialize(old_page_data.serialize()), layout=False)
+
+    def test_newer_version(self):
+        output = io.BytesIO()
+        np.savez(output, version=np.array(OcrPageData.FORMAT_VERSION + 1))
+        with self.assertRaises(ValueError):
+            OcrPageData.deserialize(output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+Order in which PageScheduler hands out the pages of queued documents
+
+Run from the repository folder: python -m pytest tests (or python -m unittest discover tests)
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))  # Include StudiOCR folder
+import unittest
+
+from StudiOCR.PageScheduler import PageScheduler
+
+
+def hand_out(scheduler: PageScheduler, pages: int, done: bool = True) -> list:
+    """The next pages handed out, each processed before the next is asked for if done"""
+    handed_out = []
+    for _ in range(pages):
+        page = scheduler.next_page()
+        handed_out.append(page)
+        if done and page is not None:
+            scheduler.page_done(page[0])
+    return handed_out
+
+
+class ShortestJobFirstTest(unittest.TestCase):
+
+    def test_short_document_overtakes(self):
+        scheduler = PageScheduler(PageScheduler.SHORTEST_JOB_FIRST)
+        scheduler.add('long', 5)
+        self.assertEqual(hand_out(scheduler, 2), [('long', 0), ('long', 1)])
+        scheduler.add('short', 2)
+        self.assertEqual(hand_out(scheduler, 6),
+                         [('short', 0), ('short', 1), ('long', 2), ('long', 3), ('long', 4), None])
+        self.assertFalse(scheduler.has_pages())
+
+    def test_pages_in_flight_count(self):
+        """A job's pages still being processed count as left, so a job is not favoured for having handed them out"""
+        scheduler = PageScheduler(PageScheduler.SHORTEST_JOB_FIRST)
+        scheduler.add('a', 3)
+        scheduler.add('b', 3)
+        self.assertEqual(hand_out(scheduler, 4, done=False), [('a', 0), ('a', 1), ('a', 2), ('b', 0)])
+
+    def test_equal_jobs_by_arrival(self):
+        scheduler = PageScheduler(PageScheduler.SHORTEST_JOB_FIRST)
+        scheduler.add('first', 2)
+        scheduler.add('second', 2)
+        self.assertEqual(hand_out(scheduler, 4), [('first', 0), ('first', 1), ('second', 0), ('second', 1)])
+
+
+class FairShareTest(unittest.TestCase):
+
+    def test_turns(self):
+        scheduler = PageScheduler(PageScheduler.FAIR_SHARE)
+        scheduler.add('a', 3)
+        scheduler.add('b', 1)
+        scheduler.add('c', 2)
+        self.assertEqual(hand_out(scheduler, 7),
+                         [('a', 0), ('b', 0), ('c', 0), ('a', 1), ('c', 1), ('a', 2), None])
+
+    def test_fewest_in_flight(self):
+        scheduler = PageScheduler(PageScheduler.FAIR_SHARE)
+        scheduler.add('a', 4)
+        scheduler.add('b', 4)
+        self.assertEqual(hand_out(scheduler, 2, done=False), [('a', 0), ('b', 0)])
+        scheduler.page_done('b')
+        # b has no pages being processed, a still has one
+        self.assertEqual(hand_out(scheduler, 1, done=False), [('b', 1)])
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_priority_first(self):
+        for policy in PageScheduler.POLICIES:
+            scheduler = PageScheduler(policy)
+            scheduler.add('low', 1, PageScheduler.LOW)
+            scheduler.add('normal', 3)
+            scheduler.add('high', 2, PageScheduler.HIGH)
+            self.assertEqual(hand_out(scheduler, 6),
+                             [('high', 0), ('high', 1), ('normal', 0), ('normal', 1), ('normal', 2), ('low', 0)])
+
+    def test_ready_pages(self):
+        scheduler = PageScheduler()
+        scheduler.add('pdf', 3, ready=0)
+        self.assertFalse(scheduler.has_pages())
+        self.assertEqual(scheduler.next_page(), None)
+        scheduler.set_ready('pdf', 2)
+        self.assertEqual(hand_out(scheduler, 3), [('pdf', 0), ('pdf', 1), None])
+        # Pages are never made unready again
+        scheduler.set_ready('pdf', 1)
+        scheduler.set_ready('pdf', 3)
+        self.assertEqual(hand_out(scheduler, 2), [('pdf', 2), None])
+
+    def test_remove(self):
+        scheduler = PageScheduler()
+        scheduler.add('a', 2)
+        scheduler.add('b', 3)
+        scheduler.remove('a')
+        scheduler.page_done('a')
+        scheduler.set_ready('a', 5)
+        self.assertEqual(hand_out(scheduler, 4), [('b', 0), ('b', 1), ('b', 2), None])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            PageScheduler('fifo')
+        with self.assertRaises(ValueError):
+            PageScheduler().add('a', 1, priority=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
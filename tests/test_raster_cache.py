@@ -0,0 +1,119 @@
+"""
+Least recently used eviction of the RasterCache, and pages evicted before the OCR process reads them rendered again.
+pdftocairo is replaced by a fake writing the same small image for every page.
+
+Run from the repository folder: python -m pytest tests (or python -m unittest discover tests)
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))  # Include StudiOCR folder
+import io
+import tempfile
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+from StudiOCR.OcrEngine import OcrEngine, PageWork
+from StudiOCR.PdfToImage import PDFToImage
+from StudiOCR.RasterCache import RasterCache, raster_cache_db, set_raster_cache
+
+
+def page_image() -> bytes:
+    output = io.BytesIO()
+    Image.new('RGB', (60, 40), 'white').save(output, format='PNG')
+    return output.getvalue()
+
+
+class RasterCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.pdf = os.path.join(self.temp_dir.name, 'lecture.pdf')
+        with open(self.pdf, 'wb') as pdf_file:
+            pdf_file.write(b'%PDF-1.4 lecture')
+        self.image = page_image()
+        # Pages rasterized by each pdftocairo run
+        self.rasterized = []
+        patcher = mock.patch.object(PDFToImage, 'rasterize', side_effect=self.rasterize)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        raster_cache_db.shutdown()
+        set_raster_cache(None)
+        self.temp_dir.cleanup()
+
+    def rasterize(self, filepath, first_page, last_page, output_folder, dpi=PDFToImage.DPI, color=PDFToImage.COLOR):
+        self.rasterized.append(list(range(first_page, last_page + 1)))
+        images = []
+        for page in range(first_page, last_page + 1):
+            images.append(os.path.join(output_folder, f'page-{page:03}.png'))
+            with open(images[-1], 'wb') as image_file:
+                image_file.write(self.image)
+        return images
+
+    def cache(self, pages: int) -> RasterCache:
+        """A cache with room for the given number of pages"""
+        return RasterCache(os.path.join(self.temp_dir.name, 'raster_cache'), max_bytes=pages * len(self.image))
+
+    def test_cached(self):
+        cache = self.cache(10)
+        first = cache.pages(self.pdf, [1, 2, 3, 5])
+        self.assertEqual(self.rasterized, [[1, 2, 3], [5]])
+        # Only the pages missing are rasterized, in runs of consecutive pages
+        self.assertEqual(cache.pages(self.pdf, [2, 3, 4, 5]), first[1:3] + cache.pages(self.pdf, [4]) + first[3:])
+        self.assertEqual(self.rasterized, [[1, 2, 3], [5], [4]])
+        # A different rendering of the same page is another entry
+        cache.pages(self.pdf, [1], dpi=300)
+        self.assertEqual(self.rasterized[-1], [1])
+
+    def test_least_recently_used(self):
+        cache = self.cache(2)
+        page_1, = cache.pages(self.pdf, [1])
+        page_2, = cache.pages(self.pdf, [2])
+        # Using page 1 again makes page 2 the least recently used
+        cache.pages(self.pdf, [1])
+        page_3, = cache.pages(self.pdf, [3])
+        self.assertEqual([os.path.exists(page) for page in (page_1, page_2, page_3)], [True, False, True])
+        self.assertEqual(self.rasterized, [[1], [2], [3]])
+
+    def test_returned_pages_kept(self):
+        """The pages asked for stay, even past max_bytes, the least recently used others go"""
+        cache = self.cache(2)
+        page_9, = cache.pages(self.pdf, [9])
+        images = cache.pages(self.pdf, [1, 2, 3])
+        self.assertTrue(all(os.path.exists(image) for image in images))
+        self.assertFalse(os.path.exists(page_9))
+        self.assertEqual(cache.pages(self.pdf, [9]), [page_9])
+        self.assertEqual(self.rasterized, [[9], [1, 2, 3], [9]])
+
+    def test_removed_file(self):
+        cache = self.cache(10)
+        image, = cache.pages(self.pdf, [1])
+        os.remove(image)
+        self.assertEqual(cache.pages(self.pdf, [1]), [image])
+        self.assertTrue(os.path.exists(image))
+        self.assertEqual(self.rasterized, [[1], [1]])
+
+    def test_decode_evicted_page(self):
+        """A page evicted by another process between rasterizing and OCR is rendered again by the decode stage"""
+        cache = self.cache(10)
+        set_raster_cache(cache)
+        image, = cache.pages(self.pdf, [4], 150, PDFToImage.GRAY)
+        os.remove(image)
+        # Words known already, so the decode stage does not look the page up in the OCR cache
+        work = PageWork(0, image, page_data={'text': []}, pdf_page=(self.pdf, 4, 150, PDFToImage.GRAY))
+        work = OcrEngine.decode_page(work)
+        self.assertEqual(work.original_bytes, self.image)
+        self.assertEqual(work.image.shape, (40, 60, 3))
+        self.assertEqual(self.rasterized, [[4], [4]])
+
+        # Image files, not from a PDF, are not rendered again
+        os.remove(image)
+        with self.assertRaises(FileNotFoundError):
+            OcrEngine.decode_page(PageWork(0, image, page_data={'text': []}))
+
+
+if __name__ == '__main__':
+    unittest.main()